@@ -6,14 +6,22 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN, ADMIN_CHAT_IDS
+from config import BOT_TOKEN, ADMIN_CHAT_IDS, BOT_MODE
 from handlers import common, admin, shop, courier
 from storage.database import init_database, init_whitelist
+from storage.fsm_storage import JsonFileStorage
+from utils.outbound import outbound
+from utils.outbox import outbox_worker
+from utils.digest import admin_digest
+from utils.jobs import register_jobs
+from utils.scheduler import scheduler
+from utils.throttling import throttling
+from utils.webhook import WebhookServer
+from utils.workers import update_pool
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +46,11 @@ async def set_commands(bot: Bot):
         BotCommand(command="whitelist_add", description="Добавить пользователя в белый список"),
         BotCommand(command="whitelist_list", description="Показать пользователей в белом списке"),
         BotCommand(command="whitelist_remove", description="Удалить пользователя из белого списка"),
-        BotCommand(command="export_orders", description="Экспортировать заказы в Excel"),
+        BotCommand(command="export_orders", description="Экспортировать заказы (Excel, CSV, Parquet)"),
+        BotCommand(command="autoassign", description="Автоматически назначить ожидающие заказы"),
+        BotCommand(command="bundles", description="Заказы, сгруппированные по районам"),
+        BotCommand(command="load", description="Загрузка курьеров"),
+        BotCommand(command="stats", description="Состояние очереди сообщений"),
     ]
     
     # Устанавливаем команды для каждого администратора
@@ -56,7 +68,8 @@ async def start_bot():
         token=BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher(storage=MemoryStorage())
+    fsm_storage = JsonFileStorage()
+    dp = Dispatcher(storage=fsm_storage)
     
     # Initialize database and whitelist
     await init_database()
@@ -68,12 +81,36 @@ async def start_bot():
     shop.register_handlers(dp)
     courier.register_handlers(dp)
     
+    # Updates of one user are processed in order, different users in parallel
+    dp.update.outer_middleware(update_pool)
+    # Floods of messages and button presses are dropped before reaching handlers
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    
     # Set default commands
     await set_commands(bot)
     
+    # Start outbound message queue, notification outbox worker, FSM session sweeper and background jobs
+    outbound.start(bot)
+    outbox_worker.start()
+    fsm_storage.start_sweeper()
+    update_pool.start()
+    register_jobs()
+    scheduler.start()
+    
     try:
-        logger.info("Starting bot...")
-        # Start polling
-        await dp.start_polling(bot, skip_updates=True)
+        if BOT_MODE == "webhook":
+            logger.info("Starting bot in webhook mode...")
+            await WebhookServer(dp, bot).serve_forever()
+        else:
+            logger.info("Starting bot...")
+            # Start polling; updates are handed to the worker pool one by one
+            await dp.start_polling(bot, skip_updates=True, handle_as_tasks=False)
     finally:
+        await scheduler.stop()
+        await update_pool.stop()
+        admin_digest.flush()
+        await outbox_worker.stop()
+        await outbound.stop()
+        await fsm_storage.close()
         logger.info("Bot stopped!")
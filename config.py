@@ -18,9 +18,53 @@ ROLE_ADMIN = "admin"
 ROLE_SHOP = "shop"
 ROLE_COURIER = "courier"
 
+# How the bot receives updates: "polling" or "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+
+# Sharded processing of incoming updates
+UPDATE_WORKERS = 8        # parallel workers; updates of one user always go to the same worker
+UPDATE_QUEUE_SIZE = 100   # updates waiting per worker before reading new updates pauses
+
+# Anti-flood throttling: (requests per second, burst) for one user
+THROTTLE_ROLE_RATES = {
+    ROLE_ADMIN: (5, 20),
+    ROLE_SHOP: (2, 10),
+    ROLE_COURIER: (2, 10),
+    None: (1, 5),         # unregistered users
+}
+# Heavy commands get an additional limit per user: (requests per second, burst)
+THROTTLE_COMMAND_RATES = {
+    "/orders": (0.2, 3),
+    "📋 Список заказов": (0.2, 3),
+    "/myorders": (0.2, 3),
+    "📋 Мои заказы": (0.2, 3),
+    "/mydeliveries": (0.2, 3),
+    "🚚 Мои доставки": (0.2, 3),
+    "/report": (0.1, 2),
+    "📊 Отчет": (0.1, 2),
+    "/export_orders": (0.05, 1),
+    "/autoassign": (0.1, 2),
+}
+
+# Webhook mode settings
+WEBHOOK_HOST = "0.0.0.0"           # address the webhook server listens on
+WEBHOOK_PORT = int(os.environ.get("PORT", 8080))
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")        # public HTTPS base URL; empty for local testing
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # secret token; random on every start if empty
+WEBHOOK_DEDUP_SIZE = 10000         # number of recent update IDs remembered to skip repeats
+WEBHOOK_DRAIN_TIMEOUT = 30         # seconds to wait for updates in progress on shutdown
+
 # Database file path
 DATABASE_FILE = "storage/data.json"
 
+# FSM storage (unfinished forms survive restarts)
+FSM_STORAGE_FILE = "storage/fsm.json"
+FSM_FLUSH_INTERVAL = 2           # seconds between writes of changed FSM states to disk
+FSM_SESSION_TTL = 24 * 60 * 60   # unfinished forms are dropped after this many seconds
+FSM_MAX_SESSIONS = 10000         # oldest sessions are evicted above this number
+FSM_SWEEP_INTERVAL = 10 * 60     # seconds between checks for expired sessions
+
 # Whitelist configuration
 USE_WHITELIST = True  # Set to False to disable whitelist
 WHITELIST_FILE = "storage/whitelist.json"
@@ -28,8 +72,72 @@ WHITELIST_FILE = "storage/whitelist.json"
 # Default whitelisted users (always allowed, even if whitelist is enabled)
 WHITELISTED_USERS = list(ADMIN_CHAT_IDS)  # Admin IDs are always whitelisted
 
-# Report export directory
+# Report export (directory and streaming settings)
 REPORT_EXPORT_DIR = "reports"
+EXPORT_CHUNK_SIZE = 2000     # orders converted to rows and written per step of an export
+EXPORT_PROGRESS_INTERVAL = 2  # seconds between updates of the export progress message
+EXPORT_CACHE_FILE = "storage/export_cache.json"  # sent exports reused while orders are unchanged
+EXPORT_CACHE_SIZE = 100      # cached exports (different formats and filters) remembered
+EXPORT_MAX_AGE_DAYS = 7      # export files older than this are deleted
+EXPORT_MAX_TOTAL_MB = 200    # oldest export files are deleted above this total size
+
+# Background jobs (cron expressions "minute hour day month weekday" in Dushanbe time)
+SCHEDULER_STATE_FILE = "storage/scheduler.json"  # next run times of jobs survive restarts
+EXPORT_CLEANUP_SCHEDULE = "30 3 * * *"           # deletion of old export files
+PENDING_REMINDER_ENABLED = True                  # remind admins of pending orders when working hours start
+
+# Outbound message queue (Telegram Bot API limits)
+OUTBOUND_GLOBAL_RATE = 30            # messages per second for the whole bot
+OUTBOUND_CHAT_RATE = 1               # messages per second for one private chat
+OUTBOUND_GROUP_RATE_PER_MINUTE = 20  # messages per minute for one group chat
+OUTBOUND_MAX_RETRIES = 5             # retries for network and server errors
+OUTBOUND_MAX_QUEUE_SIZE = 10000      # messages above this limit are dropped
+
+# Persistent notification outbox
+OUTBOX_POLL_INTERVAL = 2     # seconds between outbox checks
+OUTBOX_MAX_ATTEMPTS = 10     # entries are dropped after this many failed attempts
+OUTBOX_RETRY_DELAY = 30      # base delay in seconds before retrying a failed entry
+
+# Live order cards edited in place on status changes
+LIVE_CARDS_MAX_ORDERS = 2000  # orders whose card messages are remembered
+
+# Digest mode for admin new-order notifications
+ADMIN_DIGEST_ENABLED = True          # Set to False to always notify immediately
+ADMIN_DIGEST_INTERVAL = 60           # seconds to collect orders into one digest
+ADMIN_DIGEST_MAX_ORDERS = 10         # digest is sent early when it reaches this size
+ADMIN_DIGEST_BURST_THRESHOLD = 3     # orders per interval that switch on digest mode
+
+# Automatic courier assignment
+AUTO_ASSIGN_MODE = "suggest"   # "off", "suggest" (one-tap button for admins) or "auto"
+AUTO_ASSIGN_MAX_ACTIVE = 5     # couriers with this many active orders get no new ones
+AUTO_ASSIGN_CITY_BONUS = 2     # a courier working only in the order's city counts as this many orders less
+AUTO_ASSIGN_HISTORY = 30       # recent orders of a courier used for city and delivery speed
+AUTO_ASSIGN_BATCH_SIZE = 50    # pending orders planned by one /autoassign
+
+# Grouping of pending orders by city and area
+BUNDLE_MIN_ORDERS = 2      # orders to one area needed to show them as a group
+BUNDLES_LIMIT = 10         # largest groups listed in the admin view
+BUNDLE_ASSIGN_LIMIT = 15   # orders of a group shown and assigned at once
+
+# Number of orders on one page of the admin order browser
+ORDERS_PAGE_SIZE = 5
+
+# Number of couriers on one page of the courier picker
+COURIERS_PAGE_SIZE = 8
+
+# Number of completed deliveries on one page of the courier history
+DELIVERY_HISTORY_PAGE_SIZE = 5
+
+# Number of rows in a report breakdown by courier, shop or city
+REPORT_BREAKDOWN_LIMIT = 20
+
+# Daily summary for admins at the end of working hours
+DAILY_REPORT_ENABLED = True                       # send the day's summary to admins
+DAILY_REPORTS_FILE = "storage/daily_reports.json"  # saved numbers of closed days for /report
+DAILY_REPORTS_KEPT = 400                          # most recent closed days kept in the file
+
+# Maximum number of rendered order cards kept in memory
+ORDER_CARD_CACHE_SIZE = 2000
 
 def add_user_to_whitelist(user_id):
     """Utility function to add a user ID to the whitelist"""
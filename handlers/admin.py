@@ -2,27 +2,49 @@
 Handlers for admin users.
 This module contains handlers for admin-specific commands and functions.
 """
+import html
 import logging
 import re
-from utils.timezone import get_date_dushanbe, get_yesterday_date
+from typing import List, Optional, Tuple
 from aiogram import Router, F
-from aiogram.types import Message
-from aiogram.filters import Command, StateFilter
+from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
 
-from config import ROLE_ADMIN, ADMIN_CHAT_IDS
+from config import (
+    ROLE_ADMIN, ROLE_COURIER, ADMIN_CHAT_IDS, ORDERS_PAGE_SIZE, COURIERS_PAGE_SIZE, AUTO_ASSIGN_MODE,
+    BUNDLE_MIN_ORDERS, BUNDLES_LIMIT, BUNDLE_ASSIGN_LIMIT
+)
 from keyboards.admin_kb import (
-    get_admin_main_keyboard, get_couriers_keyboard,
+    get_admin_main_keyboard, get_couriers_keyboard, get_orders_page_keyboard,
+    get_orders_back_keyboard,
     get_courier_management_keyboard, get_shop_management_keyboard,
-    get_couriers_list_keyboard, get_shops_list_keyboard
+    get_couriers_list_keyboard, get_shops_list_keyboard, get_autoassign_keyboard,
+    get_bundles_keyboard, get_bundle_couriers_keyboard, get_report_keyboard
 )
 from storage.database import (
-    get_user_role, get_pending_orders, get_order_by_id, 
-    assign_order_to_courier, get_couriers, get_all_orders,
-    get_delivered_orders_in_timeframe, get_all_shops, get_all_couriers,
-    delete_user, check_user_has_orders
+    get_user_role, get_user_by_id, get_pending_orders_page, get_order_by_id, 
+    get_couriers, search_couriers, get_active_order_counts,
+    get_all_shops, get_all_couriers,
+    delete_user, check_user_has_orders, get_courier_workload, get_pending_bundles, get_bundle_orders
+)
+from storage.indexes import orders_fingerprint
+from utils.outbound import outbound
+from utils.assignment import (
+    assign_order, assign_orders, format_courier_name, suggest_courier, plan_pending_orders
+)
+from utils.chunker import send_chunked
+from utils.cards import render_order_card, card_cache, format_payment
+from utils.reports import (
+    BREAKDOWNS, PERIODS, make_request as make_report_request, parse_report_args, render_report,
+    report_engine
 )
+from utils.throttling import throttling
+from utils.scheduler import scheduler
+from utils.workers import update_pool
 
 logger = logging.getLogger(__name__)
 
@@ -30,19 +52,17 @@ logger = logging.getLogger(__name__)
 router = Router()
 
 
-class AssignOrderForm(StatesGroup):
-    """States for order assignment process"""
-    waiting_for_order_id = State()
-    waiting_for_courier = State()
-
-
 class UserManagementForm(StatesGroup):
     """States for user management process"""
-    waiting_for_courier_deletion = State()
     waiting_for_shop_deletion = State()
     confirm_deletion = State()
 
 
+class CourierSearchForm(StatesGroup):
+    """States for courier search in the assignment picker"""
+    waiting_for_query = State()
+
+
 async def admin_access_required(message: Message):
     """Check if user has admin role"""
     user_id = message.from_user.id
@@ -50,6 +70,34 @@ async def admin_access_required(message: Message):
     return role == ROLE_ADMIN
 
 
+async def render_pending_orders_page(page: int):
+    """
+    Render one page of pending orders
+    
+    Returns:
+        Message text and inline keyboard, or (None, None) if there are no pending orders
+    """
+    orders, total = await get_pending_orders_page(page, ORDERS_PAGE_SIZE)
+    
+    if total == 0:
+        return None, None
+    
+    total_pages = (total + ORDERS_PAGE_SIZE - 1) // ORDERS_PAGE_SIZE
+    if page >= total_pages:
+        # Заказов стало меньше, пока страница была открыта
+        page = total_pages - 1
+        orders, total = await get_pending_orders_page(page, ORDERS_PAGE_SIZE)
+    
+    response = f"📋 <b>Заказы в ожидании</b> (всего: {total})\n\n"
+    for order in orders:
+        response += render_order_card(order, "admin")
+    
+    response += "Нажмите <b>📮 Назначить</b> под заказом, чтобы выбрать курьера."
+    return response, await get_orders_page_keyboard(
+        page, total_pages, [order['id'] for order in orders]
+    )
+
+
 @router.message(Command("orders"))
 @router.message(F.text == "📋 Список заказов")
 async def cmd_view_orders(message: Message):
@@ -58,32 +106,43 @@ async def cmd_view_orders(message: Message):
         await message.answer("Эта команда доступна только администраторам.")
         return
     
-    orders = await get_pending_orders()
+    response, orders_kb = await render_pending_orders_page(0)
     
-    if not orders:
+    if not response:
         await message.answer(
             "На данный момент нет заказов в ожидании.",
             reply_markup=await get_admin_main_keyboard()
         )
         return
     
-    response = "📋 <b>Заказы в ожидании:</b>\n\n"
-    for order in orders:
-        # Форматируем сумму оплаты
-        payment_amount = order.get('payment_amount', 0)
-        payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-        
-        response += (
-            f"Заказ <b>#{order['id']}</b>\n"
-            f"🏪 Магазин: {order['shop_name']}\n"
-            f"📱 Клиент: {order['customer_phone']}\n"
-            f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-            f"💰 Сумма к оплате: {payment_formatted} сомони\n"
-            f"🔄 Статус: {order['status'].capitalize()}\n\n"
-        )
+    await message.answer(response, reply_markup=orders_kb)
+
+
+@router.callback_query(F.data.startswith("orders:"))
+async def orders_page_callback(callback_query: CallbackQuery):
+    """Handle page switching in the pending orders browser"""
+    await callback_query.answer()
     
-    response += "Используйте кнопку '📮 Назначить заказ' чтобы назначить заказ курьеру."
-    await message.answer(response, reply_markup=await get_admin_main_keyboard())
+    if not await admin_access_required(callback_query):
+        return
+    
+    # Format: "orders:page:2" or "orders:noop"
+    data_parts = callback_query.data.split(":")
+    if len(data_parts) != 3 or data_parts[1] != "page":
+        return
+    
+    page = max(int(data_parts[2]), 0)
+    response, orders_kb = await render_pending_orders_page(page)
+    
+    if not response:
+        response = "На данный момент нет заказов в ожидании."
+    
+    try:
+        await callback_query.message.edit_text(response, reply_markup=orders_kb)
+    except TelegramBadRequest as e:
+        # Страница не изменилась с момента последнего показа
+        if "message is not modified" not in str(e):
+            raise
 
 
 @router.message(Command("assign"), StateFilter("*"))
@@ -96,183 +155,433 @@ async def cmd_assign_order(message: Message, state: FSMContext):
     
     await state.clear()
     
-    # Get pending orders
-    orders = await get_pending_orders()
+    # Show the first page of pending orders with assign buttons
+    response, orders_kb = await render_pending_orders_page(0)
     
-    if not orders:
+    if not response:
         await message.answer(
             "Нет заказов для назначения.",
             reply_markup=await get_admin_main_keyboard()
         )
         return
     
-    # Display orders for selection
-    response = "Выберите заказ для назначения, отправив его номер (ID):\n\n"
-    for order in orders:
-        # Форматируем сумму оплаты
-        payment_amount = order.get('payment_amount', 0)
-        payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-        
-        response += (
-            f"Заказ <b>#{order['id']}</b>\n"
-            f"🏪 Магазин: {order['shop_name']}\n"
-            f"📱 Клиент: {order['customer_phone']}\n"
-            f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-            f"💰 Сумма к оплате: {payment_formatted} сомони\n\n"
-        )
+    await message.answer(response, reply_markup=orders_kb)
+
+
+async def render_courier_picker(order, page: int = 0, query: str = ""):
+    """
+    Render one page of the courier picker for an order
+    
+    Returns:
+        Message text and inline keyboard, or (None, None) if no couriers are registered
+    """
+    couriers, total = await search_couriers(query, page, COURIERS_PAGE_SIZE)
+    if not total and not query:
+        return None, None
+    
+    # Если страница вышла за пределы (курьеров стало меньше), показываем последнюю
+    total_pages = max((total + COURIERS_PAGE_SIZE - 1) // COURIERS_PAGE_SIZE, 1)
+    if page >= total_pages:
+        page = total_pages - 1
+        couriers, total = await search_couriers(query, page, COURIERS_PAGE_SIZE)
+    
+    order_id = order['id']
+    text = render_order_card(order, "picker")
+    if query:
+        text += f"🔍 Поиск: <b>{html.escape(query)}</b> — найдено: {total}\n"
+    if total:
+        text += "Выберите курьера (число — активные заказы):"
+    else:
+        text += "Курьеры не найдены. Измените или сбросьте поиск."
+    
+    # Рекомендованный курьер показывается первой кнопкой на первой странице
+    suggested = None
+    if AUTO_ASSIGN_MODE != "off" and page == 0 and not query:
+        suggested = await suggest_courier(order)
     
-    await message.answer(response)
-    await state.set_state(AssignOrderForm.waiting_for_order_id)
+    keyboard = await get_couriers_keyboard(
+        couriers, order_id, await get_active_order_counts(), page, total_pages, query, suggested
+    )
+    return text, keyboard
 
 
-@router.message(AssignOrderForm.waiting_for_order_id)
-async def process_order_id_selection(message: Message, state: FSMContext):
-    """Process order ID selection for assignment"""
-    # Обработка отмены операции
-    if message.text.lower() in ["отмена", "cancel", "отменить"]:
-        await message.answer(
-            "Операция назначения заказа отменена.",
-            reply_markup=await get_admin_main_keyboard()
-        )
-        await state.clear()
+async def get_picker_query(state: FSMContext, order_id: int) -> str:
+    """Return the courier search query saved for the picker of this order"""
+    data = await state.get_data()
+    if data.get("search_order_id") != order_id:
+        return ""
+    return data.get("search_query", "")
+
+
+@router.callback_query(F.data.startswith("as:"))
+async def assign_order_callback(callback_query: CallbackQuery, state: FSMContext):
+    """
+    Handle the inline courier picker:
+    "as:o:<order>" opens it, "as:p:<order>:<page>" pages, "as:s:<order>" starts a search,
+    "as:x:<order>" resets the search, "as:c:<order>:<courier>" assigns
+    """
+    if not await admin_access_required(callback_query):
+        await callback_query.answer("Эта команда доступна только администраторам.")
         return
     
-    try:
-        order_id = int(message.text)
-        order = await get_order_by_id(order_id)
-        
-        if not order:
-            await message.answer(
-                "Заказ не найден. Пожалуйста, введите правильный номер заказа или отправьте 'отмена' для возврата в меню."
-            )
-            return
+    data_parts = callback_query.data.split(":")
+    if len(data_parts) < 3:
+        await callback_query.answer("Неверные данные обратного вызова")
+        return
+    
+    action = data_parts[1]
+    order_id = int(data_parts[2])
+    
+    if action == "n":
+        await callback_query.answer()
+        return
+    
+    order = await get_order_by_id(order_id)
+    
+    if not order or order['status'] != 'pending':
+        await callback_query.answer("Заказ уже назначен или не найден.", show_alert=True)
+        return
+    
+    if action in ("o", "p", "x"):
+        page = 0
+        if action == "o" or action == "x":
+            await state.update_data(search_order_id=order_id, search_query="")
+            query = ""
+        else:
+            page = int(data_parts[3]) if len(data_parts) == 4 else 0
+            query = await get_picker_query(state, order_id)
         
-        if order['status'] != 'pending':
-            await message.answer(
-                f"Заказ #{order_id} уже {order['status']}. Пожалуйста, выберите заказ в статусе ожидания или отправьте 'отмена'."
+        text, keyboard = await render_courier_picker(order, page, query)
+        if text is None:
+            await callback_query.answer(
+                "Нет зарегистрированных курьеров. Пожалуйста, попросите курьеров зарегистрироваться.",
+                show_alert=True
             )
             return
         
-        # Save order ID in state
-        await state.update_data(order_id=order_id)
-        
-        # Get couriers for selection
-        couriers = await get_couriers()
+        await callback_query.answer()
+        try:
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            # Повторное нажатие на ту же страницу не меняет сообщение
+            if "message is not modified" not in str(e):
+                raise
+    
+    elif action == "s":
+        await state.set_state(CourierSearchForm.waiting_for_query)
+        await state.update_data(
+            search_order_id=order_id,
+            picker_chat_id=callback_query.message.chat.id,
+            picker_message_id=callback_query.message.message_id
+        )
+        await callback_query.answer()
+        await callback_query.message.answer(
+            "🔍 Введите начало имени или номера телефона курьера:"
+        )
+    
+    elif action == "c" and len(data_parts) == 4:
+        courier = await get_user_by_id(int(data_parts[3]))
         
-        if not couriers:
-            await message.answer(
-                "Нет зарегистрированных курьеров. Пожалуйста, попросите курьеров зарегистрироваться.",
-                reply_markup=await get_admin_main_keyboard()
-            )
-            await state.clear()
+        if not courier or courier['role'] != ROLE_COURIER:
+            await callback_query.answer("Курьер не найден.", show_alert=True)
             return
         
-        # Display order details and courier selection keyboard
-        courier_kb = await get_couriers_keyboard(couriers)
-        
-        # Форматируем сумму оплаты
-        payment_amount = order.get('payment_amount', 0)
-        payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
+        if not await assign_order(order, courier, callback_query.message):
+            await callback_query.answer("Не удалось назначить заказ. Возможно, он уже назначен.", show_alert=True)
+            return
         
-        await message.answer(
-            f"<b>Назначение заказа #{order_id}</b>\n\n"
-            f"🏪 Магазин: {order['shop_name']}\n"
-            f"📱 Клиент: {order['customer_phone']}\n"
-            f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-            f"💰 Сумма к оплате: {payment_formatted} сомони\n\n"
-            "Выберите курьера:",
-            reply_markup=courier_kb
+        courier_name = format_courier_name(courier)
+        await callback_query.answer(f"Заказ #{order_id} назначен")
+        await callback_query.message.edit_text(
+            f"✅ Заказ #{order_id} назначен курьеру {courier_name}.",
+            reply_markup=await get_orders_back_keyboard()
         )
-        
-        await state.set_state(AssignOrderForm.waiting_for_courier)
-        
-    except ValueError:
-        await message.answer("Пожалуйста, введите корректный номер заказа (только цифры).")
+    
+    else:
+        await callback_query.answer("Неверные данные обратного вызова")
 
 
-@router.message(AssignOrderForm.waiting_for_courier)
-async def process_courier_selection(message: Message, state: FSMContext):
-    """Process courier selection for order assignment"""
-    # Check if the user wants to cancel
-    if message.text == "❌ Отмена":
-        await message.answer(
-            "Операция отменена.",
-            reply_markup=await get_admin_main_keyboard()
-        )
+@router.message(CourierSearchForm.waiting_for_query)
+async def process_courier_search(message: Message, state: FSMContext):
+    """Handler for the courier search query; updates the picker message in place"""
+    if not await admin_access_required(message):
+        await message.answer("Эта команда доступна только администраторам.")
         await state.clear()
         return
     
-    courier_data = message.text.split(": ")
-    
-    if len(courier_data) != 2:
-        await message.answer("Пожалуйста, выберите курьера из списка.")
+    query = (message.text or "").strip()
+    if not query:
+        await message.answer("Пожалуйста, введите имя или номер телефона курьера.")
         return
     
-    courier_name = courier_data[0]
-    courier_id = int(courier_data[1])
-    
-    # Get order ID from state
     data = await state.get_data()
-    order_id = data.get('order_id')
+    order_id = data.get("search_order_id")
     
-    # Get order details
-    order = await get_order_by_id(order_id)
+    # Выходим из состояния поиска, но сохраняем запрос для перелистывания страниц
+    await state.set_state(None)
+    await state.update_data(search_query=query)
     
-    if not order:
-        await message.answer(
-            "Заказ не найден. Операция отменена.",
-            reply_markup=await get_admin_main_keyboard()
-        )
-        await state.clear()
+    order = await get_order_by_id(order_id) if order_id else None
+    if not order or order['status'] != 'pending':
+        await message.answer("Заказ уже назначен или не найден.")
         return
     
-    # Assign order to courier
-    success = await assign_order_to_courier(order_id, courier_id, courier_name)
+    text, keyboard = await render_courier_picker(order, 0, query)
+    if text is None:
+        await message.answer("Нет зарегистрированных курьеров.")
+        return
     
-    if not success:
+    try:
+        await message.bot.edit_message_text(
+            text,
+            chat_id=data["picker_chat_id"],
+            message_id=data["picker_message_id"],
+            reply_markup=keyboard
+        )
+    except TelegramBadRequest:
+        # Исходное сообщение могло быть удалено — показываем результаты новым сообщением
+        await message.answer(text, reply_markup=keyboard)
+
+
+def render_assignment_plan(plan, total: int) -> Tuple[str, List[str]]:
+    """
+    Render the list of proposed assignments
+    
+    Returns:
+        Header and one line per assignment, to be sent with send_chunked()
+    """
+    header = f"⚡ <b>Автоназначение</b> (заказов в ожидании: {total})\n\n"
+    lines = [
+        f"#{order['id']} • {html.escape(order['city'])} → {html.escape(format_courier_name(courier))}\n"
+        for order, courier in plan
+    ]
+    
+    if len(plan) < total:
+        lines.append(f"\nБез курьера останется заказов: {total - len(plan)}\n")
+    return header, lines
+
+
+@router.message(Command("autoassign"))
+async def cmd_autoassign(message: Message, state: FSMContext):
+    """Handler for /autoassign command to assign pending orders in one batch"""
+    if not await admin_access_required(message):
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+    
+    plan, total = await plan_pending_orders()
+    if not total:
+        await message.answer("Нет заказов для назначения.", reply_markup=await get_admin_main_keyboard())
+        return
+    if not plan:
         await message.answer(
-            "Не удалось назначить заказ. Пожалуйста, попробуйте еще раз.",
+            "Нет свободных курьеров: у всех достигнут лимит активных заказов.",
             reply_markup=await get_admin_main_keyboard()
         )
-        await state.clear()
         return
     
-    await message.answer(
-        f"Заказ #{order_id} назначен курьеру {courier_name}.",
-        reply_markup=await get_admin_main_keyboard()
+    # В автоматическом режиме назначаем сразу, иначе ждем подтверждения
+    # Список может не поместиться в одно сообщение; кнопки остаются под последним
+    header, lines = render_assignment_plan(plan, total)
+    if AUTO_ASSIGN_MODE == "auto":
+        assigned = await assign_orders(plan)
+        send_chunked(
+            message.chat.id,
+            lines + [f"\n✅ Назначено заказов: {len(assigned)}"],
+            header=header,
+            reply_markup=await get_admin_main_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    
+    await state.update_data(autoassign_plan=[[order['id'], courier['id']] for order, courier in plan])
+    send_chunked(
+        message.chat.id,
+        lines + ["\nНазначить все заказы по этому списку?"],
+        header=header,
+        reply_markup=await get_autoassign_keyboard(),
+        parse_mode="HTML"
     )
+
+
+@router.callback_query(F.data.startswith("aa:"))
+async def autoassign_callback(callback_query: CallbackQuery, state: FSMContext):
+    """Handle confirmation ("aa:ok") or cancellation ("aa:x") of a batch assignment"""
+    if not await admin_access_required(callback_query):
+        await callback_query.answer("Эта команда доступна только администраторам.")
+        return
     
-    # Notify courier about the new assignment
-    bot = message.bot
+    data = await state.get_data()
+    saved_plan = data.get("autoassign_plan")
+    await state.update_data(autoassign_plan=None)
     
-    # Форматируем сумму оплаты для уведомления
-    payment_amount = order.get('payment_amount', 0)
-    payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
+    if callback_query.data == "aa:x" or not saved_plan:
+        await callback_query.answer()
+        await callback_query.message.edit_text("Автоназначение отменено." if saved_plan else "Список устарел.")
+        return
     
-    courier_notification = (
-        f"📦 <b>Новое назначение доставки - Заказ #{order_id}</b>\n\n"
-        f"📱 Телефон клиента: {order['customer_phone']}\n"
-        f"🏙️ Город: {order['city']}\n"
-        f"🏪 Магазин: {order['shop_name']}\n"
-        f"📍 Адрес доставки: {order['delivery_address']}\n"
-        f"💰 Сумма к оплате: {payment_formatted} сомони"
+    # Пока список ждал подтверждения, заказы могли назначить вручную, а курьеров — удалить
+    plan = []
+    for order_id, courier_id in saved_plan:
+        order = await get_order_by_id(order_id)
+        courier = await get_user_by_id(courier_id)
+        if order and order['status'] == 'pending' and courier and courier['role'] == ROLE_COURIER:
+            plan.append((order, courier))
+    
+    assigned = await assign_orders(plan)
+    await callback_query.answer(f"Назначено заказов: {len(assigned)}")
+    await callback_query.message.edit_text(
+        f"✅ Назначено заказов: {len(assigned)} из {len(saved_plan)}.",
+        reply_markup=await get_orders_back_keyboard()
     )
-    
-    try:
-        # Send notification to courier with delivery details and buttons
-        from keyboards.courier_kb import get_delivery_confirmation_keyboard
-        await bot.send_message(
-            courier_id,
-            courier_notification,
-            reply_markup=await get_delivery_confirmation_keyboard(order_id),
-            parse_mode="HTML"
+
+
+async def render_bundles():
+    """
+    Render the list of pending order groups
+    
+    Returns:
+        Message text and inline keyboard (None if there are no groups)
+    """
+    bundles = (await get_pending_bundles(BUNDLE_MIN_ORDERS))[:BUNDLES_LIMIT]
+    if not bundles:
+        return (
+            "📦 Нет групп заказов: в каждый район ожидается не больше одного заказа.",
+            await get_orders_back_keyboard()
         )
-        logger.info(f"Telegram notification sent to courier {courier_id}")
-    except Exception as e:
-        logger.error(f"Failed to notify courier {courier_id}: {e}")
-        await message.answer(f"Предупреждение: Не удалось уведомить курьера о назначении.")
     
-    await state.clear()
+    response = "📦 <b>Группы заказов по районам</b>\n\n"
+    for number, bundle in enumerate(bundles, start=1):
+        orders = bundle['orders']
+        title = html.escape(orders[0]['city'])
+        if bundle['area']:
+            title += f", {html.escape(bundle['area'].capitalize())}"
+        order_ids = ", ".join(f"#{order['id']}" for order in orders[:BUNDLE_ASSIGN_LIMIT])
+        if len(orders) > BUNDLE_ASSIGN_LIMIT:
+            order_ids += f" и еще {len(orders) - BUNDLE_ASSIGN_LIMIT}"
+        response += f"<b>{number}. {title}</b> — заказов: {len(orders)}\n{order_ids}\n\n"
+    
+    response += "Нажмите на группу, чтобы назначить все ее заказы одному курьеру."
+    return response, await get_bundles_keyboard(bundles)
+
+
+async def render_bundle_picker(bundle_id: str, orders, page: int = 0):
+    """
+    Render one page of the courier picker for a group of orders
+    
+    Only the first BUNDLE_ASSIGN_LIMIT orders are shown, one line each, and only
+    they are assigned, so the message stays within the Telegram limit.
+    """
+    couriers, total = await search_couriers("", page, COURIERS_PAGE_SIZE)
+    total_pages = max((total + COURIERS_PAGE_SIZE - 1) // COURIERS_PAGE_SIZE, 1)
+    if page >= total_pages:
+        page = total_pages - 1
+        couriers, total = await search_couriers("", page, COURIERS_PAGE_SIZE)
+    
+    shown = orders[:BUNDLE_ASSIGN_LIMIT]
+    text = f"<b>Назначение группы из {len(shown)} заказов</b>\n\n"
+    text += "\n".join(render_order_card(order, "summary") for order in shown) + "\n\n"
+    if len(orders) > len(shown):
+        text += f"Остальные {len(orders) - len(shown)} заказов группы останутся в ожидании.\n\n"
+    text += "Выберите курьера (число — активные заказы):"
+    
+    keyboard = await get_bundle_couriers_keyboard(
+        couriers, bundle_id, orders_fingerprint(shown), await get_active_order_counts(), page, total_pages
+    )
+    return text, keyboard
+
+
+@router.message(Command("bundles"))
+async def cmd_bundles(message: Message):
+    """Handler for /bundles command to view pending orders grouped by area"""
+    if not await admin_access_required(message):
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+    
+    response, keyboard = await render_bundles()
+    await message.answer(response, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("bd:"))
+async def bundles_callback(callback_query: CallbackQuery):
+    """
+    Handle order groups:
+    "bd:l" lists groups, "bd:o:<group>" opens the courier picker, "bd:p:<group>:<page>" pages,
+    "bd:c:<group>:<courier>:<fingerprint>" assigns the group if it still has the shown orders
+    """
+    if not await admin_access_required(callback_query):
+        await callback_query.answer("Эта команда доступна только администраторам.")
+        return
+    
+    data_parts = callback_query.data.split(":")
+    action = data_parts[1] if len(data_parts) > 1 else ""
+    
+    if action == "n":
+        await callback_query.answer()
+        return
+    
+    if action == "l":
+        await callback_query.answer()
+        response, keyboard = await render_bundles()
+        try:
+            await callback_query.message.edit_text(response, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        return
+    
+    if len(data_parts) < 3 or action not in ("o", "p", "c"):
+        await callback_query.answer("Неверные данные обратного вызова")
+        return
+    
+    bundle_id = data_parts[2]
+    orders = await get_bundle_orders(bundle_id)
+    if not orders:
+        await callback_query.answer("Заказы этой группы уже назначены.", show_alert=True)
+        return
+    
+    if action in ("o", "p"):
+        page = int(data_parts[3]) if action == "p" and len(data_parts) == 4 else 0
+        text, keyboard = await render_bundle_picker(bundle_id, orders, page)
+        await callback_query.answer()
+        try:
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        return
+    
+    # Назначаются только заказы, которые администратор видел в списке; если группа
+    # изменилась (новые или уже назначенные заказы), показываем ее заново
+    shown = orders[:BUNDLE_ASSIGN_LIMIT]
+    if len(data_parts) != 5 or data_parts[4] != orders_fingerprint(shown):
+        await callback_query.answer("Состав группы изменился, проверьте заказы еще раз.", show_alert=True)
+        text, keyboard = await render_bundle_picker(bundle_id, orders)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+        return
+    
+    courier = await get_user_by_id(int(data_parts[3]))
+    if not courier or courier['role'] != ROLE_COURIER:
+        await callback_query.answer("Курьер не найден.", show_alert=True)
+        return
+    
+    # Все заказы группы назначаются одной записью в базу
+    assigned = await assign_orders([(order, courier) for order in shown])
+    order_ids = ", ".join(f"#{order_id}" for order_id in assigned)
+    await callback_query.answer(f"Назначено заказов: {len(assigned)}")
+    await callback_query.message.edit_text(
+        f"✅ Курьеру {format_courier_name(courier)} назначено заказов: {len(assigned)} ({order_ids}).",
+        reply_markup=await get_orders_back_keyboard()
+    )
+
+
+def render_user_card(user) -> str:
+    """Render a courier or shop entry of a user list"""
+    # Разделяем имя и телефон (формат: "Имя | Телефон")
+    user_info = user['username'].split(" | ")
+    user_name = user_info[0] if len(user_info) > 0 else "Неизвестно"
+    user_phone = user_info[1] if len(user_info) > 1 else "Нет телефона"
+    
+    return f"• <b>{user_name}</b>\n  📱 Телефон: {user_phone}\n  🆔 ID: {user['id']}\n\n"
 
 
 @router.message(Command("couriers"))
@@ -291,16 +600,13 @@ async def cmd_view_couriers(message: Message):
         )
         return
     
-    response = "📋 <b>Зарегистрированные курьеры:</b>\n\n"
-    for courier in couriers:
-        # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
-        courier_info = courier['username'].split(" | ")
-        courier_name = courier_info[0] if len(courier_info) > 0 else "Неизвестно"
-        courier_phone = courier_info[1] if len(courier_info) > 1 else "Нет телефона"
-        
-        response += f"• <b>{courier_name}</b>\n  📱 Телефон: {courier_phone}\n  🆔 ID: {courier['id']}\n\n"
-    
-    await message.answer(response, reply_markup=await get_admin_main_keyboard(), parse_mode="HTML")
+    send_chunked(
+        message.chat.id,
+        (render_user_card(courier) for courier in couriers),
+        header="📋 <b>Зарегистрированные курьеры:</b>\n\n",
+        reply_markup=await get_admin_main_keyboard(),
+        parse_mode="HTML"
+    )
 
 
 @router.message(F.text == "👥 Управление пользователями")
@@ -354,6 +660,50 @@ async def cmd_back_to_main_menu(message: Message, state: FSMContext):
     )
 
 
+def render_courier_load(entry) -> str:
+    """Render one courier line of the workload view"""
+    courier_name = entry['courier']['username'].split(" | ")[0]
+    return (
+        f"• <b>{html.escape(courier_name)}</b>: 🚚 {entry['active']} · "
+        f"✅ {entry['delivered']} · 💰 {format_payment(entry['cash'])}\n"
+    )
+
+
+@router.message(Command("load"))
+@router.message(F.text == "📊 Загрузка курьеров")
+async def cmd_courier_load(message: Message):
+    """Handler for /load command to show active orders, deliveries today and cash per courier"""
+    if not await admin_access_required(message):
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+    
+    workload = await get_courier_workload()
+    if not workload:
+        await message.answer(
+            "Пока нет зарегистрированных курьеров.",
+            reply_markup=await get_courier_management_keyboard()
+        )
+        return
+    
+    # Самые загруженные курьеры сверху
+    workload.sort(key=lambda entry: (-entry['active'], -entry['cash'], -entry['delivered']))
+    total_active = sum(entry['active'] for entry in workload)
+    total_delivered = sum(entry['delivered'] for entry in workload)
+    total_cash = sum(entry['cash'] for entry in workload)
+    
+    send_chunked(
+        message.chat.id,
+        (render_courier_load(entry) for entry in workload),
+        header=(
+            "📊 <b>Загрузка курьеров</b>\n"
+            "🚚 активные заказы · ✅ доставлено сегодня · 💰 к получению, сомони\n\n"
+            f"Всего: 🚚 {total_active} · ✅ {total_delivered} · 💰 {format_payment(total_cash)}\n\n"
+        ),
+        reply_markup=await get_courier_management_keyboard(),
+        parse_mode="HTML"
+    )
+
+
 @router.message(F.text == "📋 Список курьеров")
 async def cmd_list_couriers(message: Message):
     """Handler to list all couriers"""
@@ -370,16 +720,13 @@ async def cmd_list_couriers(message: Message):
         )
         return
     
-    response = "📋 <b>Зарегистрированные курьеры:</b>\n\n"
-    for courier in couriers:
-        # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
-        courier_info = courier['username'].split(" | ")
-        courier_name = courier_info[0] if len(courier_info) > 0 else "Неизвестно"
-        courier_phone = courier_info[1] if len(courier_info) > 1 else "Нет телефона"
-        
-        response += f"• <b>{courier_name}</b>\n  📱 Телефон: {courier_phone}\n  🆔 ID: {courier['id']}\n\n"
-    
-    await message.answer(response, reply_markup=await get_courier_management_keyboard(), parse_mode="HTML")
+    send_chunked(
+        message.chat.id,
+        (render_user_card(courier) for courier in couriers),
+        header="📋 <b>Зарегистрированные курьеры:</b>\n\n",
+        reply_markup=await get_courier_management_keyboard(),
+        parse_mode="HTML"
+    )
 
 
 @router.message(F.text == "📋 Список магазинов")
@@ -398,16 +745,32 @@ async def cmd_list_shops(message: Message):
         )
         return
     
-    response = "📋 <b>Зарегистрированные магазины:</b>\n\n"
-    for shop in shops:
-        # Разделяем название и телефон магазина (формат: "Название | Телефон")
-        shop_info = shop['username'].split(" | ")
-        shop_name = shop_info[0] if len(shop_info) > 0 else "Неизвестно"
-        shop_phone = shop_info[1] if len(shop_info) > 1 else "Нет телефона"
-        
-        response += f"• <b>{shop_name}</b>\n  📱 Телефон: {shop_phone}\n  🆔 ID: {shop['id']}\n\n"
-    
-    await message.answer(response, reply_markup=await get_shop_management_keyboard(), parse_mode="HTML")
+    send_chunked(
+        message.chat.id,
+        (render_user_card(shop) for shop in shops),
+        header="📋 <b>Зарегистрированные магазины:</b>\n\n",
+        reply_markup=await get_shop_management_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+async def render_courier_deletion_page(page: int = 0):
+    """
+    Render one page of the courier deletion picker
+    
+    Returns:
+        Inline keyboard, or None if there are no couriers
+    """
+    couriers, total = await search_couriers("", page, COURIERS_PAGE_SIZE)
+    total_pages = (total + COURIERS_PAGE_SIZE - 1) // COURIERS_PAGE_SIZE
+    if not total_pages:
+        return None
+    
+    if page >= total_pages:
+        page = total_pages - 1
+        couriers, total = await search_couriers("", page, COURIERS_PAGE_SIZE)
+    
+    return await get_couriers_list_keyboard(couriers, page, total_pages)
 
 
 @router.message(F.text == "🗑️ Удалить курьера", StateFilter(None))
@@ -417,9 +780,9 @@ async def cmd_delete_courier_start(message: Message, state: FSMContext):
         await message.answer("Эта команда доступна только администраторам.")
         return
     
-    couriers = await get_all_couriers()
+    keyboard = await render_courier_deletion_page(0)
     
-    if not couriers:
+    if keyboard is None:
         await message.answer(
             "Нет курьеров для удаления.",
             reply_markup=await get_courier_management_keyboard()
@@ -428,10 +791,70 @@ async def cmd_delete_courier_start(message: Message, state: FSMContext):
     
     await message.answer(
         "Выберите курьера для удаления:",
-        reply_markup=await get_couriers_list_keyboard(couriers)
+        reply_markup=keyboard
     )
+
+
+@router.callback_query(F.data.startswith("cd:"))
+async def courier_deletion_callback(callback_query: CallbackQuery, state: FSMContext):
+    """
+    Handle the courier deletion picker: "cd:p:<page>", "cd:u:<courier>" and "cd:back"
+    """
+    if not await admin_access_required(callback_query):
+        await callback_query.answer("Эта команда доступна только администраторам.")
+        return
+    
+    data_parts = callback_query.data.split(":")
+    action = data_parts[1] if len(data_parts) > 1 else ""
+    
+    if action == "n":
+        await callback_query.answer()
+    
+    elif action == "back":
+        await callback_query.answer()
+        await callback_query.message.edit_text("Вернулись в меню управления курьерами.")
+    
+    elif action == "p" and len(data_parts) == 3:
+        keyboard = await render_courier_deletion_page(int(data_parts[2]))
+        await callback_query.answer()
+        if keyboard is None:
+            await callback_query.message.edit_text("Нет курьеров для удаления.")
+            return
+        try:
+            await callback_query.message.edit_reply_markup(reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+    
+    elif action == "u" and len(data_parts) == 3:
+        user_id = int(data_parts[2])
+        courier = await get_user_by_id(user_id)
+        
+        if not courier or courier['role'] != ROLE_COURIER:
+            await callback_query.answer("Курьер не найден.", show_alert=True)
+            return
+        
+        # Проверяем, есть ли у пользователя активные заказы
+        if await check_user_has_orders(user_id):
+            await callback_query.answer(
+                "Этот курьер имеет активные заказы. Сначала необходимо завершить все его заказы.",
+                show_alert=True
+            )
+            return
+        
+        await callback_query.answer()
+        
+        # Сохраняем ID пользователя в состоянии и запрашиваем подтверждение
+        await state.set_state(UserManagementForm.confirm_deletion)
+        await state.update_data(user_id=user_id)
+        
+        await callback_query.message.answer(
+            f"Вы уверены, что хотите удалить курьера {courier['username']} (ID: {user_id})?\n\n"
+            "Отправьте 'Да' для подтверждения или 'Нет' для отмены."
+        )
     
-    await state.set_state(UserManagementForm.waiting_for_courier_deletion)
+    else:
+        await callback_query.answer("Неверные данные обратного вызова")
 
 
 @router.message(F.text == "🗑️ Удалить магазин", StateFilter(None))
@@ -458,75 +881,19 @@ async def cmd_delete_shop_start(message: Message, state: FSMContext):
     await state.set_state(UserManagementForm.waiting_for_shop_deletion)
 
 
-@router.message(F.text == "⬅️ Назад", StateFilter(UserManagementForm.waiting_for_courier_deletion, UserManagementForm.waiting_for_shop_deletion))
+@router.message(F.text == "⬅️ Назад", StateFilter(UserManagementForm.waiting_for_shop_deletion))
 async def cmd_back_to_user_management(message: Message, state: FSMContext):
     """Handler to return to user management menu"""
     if not await admin_access_required(message):
         await message.answer("Эта команда доступна только администраторам.")
         return
     
-    current_state = await state.get_state()
-    
     await state.clear()
     
-    if current_state == UserManagementForm.waiting_for_courier_deletion.state:
-        await message.answer(
-            "Вернулись в меню управления курьерами.",
-            reply_markup=await get_courier_management_keyboard()
-        )
-    else:
-        await message.answer(
-            "Вернулись в меню управления магазинами.",
-            reply_markup=await get_shop_management_keyboard()
-        )
-
-
-@router.message(UserManagementForm.waiting_for_courier_deletion)
-async def process_courier_deletion(message: Message, state: FSMContext):
-    """Handler for courier deletion"""
-    if not await admin_access_required(message):
-        await message.answer("Эта команда доступна только администраторам.")
-        await state.clear()
-        return
-    
-    if message.text == "⬅️ Назад":
-        await cmd_back_to_user_management(message, state)
-        return
-    
-    # Извлекаем ID пользователя из формата "❌ Имя (ID: 123456)"
-    match = re.search(r'ID: (\d+)', message.text)
-    if not match:
-        await message.answer(
-            "Пожалуйста, выберите курьера из списка кнопок.",
-            reply_markup=await get_couriers_list_keyboard(await get_all_couriers())
-        )
-        return
-    
-    user_id = int(match.group(1))
-    
-    # Проверяем, есть ли у пользователя активные заказы
-    has_orders = await check_user_has_orders(user_id)
-    if has_orders:
-        await message.answer(
-            "Этот курьер имеет активные заказы. Сначала необходимо завершить все его заказы.",
-            reply_markup=await get_courier_management_keyboard()
-        )
-        await state.clear()
-        return
-    
-    # Сохраняем ID пользователя в состоянии и запрашиваем подтверждение
-    await state.update_data(user_id=user_id)
-    
-    # Получаем имя пользователя
-    all_couriers = await get_all_couriers()
-    courier_name = next((c["username"] for c in all_couriers if c["id"] == user_id), "Unknown")
-    
     await message.answer(
-        f"Вы уверены, что хотите удалить курьера {courier_name} (ID: {user_id})?\n\n"
-        "Отправьте 'Да' для подтверждения или 'Нет' для отмены."
+        "Вернулись в меню управления магазинами.",
+        reply_markup=await get_shop_management_keyboard()
     )
-    
-    await state.set_state(UserManagementForm.confirm_deletion)
 
 
 @router.message(UserManagementForm.waiting_for_shop_deletion)
@@ -632,13 +999,18 @@ async def cmd_admin_help(message: Message):
         "• 📋 <b>Список заказов</b> - просмотр всех ожидающих заказов\n"
         "• 📮 <b>Назначить заказ</b> - назначение заказов курьерам\n"
         "• 👥 <b>Управление пользователями</b> - управление белым списком, курьерами и магазинами\n"
-        "• 📊 <b>Отчет</b> - просмотр статистики по заказам\n"
+        "• 📊 <b>Отчет</b> - статистика за период с разбивкой по курьерам, магазинам и городам "
+        "(например, /report week courier или /report 2024-05-01 2024-05-31 shop)\n"
         "• ❓ <b>Помощь</b> - показать эту справку\n\n"
         "<b>Команды белого списка:</b>\n"
         "/whitelist_add ID - добавить пользователя в белый список\n"
         "/whitelist_list - просмотр пользователей в белом списке\n"
         "/whitelist_remove ID - удалить пользователя из белого списка\n"
-        "/export_orders - экспорт заказов в Excel\n\n"
+        "/export_orders [csv|parquet] [from=… to=… status=… shop=… courier=… city=…] - экспорт заказов\n"
+        "/autoassign - автоматическое назначение ожидающих заказов\n"
+        "/load - загрузка курьеров\n"
+        "/bundles - ожидающие заказы, сгруппированные по районам\n"
+        "/stats - состояние очереди исходящих сообщений\n\n"
         "⏰ <b>Рабочие часы:</b> 10:00 - 20:00"
     )
     
@@ -647,52 +1019,124 @@ async def cmd_admin_help(message: Message):
 
 @router.message(Command("report"))
 @router.message(F.text == "📊 Отчет")
-async def cmd_report(message: Message):
-    """Handler for /report command to generate delivery reports"""
+async def cmd_report(message: Message, command: Optional[CommandObject] = None):
+    """
+    Handler for /report command to generate delivery reports
+    
+    Accepts a period or a date range and a breakdown, e.g. "/report week courier"
+    or "/report 2024-05-01 2024-05-31 shop"
+    """
+    if not await admin_access_required(message):
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+    
+    try:
+        request = parse_report_args(command.args if command else "")
+    except ValueError:
+        await message.answer(
+            "Не удалось разобрать параметры отчета.\n\n"
+            "Примеры:\n"
+            "/report — за сегодня\n"
+            "/report week courier — за 7 дней по курьерам\n"
+            "/report month shop — за текущий месяц по магазинам\n"
+            "/report 2024-05-01 2024-05-31 city — за период по городам",
+            reply_markup=await get_admin_main_keyboard()
+        )
+        return
+    
+    result = await report_engine.compute(request)
+    await message.answer(
+        render_report(request, result),
+        reply_markup=await get_report_keyboard(request.period, request.breakdown, request.key)
+    )
+
+
+@router.callback_query(F.data.startswith("rp:"))
+async def report_callback(callback_query: CallbackQuery):
+    """
+    Handle switching the report period and breakdown ("rp:<period>:<breakdown>");
+    the period is a period name or a date range "YYYY-MM-DD_YYYY-MM-DD"
+    """
+    if not await admin_access_required(callback_query):
+        await callback_query.answer("Эта команда доступна только администраторам.")
+        return
+    
+    data_parts = callback_query.data.split(":")
+    if len(data_parts) != 3 or data_parts[2] not in ("", *BREAKDOWNS):
+        await callback_query.answer("Неверные данные обратного вызова")
+        return
+    
+    if data_parts[1] in PERIODS:
+        request = make_report_request(data_parts[1], data_parts[2])
+    else:
+        # Разбивка отчета за произвольные даты сохраняет его период
+        try:
+            request = parse_report_args(f"{data_parts[1].replace('_', ' ')} {data_parts[2]}")
+        except ValueError:
+            await callback_query.answer("Неверные данные обратного вызова")
+            return
+    result = await report_engine.compute(request)
+    await callback_query.answer()
+    try:
+        await callback_query.message.edit_text(
+            render_report(request, result),
+            reply_markup=await get_report_keyboard(request.period, request.breakdown, request.key)
+        )
+    except TelegramBadRequest as e:
+        # Отчет не изменился с момента последнего показа
+        if "message is not modified" not in str(e):
+            raise
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, fsm_storage: BaseStorage):
+    """Handler for /stats command to show update processing, outbound queue, cache, job and FSM session metrics"""
     if not await admin_access_required(message):
         await message.answer("Эта команда доступна только администраторам.")
         return
     
-    # Get today's date and yesterday's date
-    today = get_date_dushanbe()
-    yesterday = get_yesterday_date()
-    
-    # Get all orders
-    all_orders = await get_all_orders()
-    total_orders = len(all_orders)
-    
-    # Count orders by status
-    pending_count = 0
-    assigned_count = 0
-    delivered_count = 0
-    
-    for order in all_orders:
-        status = order.get('status', 'pending')
-        if status == 'pending':
-            pending_count += 1
-        elif status == 'assigned':
-            assigned_count += 1
-        elif status == 'delivered':
-            delivered_count += 1
-    
-    # Get delivered orders for today and yesterday
-    today_delivered = await get_delivered_orders_in_timeframe(today)
-    yesterday_delivered = await get_delivered_orders_in_timeframe(yesterday)
-    
-    # Prepare report
-    report = (
-        "📊 Отчет о доставках\n\n"
-        f"Всего заказов: {total_orders}\n"
-        f"В ожидании: {pending_count}\n"
-        f"Назначено: {assigned_count}\n"
-        f"Доставлено: {delivered_count}\n\n"
-        f"Доставлено сегодня ({today}): {len(today_delivered)}\n"
-        f"Доставлено вчера ({yesterday}): {len(yesterday_delivered)}\n\n"
+    stats = outbound.stats()
+    cards = card_cache.stats()
+    updates = update_pool.stats()
+    throttled = throttling.stats()
+    jobs = scheduler.stats()
+    
+    response = (
+        "📥 <b>Обработка входящих обновлений</b>\n\n"
+        f"Обработчиков: {updates['workers']} (заняты: {updates['busy']})\n"
+        f"В очереди: {updates['queued']} (макс. в одной очереди: {updates['max_depth']})\n"
+        f"Обработано: {updates['processed']}\n"
+        f"Ошибок: {updates['failed']}\n"
+        f"Отклонено антифлудом: {throttled['throttled']}\n\n"
+        "📈 <b>Очередь исходящих сообщений</b>\n\n"
+        f"В очереди: {stats['queued']}\n"
+        f"Отправляется: {stats['in_flight']}\n"
+        f"Чатов в очереди: {stats['chats']}\n"
+        f"Отправлено: {stats['sent']}\n"
+        f"Повторов: {stats['retried']}\n"
+        f"Потеряно: {stats['dropped']}\n\n"
+        "🗂 <b>Кэш карточек заказов</b>\n\n"
+        f"Карточек: {cards['size']}\n"
+        f"Попаданий: {cards['hits']}\n"
+        f"Промахов: {cards['misses']}\n\n"
+        "⏰ <b>Фоновые задачи</b>\n\n"
+        f"Задач: {jobs['jobs']}\n"
+        f"Выполнено: {jobs['runs']}\n"
+        f"Ошибок: {jobs['failed']}\n"
+        f"Пропущено (предыдущий запуск не завершен): {jobs['skipped']}"
     )
     
-    # Убрали отображение деталей доставленных заказов по просьбе клиента
+    # Счетчики есть только у постоянного хранилища FSM
+    if hasattr(fsm_storage, "stats"):
+        sessions = fsm_storage.stats()
+        response += (
+            "\n\n💾 <b>Сессии FSM</b>\n\n"
+            f"Активных: {sessions['sessions']}\n"
+            f"Удалено по TTL: {sessions['expired']}\n"
+            f"Вытеснено по лимиту: {sessions['evicted']}"
+        )
     
-    await message.answer(report, reply_markup=await get_admin_main_keyboard())
+    await message.answer(response, reply_markup=await get_admin_main_keyboard())
 
 
 def register_handlers(dp: Router):
@@ -2,10 +2,12 @@
 Common handlers for all users regardless of role.
 This module contains handlers for commands available to all users.
 """
+import asyncio
 import logging
 from aiogram import Router, F, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
@@ -15,11 +17,18 @@ from config import (
 )
 from storage.database import (
     get_user_role, register_user, 
-    get_authorized_users, add_authorized_user, init_whitelist
+    get_authorized_users, add_authorized_user, init_whitelist, get_orders_filtered, get_orders_version,
+    get_orders_changed_since, get_export_cursor, set_export_cursor
 )
 from utils.timezone import (
     get_datetime_dushanbe, format_datetime_dushanbe, is_working_hours, get_working_hours_message
 )
+from utils.outbound import outbound
+from utils.chunker import send_chunked
+from utils.export import (
+    EXPORT_FORMATS, ExportProgress, ExportRequest, export_orders, export_monthly, parse_export_args,
+    export_cache, cleanup_exports
+)
 
 logger = logging.getLogger(__name__)
 
@@ -84,24 +93,20 @@ async def cmd_start(message: Message, state: FSMContext):
             parse_mode="HTML"
         )
         # Отправляем уведомление администратору о попытке доступа
-        bot = message.bot
         user_username = message.from_user.username or "нет"
         user_name = message.from_user.full_name or "Неизвестно"
         
         for admin_id in ADMIN_CHAT_IDS:
-            try:
-                await bot.send_message(
-                    admin_id,
-                    f"⚠️ <b>Попытка доступа от неавторизованного пользователя</b>\n\n"
-                    f"👤 <b>Имя:</b> {user_name}\n"
-                    f"🆔 <b>ID:</b> {user_id}\n"
-                    f"📝 <b>Username:</b> @{user_username}\n\n"
-                    f"Чтобы добавить этого пользователя в белый список, используйте команду:\n"
-                    f"<code>/whitelist_add {user_id}</code>",
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify admin {admin_id} about unauthorized access: {e}")
+            outbound.send_message(
+                admin_id,
+                f"⚠️ <b>Попытка доступа от неавторизованного пользователя</b>\n\n"
+                f"👤 <b>Имя:</b> {user_name}\n"
+                f"🆔 <b>ID:</b> {user_id}\n"
+                f"📝 <b>Username:</b> @{user_username}\n\n"
+                f"Чтобы добавить этого пользователя в белый список, используйте команду:\n"
+                f"<code>/whitelist_add {user_id}</code>",
+                parse_mode="HTML"
+            )
         return
     
     # Если пользователь имеет доступ, проверяем его роль
@@ -446,19 +451,15 @@ async def process_shop_phone(message: Message, state: FSMContext):
     )
     
     # Отправляем уведомление администратору о регистрации нового магазина
-    bot = message.bot
     for admin_id in ADMIN_CHAT_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                f"🏪 <b>Зарегистрирован новый магазин!</b>\n\n"
-                f"🛒 <b>Название магазина:</b> {shop_name}\n"
-                f"📱 <b>Контактный телефон:</b> {shop_phone}\n"
-                f"🆔 <b>ID:</b> {user_id}",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id} about new shop: {e}")
+        outbound.send_message(
+            admin_id,
+            f"🏪 <b>Зарегистрирован новый магазин!</b>\n\n"
+            f"🛒 <b>Название магазина:</b> {shop_name}\n"
+            f"📱 <b>Контактный телефон:</b> {shop_phone}\n"
+            f"🆔 <b>ID:</b> {user_id}",
+            parse_mode="HTML"
+        )
 
 
 @router.message(RoleRegistration.waiting_for_courier_name)
@@ -556,19 +557,15 @@ async def process_courier_phone(message: Message, state: FSMContext):
     )
     
     # Отправляем уведомление администратору о регистрации нового курьера
-    bot = message.bot
     for admin_id in ADMIN_CHAT_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                f"🆕 <b>Зарегистрирован новый курьер!</b>\n\n"
-                f"👤 <b>Имя:</b> {courier_name}\n"
-                f"📱 <b>Телефон:</b> {courier_phone}\n"
-                f"🆔 <b>ID:</b> {user_id}",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id} about new courier: {e}")
+        outbound.send_message(
+            admin_id,
+            f"🆕 <b>Зарегистрирован новый курьер!</b>\n\n"
+            f"👤 <b>Имя:</b> {courier_name}\n"
+            f"📱 <b>Телефон:</b> {courier_phone}\n"
+            f"🆔 <b>ID:</b> {user_id}",
+            parse_mode="HTML"
+        )
 
 
 @router.message(Command("cancel"), StateFilter("*"))
@@ -680,11 +677,11 @@ async def cmd_whitelist_list(message: Message):
             )
             return
         
-        # Формируем сообщение со списком пользователей
-        users_text = "\n".join([f"• {user_id}" for user_id in authorized_users_list])
-        
-        await message.answer(
-            f"📋 <b>Пользователи в белом списке:</b>\n\n{users_text}",
+        # Формируем сообщения со списком пользователей
+        send_chunked(
+            message.chat.id,
+            (f"• {user_id}\n" for user_id in authorized_users_list),
+            header="📋 <b>Пользователи в белом списке:</b>\n\n",
             parse_mode="HTML"
         )
     except Exception as e:
@@ -755,8 +752,13 @@ async def cmd_whitelist_remove(message: Message):
 
 
 @router.message(Command('export_orders'))
-async def cmd_export_orders(message: Message):
-    """Экспорт заказов в Excel файл (только для админов)"""
+async def cmd_export_orders(message: Message, command: CommandObject):
+    """
+    Экспорт заказов в Excel, CSV или Parquet (только для админов)
+    
+    Примеры: /export_orders, /export_orders csv from=2024-05-01 to=2024-05-31 status=delivered,
+    /export_orders parquet courier=Али city=Душанбе, /export_orders delta csv, /export_orders month
+    """
     user_id = message.from_user.id
     
     # Проверяем, что команду выполняет администратор
@@ -765,9 +767,41 @@ async def cmd_export_orders(message: Message):
         return
     
     try:
-        # Получаем все заказы из базы данных
-        from storage.database import get_all_orders, export_orders_to_excel
-        orders = await get_all_orders()
+        request = await parse_export_args(command.args)
+    except ValueError as e:
+        await message.answer(
+            f"❌ {e}\n\n"
+            "Формат: /export_orders [xlsx|csv|parquet] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] "
+            "[status=pending|assigned|delivered] [shop=ID или имя] [courier=ID или имя] [city=Город]\n"
+            "Только изменения с прошлой выгрузки: /export_orders delta [xlsx|csv|parquet] "
+            "или /export_orders month (месячная книга Excel)"
+        )
+        return
+    
+    try:
+        if request.delta:
+            await _export_changes(message, request)
+            return
+        
+        # Пока заказы не менялись, тот же отчет отправляется повторно по file_id без генерации
+        cache_key = request.cache_key()
+        version = await get_orders_version()
+        cached = export_cache.get(cache_key, version)
+        if cached is not None:
+            try:
+                await message.bot.send_document(
+                    chat_id=message.chat.id,
+                    document=cached["file_id"],
+                    caption=f"📊 <b>Отчет о заказах</b> ({cached['orders']})",
+                    parse_mode="HTML"
+                )
+                return
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached export file_id rejected, generating again: {e}")
+                export_cache.discard(cache_key)
+        
+        # Фильтры применяются через индексы базы, без перебора всех заказов
+        orders = await get_orders_filtered(**request.filters)
         
         if not orders:
             await message.answer(
@@ -776,22 +810,31 @@ async def cmd_export_orders(message: Message):
             )
             return
         
-        # Уведомляем о начале экспорта
-        await message.answer(
+        # Сообщение о начале экспорта обновляется по мере записи заказов
+        status_message = await message.answer(
             "⏳ <b>Генерация отчета...</b>",
             parse_mode="HTML"
         )
+        progress = ExportProgress(status_message, "Генерация отчета...")
         
-        # Экспортируем заказы в Excel
-        filepath = await export_orders_to_excel(orders)
+        # Записываем файл в фоновом потоке
+        filepath = await export_orders(
+            orders, EXPORT_FORMATS[request.file_format], request.filename(), progress
+        )
+        await progress.update(len(orders), len(orders), force=True)
         
-        # Отправляем файл
-        await message.bot.send_document(
+        # Отправляем файл и запоминаем его file_id для повторных запросов
+        sent = await message.bot.send_document(
             chat_id=message.chat.id,
             document=types.FSInputFile(filepath),
-            caption="📊 <b>Отчет о заказах</b>",
+            caption=f"📊 <b>Отчет о заказах</b> ({len(orders)})",
             parse_mode="HTML"
         )
+        if sent.document:
+            export_cache.put(cache_key, version, sent.document.file_id, len(orders))
+        
+        # Старые файлы отчетов удаляются по возрасту и общему размеру
+        await asyncio.to_thread(cleanup_exports)
     except Exception as e:
         logger.error(f"Error in export_orders command: {e}")
         await message.answer(
@@ -800,6 +843,49 @@ async def cmd_export_orders(message: Message):
         )
 
 
+async def _export_changes(message: Message, request: ExportRequest):
+    """Send orders created or changed since the previous export of this admin and move the cursor"""
+    cursor_key = request.cursor_key(message.from_user.id)
+    cursor = await get_export_cursor(cursor_key)
+    orders, version = await get_orders_changed_since(cursor)
+    
+    if request.monthly:
+        workbooks = await export_monthly(orders, message.from_user.id, first_run=cursor == 0)
+        for month, filepath, merged, total in workbooks:
+            await message.bot.send_document(
+                chat_id=message.chat.id,
+                document=types.FSInputFile(filepath),
+                caption=f"📊 <b>Заказы за {month}</b> ({total}), обновлено: {merged}",
+                parse_mode="HTML"
+            )
+    elif orders:
+        status_message = await message.answer(
+            "⏳ <b>Выгрузка изменений...</b>",
+            parse_mode="HTML"
+        )
+        progress = ExportProgress(status_message, "Выгрузка изменений...")
+        filepath = await export_orders(
+            orders, EXPORT_FORMATS[request.file_format], request.filename(), progress
+        )
+        await progress.update(len(orders), len(orders), force=True)
+        await message.bot.send_document(
+            chat_id=message.chat.id,
+            document=types.FSInputFile(filepath),
+            caption=f"📊 <b>Изменения заказов</b> ({len(orders)})",
+            parse_mode="HTML"
+        )
+        await asyncio.to_thread(cleanup_exports)
+    
+    if not orders or (request.monthly and not workbooks):
+        await message.answer(
+            "📊 <b>Нет новых или измененных заказов с прошлой выгрузки</b>",
+            parse_mode="HTML"
+        )
+    
+    # Курсор сдвигается только после успешной отправки
+    await set_export_cursor(cursor_key, version)
+
+
 @router.message(F.text == "👥 Управление пользователями")
 async def cmd_user_management(message: Message):
     """Обработчик для кнопки 'Управление пользователями'"""
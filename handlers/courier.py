@@ -6,17 +6,24 @@ import logging
 from utils.timezone import format_datetime_dushanbe, is_working_hours, get_working_hours_message
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-from config import ROLE_COURIER, ADMIN_CHAT_IDS
-from keyboards.courier_kb import get_delivery_confirmation_keyboard, get_courier_main_keyboard
+from config import ROLE_COURIER, ADMIN_CHAT_IDS, DELIVERY_HISTORY_PAGE_SIZE
+from keyboards.courier_kb import (
+    get_courier_main_keyboard, get_delivery_confirmation_keyboard,
+    get_deliveries_carousel_keyboard, get_delivery_history_keyboard
+)
 from storage.database import (
-    get_user_role, get_courier_orders, get_order_by_id, 
-    mark_order_as_delivered
+    get_user_role, get_courier_active_orders, get_courier_delivered_page, get_order_by_id, 
+    mark_order_as_delivered, get_order_cards
 )
+from utils.outbound import outbound
+from utils.outbox import make_notification, make_card_updates, outbox_worker
+from utils.cards import render_order_card
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +43,50 @@ async def courier_access_required(message: Message):
     return role == ROLE_COURIER
 
 
+async def render_active_delivery(courier_id: int, index: int = 0):
+    """
+    Render one active delivery of the courier carousel
+    
+    Returns:
+        Message text and inline keyboard, or (None, None) if there are no active deliveries
+    """
+    orders = await get_courier_active_orders(courier_id)
+    if not orders:
+        return None, None
+    
+    # Доставок могло стать меньше, пока карусель была открыта
+    index = min(max(index, 0), len(orders) - 1)
+    order = orders[index]
+    
+    text = (
+        f"📦 Активные доставки: {index + 1} из {len(orders)}\n\n"
+        + render_order_card(order, "courier")
+    )
+    return text, await get_deliveries_carousel_keyboard(order['id'], index, len(orders))
+
+
+async def render_delivery_history(courier_id: int, page: int = 0):
+    """
+    Render one page of completed deliveries of a courier
+    
+    Returns:
+        Message text and inline keyboard, or (None, None) if there are no completed deliveries
+    """
+    orders, total = await get_courier_delivered_page(courier_id, page, DELIVERY_HISTORY_PAGE_SIZE)
+    if total == 0:
+        return None, None
+    
+    total_pages = (total + DELIVERY_HISTORY_PAGE_SIZE - 1) // DELIVERY_HISTORY_PAGE_SIZE
+    if page >= total_pages:
+        page = total_pages - 1
+        orders, total = await get_courier_delivered_page(courier_id, page, DELIVERY_HISTORY_PAGE_SIZE)
+    
+    text = f"✅ <b>Выполненные доставки</b> (всего: {total})\n\n"
+    for order in orders:
+        text += render_order_card(order, "courier_history")
+    return text, await get_delivery_history_keyboard(page, total_pages)
+
+
 @router.message(Command("mydeliveries"))
 @router.message(F.text == "🚚 Мои доставки")
 async def cmd_my_deliveries(message: Message):
@@ -45,9 +96,13 @@ async def cmd_my_deliveries(message: Message):
         return
     
     user_id = message.from_user.id
-    orders = await get_courier_orders(user_id)
     
-    if not orders:
+    # Активные доставки показываются в одном сообщении-карусели, история — отдельно по кнопке
+    text, keyboard = await render_active_delivery(user_id)
+    if text is None:
+        text, keyboard = await render_delivery_history(user_id)
+    
+    if text is None:
         await message.answer(
             "📭 <b>У вас нет назначенных доставок.</b>\n\n"
             "Когда администратор назначит вам доставку, вы получите уведомление.",
@@ -56,59 +111,44 @@ async def cmd_my_deliveries(message: Message):
         )
         return
     
-    delivered_orders = []
-    assigned_orders = []
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("dl:"))
+async def deliveries_page_callback(callback_query: CallbackQuery):
+    """
+    Handle carousel and history navigation: "dl:a:<index>", "dl:h:<page>" and "dl:n"
+    """
+    if not await courier_access_required(callback_query):
+        await callback_query.answer("❌ Эта команда доступна только курьерам.")
+        return
     
-    for order in orders:
-        if order['status'] == "delivered":
-            delivered_orders.append(order)
-        elif order['status'] == "assigned":
-            assigned_orders.append(order)
-    
-    # First, show active assignments with confirmation buttons
-    for order in assigned_orders:
-        # Форматируем сумму оплаты
-        payment_amount = order.get('payment_amount', 0)
-        payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-        
-        response = (
-            f"🚚 <b>Активная доставка: Заказ #{order['id']}</b>\n\n"
-            f"🏪 <b>Магазин:</b> {order['shop_name']}\n"
-            f"📱 <b>Клиент:</b> {order['customer_phone']}\n"
-            f"📍 <b>Адрес:</b> {order['city']}, {order['delivery_address']}\n"
-            f"💰 <b>Сумма к оплате:</b> {payment_formatted} сомони\n"
-            f"🕒 <b>Назначен:</b> {order.get('assigned_at', 'Н/Д')}\n\n"
-            f"Нажмите кнопку <b>✅ Доставлено</b>, когда заказ будет доставлен клиенту."
-        )
-        
-        await message.answer(
-            response, 
-            reply_markup=await get_delivery_confirmation_keyboard(order['id']),
-            parse_mode="HTML"
-        )
+    data_parts = callback_query.data.split(":")
+    if len(data_parts) != 3 or data_parts[1] not in ("a", "h"):
+        await callback_query.answer()
+        return
     
-    # Then, show completed deliveries if any
-    if delivered_orders:
-        response = "✅ <b>Выполненные доставки:</b>\n\n"
-        for order in delivered_orders:
-            # Форматируем сумму оплаты
-            payment_amount = order.get('payment_amount', 0)
-            payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-            
-            response += (
-                f"🟢 <b>Заказ #{order['id']}</b>\n"
-                f"🏪 Магазин: {order['shop_name']}\n"
-                f"📱 Клиент: {order['customer_phone']}\n"
-                f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-                f"💰 Сумма к оплате: {payment_formatted} сомони\n"
-                f"🕒 Доставлен в: {order.get('delivered_at', 'Н/Д')}\n\n"
-            )
-        
-        await message.answer(
-            response, 
-            reply_markup=await get_courier_main_keyboard(),
-            parse_mode="HTML"
-        )
+    courier_id = callback_query.from_user.id
+    position = int(data_parts[2])
+    
+    if data_parts[1] == "a":
+        text, keyboard = await render_active_delivery(courier_id, position)
+        empty_text = "📭 У вас нет активных доставок."
+    else:
+        text, keyboard = await render_delivery_history(courier_id, position)
+        empty_text = "📭 У вас пока нет выполненных доставок."
+    
+    if text is None:
+        await callback_query.answer(empty_text, show_alert=True)
+        return
+    
+    await callback_query.answer()
+    try:
+        await callback_query.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest as e:
+        # Повторное нажатие на ту же страницу не меняет сообщение
+        if "message is not modified" not in str(e):
+            raise
 
 
 @router.callback_query(F.data.startswith("delivery:"))
@@ -139,6 +179,11 @@ async def delivery_confirmation_callback(callback_query: CallbackQuery, state: F
         await callback_query.message.answer("Вы не назначены на этот заказ")
         return
     
+    # Кнопки в карусели могли остаться от уже доставленного заказа
+    if order['status'] == "delivered":
+        await callback_query.message.answer(f"Заказ #{order_id} уже отмечен как доставленный")
+        return
+    
     if action == "confirm":
         # Show final confirmation
         confirmation_kb = ReplyKeyboardMarkup(keyboard=[
@@ -201,13 +246,69 @@ async def process_final_confirmation(message: Message, state: FSMContext):
             
             logger.info(f"Processing delivery confirmation for order #{order_id}")
             
-            # Mark order as delivered
+            # Get order details to notify admin and shop
+            order = await get_order_by_id(order_id)
+            if not order:
+                logger.error(f"Order #{order_id} not found")
+                await message.answer(
+                    "❌ Заказ не найден.",
+                    reply_markup=await get_courier_main_keyboard()
+                )
+                return
+            
+            # Подтверждение — обычный текст, его может прислать кто угодно и сколько угодно раз
+            if order.get('courier_id') != message.from_user.id:
+                await message.answer(
+                    "❌ Вы не назначены на этот заказ.",
+                    reply_markup=await get_courier_main_keyboard()
+                )
+                return
+            
+            if order['status'] == "delivered":
+                await message.answer(
+                    f"Заказ #{order_id} уже отмечен как доставленный.",
+                    reply_markup=await get_courier_main_keyboard()
+                )
+                return
+            
             current_time = format_datetime_dushanbe()
+            
+            # Prepare notification message; the order is not stored as delivered yet,
+            # so the card is rendered without the cache
+            delivery_notification = render_order_card(
+                {**order, "status": "delivered", "delivered_at": current_time},
+                "delivered",
+                cached=False
+            )
+            
+            # Уведомления сохраняются вместе со сменой статуса и отправляются в фоне.
+            # Если у получателя уже есть карточка заказа, она обновляется на месте
+            cards = await get_order_cards(order_id)
+            notifications = make_card_updates(
+                {**order, "status": "delivered", "delivered_at": current_time},
+                cards,
+                {"admin": "admin_status", "shop": "shop", "courier": "delivered"}
+            )
+            card_chats = {card["chat_id"] for card in cards if card["variant"] in ("admin", "shop")}
+            
+            recipients = list(ADMIN_CHAT_IDS)
+            shop_id = order.get('shop_id')
+            if shop_id:
+                recipients.append(shop_id)
+            notifications += [
+                make_notification(chat_id, delivery_notification)
+                for chat_id in recipients
+                if chat_id not in card_chats
+            ]
+            
+            # Mark order as delivered
             logger.debug(f"Marking order #{order_id} as delivered at {current_time}")
             
             success = await mark_order_as_delivered(
                 order_id=order_id,
-                delivered_at=current_time
+                courier_id=message.from_user.id,
+                delivered_at=current_time,
+                notifications=notifications
             )
             
             if not success:
@@ -219,6 +320,8 @@ async def process_final_confirmation(message: Message, state: FSMContext):
                 )
                 return
             
+            outbox_worker.wake()
+            
             await message.answer(
                 f"✅ <b>Заказ #{order_id} отмечен как доставленный!</b>\n\n"
                 f"Время доставки: {current_time}",
@@ -226,47 +329,6 @@ async def process_final_confirmation(message: Message, state: FSMContext):
                 parse_mode="HTML"
             )
             
-            # Get order details to notify admin and shop
-            order = await get_order_by_id(order_id)
-            if not order:
-                logger.error(f"Order #{order_id} not found after marking as delivered")
-                return
-            
-            # Prepare notification message
-            # Форматируем сумму оплаты
-            payment_amount = order.get('payment_amount', 0)
-            payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-            
-            delivery_notification = (
-                f"✅ <b>Заказ #{order_id} доставлен!</b>\n\n"
-                f"🏪 Магазин: {order['shop_name']}\n"
-                f"📱 Клиент: {order['customer_phone']}\n"
-                f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-                f"💰 Сумма к оплате: {payment_formatted} сомони\n"
-                f"🕒 Доставлен в: {current_time}\n"
-                f"🚚 Курьер: {order.get('courier_name', 'Н/Д')}"
-            )
-            
-            # Notify admin
-            bot = message.bot
-            for admin_id in ADMIN_CHAT_IDS:
-                try:
-                    await bot.send_message(admin_id, delivery_notification, parse_mode="HTML")
-                    logger.info(f"Notification sent to admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Failed to notify admin {admin_id}: {e}")
-            
-            # Notify shop
-            shop_id = order.get('shop_id')
-            if shop_id:
-                try:
-                    await bot.send_message(shop_id, delivery_notification, parse_mode="HTML")
-                    logger.info(f"Notification sent to shop {shop_id}")
-                except Exception as e:
-                    logger.error(f"Failed to notify shop {shop_id}: {e}")
-                    
-
-            
         except Exception as e:
             logger.error(f"Unexpected error processing delivery confirmation: {e}", exc_info=True)
             await message.answer(
@@ -356,22 +418,13 @@ async def process_delivery_comment(message: Message, state: FSMContext):
     )
     
     # Send to admins
-    bot = message.bot
     for admin_id in ADMIN_CHAT_IDS:
-        try:
-            await bot.send_message(admin_id, comment_notification, parse_mode="HTML")
-            logger.info(f"Comment notification sent to admin {admin_id}")
-        except Exception as e:
-            logger.error(f"Failed to send comment to admin {admin_id}: {e}")
+        outbound.send_message(admin_id, comment_notification, parse_mode="HTML")
     
     # Notify shop about the comment
     shop_id = order.get('shop_id')
     if shop_id:
-        try:
-            await bot.send_message(shop_id, comment_notification, parse_mode="HTML")
-            logger.info(f"Comment notification sent to shop {shop_id}")
-        except Exception as e:
-            logger.error(f"Failed to send comment to shop {shop_id}: {e}")
+        outbound.send_message(shop_id, comment_notification, parse_mode="HTML")
     
     await state.clear()
 
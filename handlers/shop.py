@@ -10,10 +10,18 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
-from config import ROLE_SHOP, ADMIN_CHAT_IDS
+from config import ROLE_SHOP, ADMIN_CHAT_IDS, AUTO_ASSIGN_MODE
 from keyboards.shop_kb import get_shop_main_keyboard
-from storage.database import get_user_role, create_order, get_shop_orders, _read_database
+from keyboards.admin_kb import get_assign_order_keyboard
+from storage.database import (
+    get_user_role, create_order, get_order_by_id, get_shop_orders, register_order_cards,
+    _read_database
+)
 from utils.timezone import is_working_hours, get_working_hours_message
+from utils.assignment import assign_order, suggest_courier
+from utils.digest import admin_digest
+from utils.chunker import send_chunked
+from utils.cards import render_order_card, format_payment
 
 logger = logging.getLogger(__name__)
 
@@ -194,7 +202,7 @@ async def process_payment_amount(message: Message, state: FSMContext):
     data = await state.get_data()
     
     # Format payment amount with 2 decimal places
-    payment_formatted = f"{data['payment_amount']:.2f}" if data['payment_amount'] > 0 else "Нет"
+    payment_formatted = format_payment(data['payment_amount'])
     
     # Prepare order confirmation message
     confirmation_msg = (
@@ -261,30 +269,34 @@ async def process_order_confirmation(message: Message, state: FSMContext):
     
     await state.clear()
     
-    await message.answer(
+    sent = await message.answer(
         f"✅ <b>Заказ #{order_id} успешно создан!</b>\n\nИнформация о заказе отправлена администратору. Вы получите уведомление, когда заказ будет назначен курьеру.",
         reply_markup=await get_shop_main_keyboard()
     )
     
-    # Notify admins about the new order
-    payment_amount = data.get('payment_amount', 0)
-    payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-    
-    order_notification = (
-        f"📦 <b>Новый заказ #{order_id}</b>\n\n"
-        f"🏪 От магазина: {data['shop_name']}\n"
-        f"📱 Телефон клиента: {data['customer_phone']}\n"
-        f"🏙️ Город: {data['city']}\n"
-        f"📍 Адрес доставки: {data['delivery_address']}\n"
-        f"💰 Сумма к оплате: {payment_formatted} сомони"
-    )
+    # Сообщение о создании станет карточкой заказа и будет обновляться при смене статуса
+    await register_order_cards([{
+        "order_id": order_id,
+        "chat_id": sent.chat.id,
+        "message_id": sent.message_id,
+        "variant": "shop"
+    }])
     
-    bot = message.bot
-    for admin_id in ADMIN_CHAT_IDS:
-        try:
-            await bot.send_message(admin_id, order_notification)
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id}: {e}")
+    # Notify admins about the new order
+    order = await get_order_by_id(order_id)
+    order_notification = render_order_card(order, "new_order")
+    summary_line = render_order_card(order, "summary")
+    reply_markup = None
+    
+    # Курьер подбирается автоматически или предлагается администратору одной кнопкой
+    courier = await suggest_courier(order) if AUTO_ASSIGN_MODE != "off" else None
+    if AUTO_ASSIGN_MODE == "auto" and courier and await assign_order(order, courier):
+        order_notification = f"⚡ <b>Назначен автоматически</b>\n\n{render_order_card(order, 'admin_status')}"
+    else:
+        reply_markup = await get_assign_order_keyboard(order_id, suggested=courier)
+    
+    # При большом потоке заказов уведомления объединяются в сводку
+    admin_digest.add_order(order_id, order_notification, summary_line, reply_markup=reply_markup)
 
 
 @router.message(Command("myorders"))
@@ -316,38 +328,13 @@ async def cmd_my_orders(message: Message):
         )
         return
     
-    # Display all orders for the shop
-    response = "📋 <b>Ваши заказы:</b>\n\n"
-    for order in orders:
-        status = order.get('status', 'pending')
-        status_text = {
-            'pending': 'Ожидает',
-            'assigned': 'Назначен',
-            'delivered': 'Доставлен'
-        }.get(status, status)
-        
-        status_emoji = "🟢" if status == "delivered" else "🟡" if status == "assigned" else "🔴"
-        
-        # Форматируем сумму оплаты
-        payment_amount = order.get('payment_amount', 0)
-        payment_formatted = f"{payment_amount:.2f}" if payment_amount > 0 else "Нет"
-        
-        response += (
-            f"📦 <b>Заказ #{order['id']}</b> - {status_emoji} {status_text}\n"
-            f"📱 Клиент: {order['customer_phone']}\n"
-            f"📍 Адрес: {order['city']}, {order['delivery_address']}\n"
-            f"💰 Сумма к оплате: {payment_formatted} сомони\n"
-        )
-        
-        if status == "delivered" and "delivered_at" in order:
-            response += f"🕒 Доставлен в: {order['delivered_at']}\n"
-        
-        if status == "assigned" and "courier_name" in order:
-            response += f"🚚 Курьер: {order['courier_name']}\n"
-            
-        response += "\n"
-    
-    await message.answer(response, reply_markup=await get_shop_main_keyboard())
+    # Display all orders for the shop, split into several messages if needed
+    send_chunked(
+        message.chat.id,
+        (render_order_card(order, "shop") for order in orders),
+        header="📋 <b>Ваши заказы:</b>\n\n",
+        reply_markup=await get_shop_main_keyboard()
+    )
 
 
 def register_handlers(dp: Router):
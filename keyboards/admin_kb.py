@@ -3,6 +3,7 @@ Keyboard layouts for admin users.
 This module contains functions to create admin keyboard layouts.
 """
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
 async def get_admin_main_keyboard():
@@ -15,39 +16,187 @@ async def get_admin_main_keyboard():
     return keyboard
 
 
-async def get_couriers_keyboard(couriers):
-    """Create keyboard with courier selection options"""
+async def get_orders_page_keyboard(page, total_pages, order_ids=()):
+    """Create inline keyboard for paging through pending orders with assign buttons"""
+    builder = InlineKeyboardBuilder()
+    
+    # Кнопки назначения для заказов на текущей странице
+    for order_id in order_ids:
+        builder.row(
+            InlineKeyboardButton(text=f"📮 Назначить #{order_id}", callback_data=f"as:o:{order_id}")
+        )
+    
     buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"orders:page:{page - 1}"))
+    buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="orders:noop"))
+    if page < total_pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"orders:page:{page + 1}"))
     
-    # Add buttons for each courier
+    builder.row(*buttons)
+    builder.row(InlineKeyboardButton(text="📦 Группы по районам", callback_data="bd:l"))
+    return builder.as_markup()
+
+
+async def get_assign_order_keyboard(order_id, suggested=None):
+    """Create inline keyboard with an assign button for an order card and an optional suggested courier"""
+    builder = InlineKeyboardBuilder()
+    if suggested:
+        builder.row(InlineKeyboardButton(
+            text=_courier_button_text(suggested, "⚡ "), callback_data=f"as:c:{order_id}:{suggested['id']}"
+        ))
+    builder.row(
+        InlineKeyboardButton(text="📮 Назначить курьера", callback_data=f"as:o:{order_id}")
+    )
+    return builder.as_markup()
+
+
+async def get_orders_back_keyboard():
+    """Create inline keyboard with a button returning to the pending orders list"""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="📋 К списку заказов", callback_data="orders:page:0"))
+    return builder.as_markup()
+
+
+def _courier_button_text(courier, prefix=""):
+    """Build button text with the courier name and phone"""
+    # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
+    courier_info = courier['username'].split(" | ")
+    courier_name = courier_info[0] if len(courier_info) > 0 else "Неизвестно"
+    courier_phone = courier_info[1] if len(courier_info) > 1 else ""
+    
+    button_text = f"{prefix}{courier_name}"
+    if courier_phone:
+        button_text += f" ({courier_phone})"
+    return button_text
+
+
+def _pager_row(page, total_pages, callback_prefix, noop_callback):
+    """Build a ◀️ page/total ▶️ row for paginated inline keyboards"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"{callback_prefix}{page - 1}"))
+    buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data=noop_callback))
+    if page < total_pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"{callback_prefix}{page + 1}"))
+    return buttons
+
+
+async def get_couriers_keyboard(
+    couriers, order_id, active_counts=None, page=0, total_pages=1, query="", suggested=None
+):
+    """Create inline keyboard with one page of couriers for an order, with search and paging"""
+    builder = InlineKeyboardBuilder()
+    active_counts = active_counts or {}
+    
+    # Рекомендованный курьер выбирается одним нажатием
+    if suggested:
+        button_text = _courier_button_text(suggested, "⚡ ") + f" · {active_counts.get(suggested['id'], 0)}"
+        builder.row(
+            InlineKeyboardButton(text=button_text, callback_data=f"as:c:{order_id}:{suggested['id']}")
+        )
+    
+    # Кнопки курьеров с числом активных заказов
     for courier in couriers:
-        courier_id = courier['id']
-        courier_full_info = courier['username']
-        
-        # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
-        courier_info = courier_full_info.split(" | ")
-        courier_name = courier_info[0] if len(courier_info) > 0 else "Неизвестно"
-        courier_phone = courier_info[1] if len(courier_info) > 1 else ""
-        
-        # Формируем текст кнопки
-        button_text = f"{courier_name}"
-        if courier_phone:
-            button_text += f" ({courier_phone})"
-        button_text += f": {courier_id}"
-        
-        buttons.append([KeyboardButton(text=button_text)])
+        button_text = _courier_button_text(courier) + f" · {active_counts.get(courier['id'], 0)}"
+        builder.row(
+            InlineKeyboardButton(text=button_text, callback_data=f"as:c:{order_id}:{courier['id']}")
+        )
     
-    # Add cancel button
-    buttons.append([KeyboardButton(text="❌ Отмена")])
+    if total_pages > 1:
+        builder.row(*_pager_row(page, total_pages, f"as:p:{order_id}:", f"as:n:{order_id}"))
     
-    keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    return keyboard
+    search_buttons = [InlineKeyboardButton(text="🔍 Поиск", callback_data=f"as:s:{order_id}")]
+    if query:
+        search_buttons.append(InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data=f"as:x:{order_id}"))
+    builder.row(*search_buttons)
+    
+    # Add back button
+    builder.row(InlineKeyboardButton(text="⬅️ К списку заказов", callback_data="orders:page:0"))
+    return builder.as_markup()
+
+
+async def get_bundles_keyboard(bundles):
+    """Create inline keyboard with an assign button for every group of orders"""
+    builder = InlineKeyboardBuilder()
+    for number, bundle in enumerate(bundles, start=1):
+        builder.row(InlineKeyboardButton(
+            text=f"🚚 {number}. {(bundle['area'] or bundle['city']).capitalize()} · {len(bundle['orders'])}",
+            callback_data=f"bd:o:{bundle['id']}"
+        ))
+    builder.row(InlineKeyboardButton(text="⬅️ К списку заказов", callback_data="orders:page:0"))
+    return builder.as_markup()
+
+
+async def get_bundle_couriers_keyboard(couriers, bundle_id, fingerprint, active_counts=None, page=0, total_pages=1):
+    """
+    Create inline keyboard with one page of couriers for a group of orders
+    
+    The fingerprint of the shown orders is put into every courier button, so
+    the group is assigned only if it still consists of exactly these orders.
+    """
+    builder = InlineKeyboardBuilder()
+    active_counts = active_counts or {}
+    
+    for courier in couriers:
+        button_text = _courier_button_text(courier) + f" · {active_counts.get(courier['id'], 0)}"
+        builder.row(
+            InlineKeyboardButton(text=button_text, callback_data=f"bd:c:{bundle_id}:{courier['id']}:{fingerprint}")
+        )
+    
+    if total_pages > 1:
+        builder.row(*_pager_row(page, total_pages, f"bd:p:{bundle_id}:", "bd:n"))
+    
+    builder.row(InlineKeyboardButton(text="⬅️ К группам", callback_data="bd:l"))
+    return builder.as_markup()
+
+
+async def get_report_keyboard(period="", breakdown="", key=""):
+    """
+    Create inline keyboard switching the report period and breakdown
+    
+    Args:
+        period: Named period of the shown report ("" for a date range)
+        breakdown: Breakdown of the shown report
+        key: Period or date range the breakdown buttons keep (ReportRequest.key)
+    """
+    periods = [("today", "Сегодня"), ("yesterday", "Вчера"), ("week", "7 дней"), ("month", "Месяц")]
+    breakdowns = [("", "Итоги"), ("courier", "Курьеры"), ("shop", "Магазины"), ("city", "Города")]
+    
+    # Текущий выбор отмечается точкой
+    builder = InlineKeyboardBuilder()
+    builder.row(*[
+        InlineKeyboardButton(
+            text=f"• {text}" if key == period else text,
+            callback_data=f"rp:{key}:{breakdown}"
+        )
+        for key, text in periods
+    ])
+    builder.row(*[
+        InlineKeyboardButton(
+            text=f"• {text}" if value == breakdown else text,
+            callback_data=f"rp:{key or period or 'today'}:{value}"
+        )
+        for value, text in breakdowns
+    ])
+    return builder.as_markup()
+
+
+async def get_autoassign_keyboard():
+    """Create inline keyboard confirming a batch assignment"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Назначить все", callback_data="aa:ok"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="aa:x")
+    )
+    return builder.as_markup()
 
 
 async def get_courier_management_keyboard():
     """Create keyboard for courier management"""
     keyboard = ReplyKeyboardMarkup(keyboard=[
         [KeyboardButton(text="📋 Список курьеров"), KeyboardButton(text="🗑️ Удалить курьера")],
+        [KeyboardButton(text="📊 Загрузка курьеров")],
         [KeyboardButton(text="⬅️ Назад в главное меню")]
     ], resize_keyboard=True)
     return keyboard
@@ -62,33 +211,22 @@ async def get_shop_management_keyboard():
     return keyboard
 
 
-async def get_couriers_list_keyboard(couriers):
-    """Create keyboard with courier list for deletion"""
-    buttons = []
+async def get_couriers_list_keyboard(couriers, page=0, total_pages=1):
+    """Create inline keyboard with one page of couriers for deletion"""
+    builder = InlineKeyboardBuilder()
     
     # Add buttons for each courier
     for courier in couriers:
-        courier_id = courier['id']
-        courier_full_info = courier['username']
-        
-        # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
-        courier_info = courier_full_info.split(" | ")
-        courier_name = courier_info[0] if len(courier_info) > 0 else "Неизвестно"
-        courier_phone = courier_info[1] if len(courier_info) > 1 else ""
-        
-        # Формируем текст кнопки
-        button_text = f"❌ {courier_name}"
-        if courier_phone:
-            button_text += f" ({courier_phone})"
-        button_text += f" (ID: {courier_id})"
-        
-        buttons.append([KeyboardButton(text=button_text)])
+        builder.row(
+            InlineKeyboardButton(text=_courier_button_text(courier, "❌ "), callback_data=f"cd:u:{courier['id']}")
+        )
     
-    # Add back button
-    buttons.append([KeyboardButton(text="⬅️ Назад")])
+    if total_pages > 1:
+        builder.row(*_pager_row(page, total_pages, "cd:p:", "cd:n"))
     
-    keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    return keyboard
+    # Add back button
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="cd:back"))
+    return builder.as_markup()
 
 
 async def get_shops_list_keyboard(shops):
@@ -34,3 +34,41 @@ async def get_delivery_confirmation_keyboard(order_id):
         )
     )
     return builder.as_markup()
+
+
+async def get_deliveries_carousel_keyboard(order_id, index, total):
+    """Create inline keyboard for the active deliveries carousel"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Доставлено", callback_data=f"delivery:confirm:{order_id}"),
+        InlineKeyboardButton(text="💬 Комментарий", callback_data=f"delivery:comment:{order_id}")
+    )
+    
+    if total > 1:
+        buttons = []
+        if index > 0:
+            buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"dl:a:{index - 1}"))
+        buttons.append(InlineKeyboardButton(text=f"{index + 1}/{total}", callback_data="dl:n"))
+        if index < total - 1:
+            buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"dl:a:{index + 1}"))
+        builder.row(*buttons)
+    
+    builder.row(InlineKeyboardButton(text="📜 Выполненные доставки", callback_data="dl:h:0"))
+    return builder.as_markup()
+
+
+async def get_delivery_history_keyboard(page, total_pages):
+    """Create inline keyboard for paging through completed deliveries"""
+    builder = InlineKeyboardBuilder()
+    
+    if total_pages > 1:
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"dl:h:{page - 1}"))
+        buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="dl:n"))
+        if page < total_pages - 1:
+            buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"dl:h:{page + 1}"))
+        builder.row(*buttons)
+    
+    builder.row(InlineKeyboardButton(text="🚚 Активные доставки", callback_data="dl:a:0"))
+    return builder.as_markup()
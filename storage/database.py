@@ -6,20 +6,40 @@ import json
 import logging
 import os
 import asyncio
-from typing import List, Dict, Any, Optional, Union
+import time
+from typing import List, Dict, Any, Optional, Set, Tuple, Union
 from utils.timezone import format_datetime_dushanbe, get_date_dushanbe
-import pandas as pd
+from utils.cards import card_cache
 
 from config import (
     DATABASE_FILE, ROLE_ADMIN, ROLE_SHOP, ROLE_COURIER,
-    WHITELIST_FILE, WHITELISTED_USERS
+    WHITELIST_FILE, WHITELISTED_USERS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY,
+    LIVE_CARDS_MAX_ORDERS
 )
+from storage.indexes import DatabaseIndex, normalize_city
 
 logger = logging.getLogger(__name__)
 
 # Lock for thread-safe database operations
 db_lock = asyncio.Lock()
 
+# Кэш содержимого базы в памяти и индексы по нему.
+# Кэш сбрасывается, если файл был изменен снаружи (например, скриптами очистки).
+_db_cache: Optional[Dict[str, Any]] = None
+_db_signature: Optional[Tuple[int, int]] = None
+_index = DatabaseIndex()
+
+# Версия заказов растет при создании, назначении и доставке заказа, а также при загрузке
+# измененного снаружи файла; по ней проверяется актуальность отчетов и выгрузок
+_orders_version = 0
+# Загружался ли файл в этом процессе (первая загрузка при старте — не внешнее изменение)
+_db_loaded = False
+# Версия последней загрузки измененного снаружи файла: такие изменения не отмечены в заказах
+_external_version = 0
+
+# Сколько последних карточек одного заказа запоминать
+MAX_CARDS_PER_ORDER = 10
+
 
 async def init_database():
     """Initialize the database file if it doesn't exist"""
@@ -30,7 +50,10 @@ async def init_database():
         initial_data = {
             "users": [],
             "orders": [],
-            "next_order_id": 1
+            "next_order_id": 1,
+            "outbox": [],
+            "next_outbox_id": 1,
+            "cards": {}
         }
         async with db_lock:
             with open(DATABASE_FILE, 'w') as f:
@@ -39,36 +62,170 @@ async def init_database():
         logger.info(f"Created new database file at {DATABASE_FILE}")
 
 
+def _file_signature() -> Optional[Tuple[int, int]]:
+    """Return modification time and size of the database file"""
+    try:
+        stat = os.stat(DATABASE_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _invalidate_cache():
+    """Force the next read to load the database from disk"""
+    global _db_cache, _db_signature
+    _db_cache = None
+    _db_signature = None
+
+
 async def _read_database() -> Dict[str, Any]:
-    """Read the database file and return its contents"""
+    """Return the database contents, loading the file only when it has changed"""
+    global _db_cache, _db_signature, _orders_version, _db_loaded, _external_version
+    
+    signature = _file_signature()
+    if _db_cache is not None and signature == _db_signature:
+        return _db_cache
+    
     try:
         with open(DATABASE_FILE, 'r') as f:
-            return json.load(f)
+            data = json.load(f)
     except (json.JSONDecodeError, FileNotFoundError) as e:
         logger.error(f"Error reading database: {e}")
         # Return empty database structure
-        return {"users": [], "orders": [], "next_order_id": 1}
+        data = {"users": [], "orders": [], "next_order_id": 1, "outbox": [], "next_outbox_id": 1, "cards": {}}
+        _invalidate_cache()
+        _index.rebuild(data)
+        return data
+    
+    stored_version = data.get("orders_version")
+    if stored_version is None:
+        # Новый или очищенный файл (например, clear_data.py): версия начинается с текущего
+        # времени в миллисекундах, чтобы не совпасть с версиями прежних данных в кэшах
+        _orders_version = max(int(time.time() * 1000), _orders_version + 1)
+        _external_version = _orders_version
+    elif _db_loaded:
+        # Файл перезаписан снаружи во время работы без увеличения версии
+        _orders_version = max(stored_version, _orders_version) + 1
+        _external_version = _orders_version
+    else:
+        # При старте версия из файла верна, и сохраненные кэши выгрузок остаются в силе
+        _orders_version = stored_version
+    data["orders_version"] = _orders_version
+    _db_loaded = True
+    
+    _db_cache = data
+    _db_signature = signature
+    _index.rebuild(data)
+    # Номера заказов в измененном файле могут указывать на другие заказы (например, после очистки)
+    card_cache.clear()
+    return data
 
 
 async def _write_database(data: Dict[str, Any]):
     """Write data to the database file"""
+    global _db_cache, _db_signature
+    
+    # Пишем во временный файл и атомарно подменяем им базу,
+    # чтобы сбой во время записи не оставил файл наполовину записанным
+    tmp_file = f"{DATABASE_FILE}.tmp"
     try:
-        with open(DATABASE_FILE, 'w') as f:
+        with open(tmp_file, 'w') as f:
             json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, DATABASE_FILE)
     except Exception as e:
         logger.error(f"Error writing to database: {e}")
+        # Данные в памяти могли разойтись с файлом
+        _invalidate_cache()
         raise
+    
+    if data is not _db_cache:
+        _index.rebuild(data)
+    _db_cache = data
+    _db_signature = _file_signature()
+
+
+def _touch_orders(db: Dict[str, Any], order: Dict[str, Any]):
+    """Bump the orders version inside the current database transaction and stamp the changed order"""
+    global _orders_version
+    _orders_version = max(db.get("orders_version", 0), _orders_version) + 1
+    db["orders_version"] = _orders_version
+    # По changed_in находятся заказы, измененные после прошлой выгрузки
+    order["changed_in"] = _orders_version
+    _index.mark_changed(order)
+
+
+def _add_outbox_entries(db: Dict[str, Any], notifications: Optional[List[Dict[str, Any]]]):
+    """Append notifications to the outbox inside the current database transaction"""
+    if not notifications:
+        return
+    
+    outbox = db.setdefault("outbox", [])
+    next_id = db.get("next_outbox_id", 1)
+    
+    for notification in notifications:
+        outbox.append({
+            "id": next_id,
+            "chat_id": notification["chat_id"],
+            "text": notification["text"],
+            "parse_mode": notification.get("parse_mode"),
+            "reply_markup": notification.get("reply_markup"),
+            "message_id": notification.get("message_id"),
+            "card": notification.get("card"),
+            "attempts": 0,
+            "next_attempt_at": 0,
+            "created_at": format_datetime_dushanbe()
+        })
+        next_id += 1
+    
+    db["next_outbox_id"] = next_id
+
+
+def _register_cards(db: Dict[str, Any], cards: Optional[List[Dict[str, Any]]]):
+    """
+    Remember sent order card messages inside the current database transaction.
+    
+    Each card is a dict with order_id, chat_id, message_id and variant. The
+    optional "replaces" key holds the ID of a card message that the new one
+    replaces (e.g. when the old message could not be edited).
+    """
+    if not cards:
+        return
+    
+    registry = db.setdefault("cards", {})
+    for card in cards:
+        # Ключи JSON-объекта — строки
+        key = str(card["order_id"])
+        stale = {card["message_id"], card.get("replaces")}
+        entries = [
+            entry for entry in registry.pop(key, [])
+            if entry["chat_id"] != card["chat_id"] or entry["message_id"] not in stale
+        ]
+        entries.append({
+            "chat_id": card["chat_id"],
+            "message_id": card["message_id"],
+            "variant": card["variant"]
+        })
+        # Перемещаем заказ в конец, чтобы первыми вытеснялись самые старые
+        registry[key] = entries[-MAX_CARDS_PER_ORDER:]
+    
+    while len(registry) > LIVE_CARDS_MAX_ORDERS:
+        del registry[next(iter(registry))]
 
 
 async def get_user_role(user_id: int) -> Optional[str]:
     """Get the role of a user by ID"""
-    db = await _read_database()
+    await _read_database()
     
-    for user in db["users"]:
-        if user["id"] == user_id:
-            return user["role"]
-    
-    return None
+    user = _index.users_by_id.get(user_id)
+    return user["role"] if user else None
+
+
+async def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
+    """Get a registered user by ID"""
+    await _read_database()
+    return _index.users_by_id.get(user_id)
 
 
 async def register_user(user_id: int, username: str, role: str) -> bool:
@@ -81,21 +238,24 @@ async def register_user(user_id: int, username: str, role: str) -> bool:
         db = await _read_database()
         
         # Check if user already exists
-        for user in db["users"]:
-            if user["id"] == user_id:
-                # Update existing user
-                user["username"] = username
-                user["role"] = role
-                await _write_database(db)
-                return True
+        user = _index.users_by_id.get(user_id)
+        if user:
+            # Update existing user
+            user["username"] = username
+            user["role"] = role
+            _index.add_user(user)
+            await _write_database(db)
+            return True
         
         # Add new user
-        db["users"].append({
+        user = {
             "id": user_id,
             "username": username,
             "role": role,
             "registered_at": format_datetime_dushanbe()
-        })
+        }
+        db["users"].append(user)
+        _index.add_user(user)
         
         await _write_database(db)
         return True
@@ -117,7 +277,7 @@ async def create_order(
         db["next_order_id"] += 1
         
         # Create new order
-        db["orders"].append({
+        order = {
             "id": order_id,
             "shop_id": shop_id,
             "shop_name": shop_name,
@@ -126,8 +286,13 @@ async def create_order(
             "delivery_address": delivery_address,
             "payment_amount": payment_amount,
             "status": "pending",
-            "created_at": format_datetime_dushanbe()
-        })
+            "created_at": format_datetime_dushanbe(),
+            # Версия растет при каждом изменении заказа (используется кэшем карточек)
+            "version": 1
+        }
+        db["orders"].append(order)
+        _index.add_order(order)
+        _touch_orders(db, order)
         
         await _write_database(db)
         return order_id
@@ -135,19 +300,111 @@ async def create_order(
 
 async def get_pending_orders() -> List[Dict[str, Any]]:
     """Get all pending orders"""
+    await _read_database()
+    return list(_index.orders_by_status["pending"].values())
+
+
+async def get_pending_orders_page(page: int, page_size: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get one page of pending orders
+    
+    Args:
+        page: Page number starting from 0
+        page_size: Number of orders on a page
+        
+    Returns:
+        Orders of the requested page and the total number of pending orders
+    """
+    await _read_database()
+    return _index.page("pending", page, page_size)
+
+
+async def get_pending_bundles(min_size: int = 2) -> List[Dict[str, Any]]:
+    """
+    Get groups of pending orders going to the same city and area
+    
+    Returns:
+        Dicts with the group ID, normalized city and area and its orders, largest group first
+    """
+    await _read_database()
+    return _index.pending_bundles(min_size)
+
+
+async def get_bundle_orders(bundle_id: str) -> List[Dict[str, Any]]:
+    """Get pending orders of a group returned by get_pending_bundles()"""
+    await _read_database()
+    return _index.bundle_orders(bundle_id)
+
+
+async def get_orders_version() -> int:
+    """Get the version of the orders; it changes whenever an order is created or changed"""
+    await _read_database()
+    return _orders_version
+
+
+async def get_orders_changed_since(version: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get orders created or changed after an orders version
+    
+    Args:
+        version: Orders version of the previous export (0 for all orders)
+        
+    Returns:
+        Changed orders, oldest change first, and the current orders version
+    """
+    await _read_database()
+    return _index.changed_since(version), _orders_version
+
+
+async def get_changed_order_dates(version: int) -> Tuple[int, Optional[Set[str]]]:
+    """
+    Get dates of orders created or changed after an orders version
+    
+    Args:
+        version: Orders version the caller's data was checked at
+        
+    Returns:
+        The current orders version and the creation and delivery dates
+        (YYYY-MM-DD) of changed orders, or None instead of the dates if the
+        changes are unknown: the file was changed outside the bot since then
+        or the version belongs to other data
+    """
+    await _read_database()
+    if version < _external_version or version > _orders_version:
+        return _orders_version, None
+    
+    dates = set()
+    for order in _index.changed_since(version):
+        for field in ("created_at", "delivered_at"):
+            if order.get(field):
+                dates.add(order[field][:10])
+    return _orders_version, dates
+
+
+async def get_export_cursor(key: str) -> int:
+    """Get the orders version of the previous export for a cursor key (0 if none)"""
     db = await _read_database()
-    return [order for order in db["orders"] if order["status"] == "pending"]
+    return db.get("export_cursors", {}).get(key, 0)
+
+
+async def set_export_cursor(key: str, version: int) -> None:
+    """Remember the orders version an export was made from"""
+    async with db_lock:
+        db = await _read_database()
+        db.setdefault("export_cursors", {})[key] = version
+        await _write_database(db)
+
+
+async def get_order_status_counts() -> Dict[str, int]:
+    """Get the number of orders in every status from the in-memory index"""
+    await _read_database()
+    return {status: len(orders) for status, orders in _index.orders_by_status.items()}
 
 
 async def get_order_by_id(order_id: int) -> Optional[Dict[str, Any]]:
     """Get an order by its ID"""
-    db = await _read_database()
-    
-    for order in db["orders"]:
-        if order["id"] == order_id:
-            return order
-    
-    return None
+    await _read_database()
+    return _index.orders_by_id.get(order_id)
 
 
 async def get_couriers() -> List[Dict[str, Any]]:
@@ -156,59 +413,268 @@ async def get_couriers() -> List[Dict[str, Any]]:
     return [user for user in db["users"] if user["role"] == ROLE_COURIER]
 
 
-async def assign_order_to_courier(order_id: int, courier_id: int, courier_name: str) -> bool:
-    """Assign an order to a courier"""
+async def search_couriers(
+    query: str = "", 
+    page: int = 0, 
+    page_size: int = 8
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Find couriers by name or phone prefix using the in-memory courier index
+    
+    Args:
+        query: Prefix of a name word or phone number (empty for all couriers)
+        page: Page number starting from 0
+        page_size: Number of couriers on a page
+        
+    Returns:
+        Couriers of the requested page sorted by active load and deliveries today,
+        and the total number found
+    """
+    await _read_database()
+    couriers = _index.search_couriers(query, get_date_dushanbe())
+    start = page * page_size
+    return couriers[start:start + page_size], len(couriers)
+
+
+async def get_active_order_counts() -> Dict[int, int]:
+    """Get the number of assigned (not yet delivered) orders per courier"""
+    await _read_database()
+    return dict(_index.active_by_courier)
+
+
+def _assign(db: Dict[str, Any], order: Dict[str, Any], courier_id: int, courier_name: str):
+    """Assign a pending order to a courier and update the indexes"""
+    previous_status = order["status"]
+    previous_courier_id = order.get("courier_id")
+    
+    # Update order status and courier info
+    order["status"] = "assigned"
+    order["courier_id"] = courier_id
+    order["courier_name"] = courier_name
+    order["assigned_at"] = format_datetime_dushanbe()
+    order["version"] = order.get("version", 0) + 1
+    _index.update_order(order, previous_status, previous_courier_id)
+    _touch_orders(db, order)
+
+
+async def assign_order_to_courier(
+    order_id: int, 
+    courier_id: int, 
+    courier_name: str,
+    notifications: Optional[List[Dict[str, Any]]] = None
+) -> bool:
+    """Assign an order to a courier and queue notifications in the same write"""
     async with db_lock:
         db = await _read_database()
         
-        # Find the order
-        for order in db["orders"]:
-            if order["id"] == order_id:
-                # Update order status and courier info
-                order["status"] = "assigned"
-                order["courier_id"] = courier_id
-                order["courier_name"] = courier_name
-                order["assigned_at"] = format_datetime_dushanbe()
-                
-                await _write_database(db)
-                return True
+        # Find the order; it may have been assigned by another admin already
+        order = _index.orders_by_id.get(order_id)
+        if not order or order["status"] != "pending":
+            return False
         
-        return False
+        _assign(db, order, courier_id, courier_name)
+        
+        _add_outbox_entries(db, notifications)
+        await _write_database(db)
+        return True
 
 
-async def mark_order_as_delivered(order_id: int, delivered_at: str = None) -> bool:
-    """Mark an order as delivered"""
+async def assign_orders_to_couriers(assignments: List[Dict[str, Any]]) -> List[int]:
+    """
+    Assign several orders in one database write
+    
+    Args:
+        assignments: Dicts with order_id, courier_id, courier_name and notifications
+        
+    Returns:
+        IDs of the assigned orders; orders that are no longer pending are skipped
+    """
+    async with db_lock:
+        db = await _read_database()
+        
+        assigned = []
+        for assignment in assignments:
+            order = _index.orders_by_id.get(assignment["order_id"])
+            if not order or order["status"] != "pending":
+                continue
+            
+            _assign(db, order, assignment["courier_id"], assignment["courier_name"])
+            _add_outbox_entries(db, assignment.get("notifications"))
+            assigned.append(order["id"])
+        
+        if assigned:
+            await _write_database(db)
+        return assigned
+
+
+async def get_courier_workload(date: str = None) -> List[Dict[str, Any]]:
+    """
+    Get counters of every courier from the in-memory index
+    
+    Args:
+        date: Date in YYYY-MM-DD format (today in Dushanbe by default)
+        
+    Returns:
+        Dicts with the courier, active orders, deliveries on the date and cash to collect
+    """
+    await _read_database()
+    return _index.courier_workload(date or get_date_dushanbe())
+
+
+async def get_assignment_candidates(history: int = 30) -> List[Dict[str, Any]]:
+    """
+    Get couriers with the data used for automatic assignment
+    
+    Args:
+        history: Number of recent orders of a courier to look at
+        
+    Returns:
+        Dicts with the courier, the number of active orders, shares of recent
+        orders per city and the average delivery time in minutes
+    """
+    await _read_database()
+    return [
+        {
+            "courier": courier,
+            "active": _index.active_by_courier.get(courier_id, 0),
+            **_index.courier_profile(courier_id, history),
+        }
+        for courier_id, courier in _index.couriers_by_id.items()
+    ]
+
+
+async def mark_order_as_delivered(
+    order_id: int, 
+    courier_id: int,
+    delivered_at: str = None,
+    notifications: Optional[List[Dict[str, Any]]] = None
+) -> bool:
+    """
+    Mark an order as delivered and queue notifications in the same write
+    
+    Only the courier the order is assigned to can deliver it, and only once:
+    a repeated confirmation returns False and queues nothing.
+    """
     if not delivered_at:
         delivered_at = format_datetime_dushanbe()
     
     async with db_lock:
         db = await _read_database()
         
-        # Find the order
-        for order in db["orders"]:
-            if order["id"] == order_id:
-                # Update order status
-                order["status"] = "delivered"
-                order["delivered_at"] = delivered_at
-                
-                await _write_database(db)
-                return True
+        # Find the order; it may have been delivered already (a repeated confirmation)
+        order = _index.orders_by_id.get(order_id)
+        if not order or order["status"] != "assigned" or order.get("courier_id") != courier_id:
+            return False
         
-        return False
+        previous_status = order["status"]
+        
+        # Update order status
+        order["status"] = "delivered"
+        order["delivered_at"] = delivered_at
+        order["version"] = order.get("version", 0) + 1
+        _index.update_order(order, previous_status, order.get("courier_id"))
+        _touch_orders(db, order)
+        
+        # Доставленный заказ больше не меняется, его карточки можно забыть
+        db.get("cards", {}).pop(str(order_id), None)
+        
+        _add_outbox_entries(db, notifications)
+        await _write_database(db)
+        return True
 
 
 async def get_shop_orders(shop_id: int) -> List[Dict[str, Any]]:
     """Get all orders for a shop"""
-    db = await _read_database()
-    return [order for order in db["orders"] if order["shop_id"] == shop_id]
+    await _read_database()
+    return list(_index.orders_by_shop.get(shop_id, {}).values())
 
 
 async def get_courier_orders(courier_id: int) -> List[Dict[str, Any]]:
     """Get all orders assigned to a courier"""
+    await _read_database()
+    return [
+        order for order in _index.orders_by_courier.get(courier_id, {}).values()
+        if order["status"] in ["assigned", "delivered"]
+    ]
+
+
+async def get_courier_active_orders(courier_id: int) -> List[Dict[str, Any]]:
+    """Get orders assigned to a courier and not yet delivered"""
+    await _read_database()
+    return [
+        order for order in _index.orders_by_courier.get(courier_id, {}).values()
+        if order["status"] == "assigned"
+    ]
+
+
+async def get_courier_delivered_page(
+    courier_id: int, 
+    page: int, 
+    page_size: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Get one page of orders delivered by a courier, newest first
+    
+    Returns:
+        Orders of the requested page and the total number of delivered orders
+    """
+    await _read_database()
+    delivered = [
+        order for order in _index.orders_by_courier.get(courier_id, {}).values()
+        if order["status"] == "delivered"
+    ]
+    delivered.reverse()
+    start = page * page_size
+    return delivered[start:start + page_size], len(delivered)
+
+
+async def get_orders_filtered(
+    status: Optional[str] = None,
+    shop_id: Optional[int] = None,
+    courier_id: Optional[int] = None,
+    city: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get orders matching all given filters
+    
+    The smallest of the status, shop and courier indexes is used as the
+    starting set, so a filter by one courier does not look at other orders.
+    
+    Args:
+        status: Order status
+        shop_id: ID of the shop that created the order
+        courier_id: ID of the assigned courier
+        city: City name; compared after normalization ("г. Душанбе" matches "душанбе")
+        date_from: First creation date in YYYY-MM-DD format
+        date_to: Last creation date in YYYY-MM-DD format
+        
+    Returns:
+        Matching orders in creation order
+    """
     db = await _read_database()
+    
+    candidates = []
+    if status is not None:
+        candidates.append(_index.orders_by_status.get(status, {}))
+    if shop_id is not None:
+        candidates.append(_index.orders_by_shop.get(shop_id, {}))
+    if courier_id is not None:
+        candidates.append(_index.orders_by_courier.get(courier_id, {}))
+    orders = min(candidates, key=len).values() if candidates else db["orders"]
+    
+    city = normalize_city(city) if city else None
+    # Даты хранятся как "YYYY-MM-DD HH:MM:SS", поэтому их можно сравнивать как строки
+    date_to = f"{date_to} 99" if date_to else None
     return [
-        order for order in db["orders"] 
-        if order.get("courier_id") == courier_id and order["status"] in ["assigned", "delivered"]
+        order for order in orders
+        if (status is None or order.get("status") == status)
+        and (shop_id is None or order.get("shop_id") == shop_id)
+        and (courier_id is None or order.get("courier_id") == courier_id)
+        and (city is None or normalize_city(order.get("city", "")) == city)
+        and (date_from is None or order.get("created_at", "") >= date_from)
+        and (date_to is None or order.get("created_at", "") <= date_to)
     ]
 
 
@@ -258,6 +724,7 @@ async def delete_user(user_id: int) -> bool:
             if user["id"] == user_id:
                 # Удаляем пользователя
                 del db["users"][i]
+                _index.remove_user(user_id)
                 await _write_database(db)
                 return True
                 
@@ -266,18 +733,90 @@ async def delete_user(user_id: int) -> bool:
 
 async def check_user_has_orders(user_id: int) -> bool:
     """Check if a user has any orders (as shop or courier)"""
+    await _read_database()
+    
+    # Проверяем заказы, где пользователь выступает как магазин или как курьер
+    return bool(_index.orders_by_shop.get(user_id) or _index.orders_by_courier.get(user_id))
+
+
+# Функции для работы с очередью уведомлений (outbox)
+async def get_due_outbox_entries(limit: int = 50) -> List[Dict[str, Any]]:
+    """Get outbox entries that are ready to be sent"""
     db = await _read_database()
+    now = time.time()
     
-    # Проверяем заказы, где пользователь выступает как магазин
-    for order in db["orders"]:
-        if order["shop_id"] == user_id:
-            return True
+    due = [entry for entry in db.get("outbox", []) if entry["next_attempt_at"] <= now]
+    return due[:limit]
+
+
+async def complete_outbox_entries(
+    delivered_ids: List[int], 
+    failed_ids: List[int],
+    cards: Optional[List[Dict[str, Any]]] = None
+) -> None:
+    """
+    Remove delivered entries from the outbox and schedule retries for failed ones
+    
+    Args:
+        delivered_ids: IDs of entries that were sent successfully
+        failed_ids: IDs of entries whose delivery failed
+        cards: Order card messages sent by delivered entries
+    """
+    if not delivered_ids and not failed_ids and not cards:
+        return
+    
+    delivered = set(delivered_ids)
+    failed = set(failed_ids)
+    now = time.time()
+    
+    async with db_lock:
+        db = await _read_database()
+        
+        outbox = []
+        for entry in db.get("outbox", []):
+            if entry["id"] in delivered:
+                continue
             
-        # Проверяем заказы, где пользователь выступает как курьер
-        if order.get("courier_id") == user_id:
-            return True
+            if entry["id"] in failed:
+                entry["attempts"] += 1
+                if entry["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    logger.error(
+                        f"Outbox entry {entry['id']} to chat {entry['chat_id']} "
+                        f"dropped after {entry['attempts']} attempts"
+                    )
+                    continue
+                # Экспоненциальная задержка, не больше часа
+                delay = min(OUTBOX_RETRY_DELAY * 2 ** (entry["attempts"] - 1), 3600)
+                entry["next_attempt_at"] = now + delay
             
-    return False
+            outbox.append(entry)
+        
+        db["outbox"] = outbox
+        _register_cards(db, cards)
+        await _write_database(db)
+
+
+# Функции для работы с карточками заказов, которые обновляются на месте
+async def register_order_cards(cards: List[Dict[str, Any]]) -> None:
+    """
+    Remember messages with order cards so they can be edited on status changes
+    
+    Args:
+        cards: Dicts with order_id, chat_id, message_id and variant (admin, courier, shop)
+    """
+    if not cards:
+        return
+    
+    async with db_lock:
+        db = await _read_database()
+        _register_cards(db, cards)
+        await _write_database(db)
+
+
+async def get_order_cards(order_id: int) -> List[Dict[str, Any]]:
+    """Get remembered card messages of an order"""
+    db = await _read_database()
+    return list(db.get("cards", {}).get(str(order_id), []))
 
 
 # Функции для работы с белым списком
@@ -387,59 +926,3 @@ async def remove_authorized_user(user_id: int) -> bool:
     except Exception as e:
         logger.error(f"Ошибка удаления пользователя из белого списка: {e}")
         return False
-
-
-# Функции для экспорта заказов в Excel
-async def export_orders_to_excel(orders: List[Dict], filename: str = None) -> str:
-    """
-    Экспорт заказов в Excel файл
-    
-    Args:
-        orders: Список заказов для экспорта
-        filename: Имя файла (если не указано, генерируется автоматически)
-        
-    Returns:
-        Путь к созданному файлу
-    """
-    try:
-        # Если имя файла не указано, генерируем его с текущей датой
-        if not filename:
-            current_date = get_date_dushanbe()
-            filename = f"orders_report_{current_date}.xlsx"
-        
-        # Создаем директорию reports, если она не существует
-        os.makedirs("reports", exist_ok=True)
-        
-        # Полный путь к файлу
-        filepath = os.path.join("reports", filename)
-        
-        # Готовим данные для DataFrame
-        # Преобразуем и упрощаем структуру для экспорта
-        export_data = []
-        for order in orders:
-            export_order = {
-                "№ заказа": order["id"],
-                "Статус": order["status"],
-                "Магазин": order.get("shop_name", "Н/Д"),
-                "Город": order.get("city", "Н/Д"),
-                "Адрес доставки": order.get("delivery_address", "Н/Д"),
-                "Телефон клиента": order.get("customer_phone", "Н/Д"),
-                "Сумма оплаты": order.get("payment_amount", 0),
-                "Курьер": order.get("courier_name", "Не назначен"),
-                "Создан": order.get("created_at", "Н/Д"),
-                "Назначен": order.get("assigned_at", "Н/Д"),
-                "Доставлен": order.get("delivered_at", "Н/Д")
-            }
-            export_data.append(export_order)
-        
-        # Создаем DataFrame
-        df = pd.DataFrame(export_data)
-        
-        # Экспортируем в Excel
-        df.to_excel(filepath, index=False, engine="openpyxl")
-        
-        logger.info(f"Отчет успешно экспортирован в {filepath}")
-        return filepath
-    except Exception as e:
-        logger.error(f"Ошибка экспорта отчета в Excel: {e}")
-        raise
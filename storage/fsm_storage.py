@@ -0,0 +1,187 @@
+"""
+Persistent FSM storage for aiogram.
+States and data of all users are kept in memory and written to a JSON file
+in the background, so unfinished forms survive a restart while handlers never
+wait for the disk. Abandoned sessions expire after a TTL and the total number
+of sessions is capped.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import (
+    FSM_STORAGE_FILE, FSM_FLUSH_INTERVAL, FSM_SESSION_TTL, FSM_MAX_SESSIONS, FSM_SWEEP_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _key_to_str(key: StorageKey) -> str:
+    """Convert a storage key to a string usable as a JSON object key"""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class JsonFileStorage(BaseStorage):
+    """
+    FSM storage backed by a JSON file.
+
+    All records live in memory and every read is served from there. Changes
+    mark the storage as dirty and are written to disk at most once per flush
+    interval, together with all other changes made in the meantime. Records
+    without state and data are removed, so finished flows do not accumulate.
+
+    Records are kept in order of their last change. A background sweeper
+    removes records untouched for longer than the TTL, and the oldest records
+    are evicted as soon as there are more than `max_sessions` of them.
+    """
+
+    def __init__(
+        self,
+        path: str = FSM_STORAGE_FILE,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        ttl: float = FSM_SESSION_TTL,
+        max_sessions: int = FSM_MAX_SESSIONS,
+        sweep_interval: float = FSM_SWEEP_INTERVAL
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self._records: Dict[str, Dict[str, Any]] = self._load()
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+        # Счетчики для мониторинга
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading FSM storage, starting empty: {e}")
+            return {}
+
+        logger.info(f"Loaded {len(records)} FSM records from {self.path}")
+        # Восстанавливаем порядок последних изменений
+        return dict(sorted(records.items(), key=lambda item: item[1].get("updated_at", 0)))
+
+    def _record(self, key: StorageKey) -> Dict[str, Any]:
+        return self._records.get(_key_to_str(key), {})
+
+    def _update(self, key: StorageKey, **fields):
+        str_key = _key_to_str(key)
+        # Запись извлекается и вставляется заново, чтобы она оказалась в конце порядка
+        record = self._records.pop(str_key, {"state": None, "data": {}})
+        record.update(fields)
+        record["updated_at"] = time.time()
+
+        if record["state"] is not None or record["data"]:
+            self._records[str_key] = record
+            while len(self._records) > self.max_sessions:
+                del self._records[next(iter(self._records))]
+                self.evicted_count += 1
+        self._mark_dirty()
+
+    def start_sweeper(self):
+        """Start periodic removal of expired sessions"""
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Remove sessions untouched for longer than the TTL and return their number"""
+        deadline = (now or time.time()) - self.ttl
+        expired = 0
+        # Самые старые записи идут первыми, поэтому останавливаемся на первой свежей
+        while self._records:
+            str_key = next(iter(self._records))
+            if self._records[str_key].get("updated_at", 0) > deadline:
+                break
+            del self._records[str_key]
+            expired += 1
+
+        if expired:
+            self.expired_count += expired
+            self._mark_dirty()
+            logger.info(f"Removed {expired} expired FSM sessions")
+        return expired
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping FSM storage: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of sessions and eviction counters"""
+        return {
+            "sessions": len(self._records),
+            "expired": self.expired_count,
+            "evicted": self.evicted_count,
+        }
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error writing FSM storage: {e}")
+            # Попробуем снова при следующем изменении
+            self._dirty = True
+
+    async def flush(self):
+        """Write pending changes to disk"""
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            # Снимок делаем в цикле событий, а запись на диск выносим в отдельный поток
+            snapshot = json.dumps(self._records, ensure_ascii=False)
+            self._dirty = False
+            await asyncio.to_thread(self._write, snapshot)
+
+    def _write(self, snapshot: str):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.path)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._update(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key).get("state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._update(key, data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._record(key).get("data", {}))
+
+    async def close(self) -> None:
+        for task in (self._flush_task, self._sweep_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await self.flush()
+        logger.info("FSM storage closed")
@@ -0,0 +1,367 @@
+"""
+In-memory indexes over the database.
+This module keeps lookups by ID, status, shop and courier so that handlers do
+not have to scan the whole order list for every request.
+"""
+import hashlib
+import re
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+ORDER_STATUSES = ("pending", "assigned", "delivered")
+
+# Роль курьера (дублирует config.ROLE_COURIER, чтобы модуль не зависел от настроек)
+ROLE_COURIER = "courier"
+
+# Формат дат в заказах (см. utils.timezone.format_datetime_dushanbe)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# Служебные слова адреса, которые не определяют район
+_ADDRESS_STOPWORDS = {
+    "ул", "улица", "пр", "проспект", "пер", "переулок", "туп", "тупик", "ш", "шоссе",
+    "дом", "д", "кв", "квартира", "корп", "корпус", "подъезд", "под", "этаж", "эт",
+    "г", "город", "район", "рн", "ориентир", "напротив", "возле", "рядом",
+}
+_MICRODISTRICT_WORDS = {"мкр", "микрорайон", "мкрн"}
+
+
+def normalize_city(city: str) -> str:
+    """Normalize a free-text city name ("  г. Душанбе " becomes "душанбе")"""
+    city = re.sub(r"\s+", " ", (city or "").lower()).strip()
+    return re.sub(r"^(г\.|г |город )\s*", "", city)
+
+
+def _search_keys(username: str) -> Set[str]:
+    """
+    Build search keys for a courier stored as "Name | Phone".
+
+    Every word of the name, the full name and the phone digits are indexed,
+    so a prefix of any of them finds the courier.
+    """
+    parts = username.split(" | ")
+    name = parts[0].lower().strip()
+    keys = {name}
+    keys.update(word for word in re.split(r"\s+", name) if word)
+    if len(parts) > 1:
+        digits = re.sub(r"\D", "", parts[1])
+        if digits:
+            keys.add(digits)
+            # Номер без кода страны, например 992 для Таджикистана
+            if len(digits) > 9:
+                keys.add(digits[-9:])
+    return keys
+
+
+def address_area(address: str, city: str = "") -> str:
+    """
+    Extract the area of a free-text address.
+
+    The area is the first meaningful word of the address, usually the street
+    or district name ("ул. Рудаки 45, кв 3" and "проспект Рудаки" both give
+    "рудаки"); microdistricts keep their number ("мкр 34, дом 5" and
+    "34 мкр" give "мкр 34"). The city repeated in the address is skipped.
+    """
+    tokens = re.findall(r"[^\W_]+", (address or "").lower())
+    for i, token in enumerate(tokens):
+        if token in _MICRODISTRICT_WORDS:
+            if i + 1 < len(tokens) and tokens[i + 1].isdigit():
+                return f"мкр {tokens[i + 1]}"
+            if i > 0 and tokens[i - 1].isdigit():
+                return f"мкр {tokens[i - 1]}"
+            continue
+        if token in _ADDRESS_STOPWORDS or token == city or token.isdigit() or len(token) < 2:
+            continue
+        return token
+    return ""
+
+
+def order_area(order: Dict[str, Any]) -> Tuple[str, str]:
+    """Return the (city, area) key an order is grouped by"""
+    city = normalize_city(order.get("city", ""))
+    return city, address_area(order.get("delivery_address", ""), city)
+
+
+def area_id(key: Tuple[str, str]) -> str:
+    """Return a short ID of an area group that does not change between restarts"""
+    return hashlib.blake2b("|".join(key).encode(), digest_size=5).hexdigest()
+
+
+def orders_fingerprint(orders: List[Dict[str, Any]]) -> str:
+    """Return a short hash of the IDs of a set of orders (to detect that a group has changed)"""
+    ids = ",".join(str(order_id) for order_id in sorted(order["id"] for order in orders))
+    return hashlib.blake2b(ids.encode(), digest_size=4).hexdigest()
+
+
+class DatabaseIndex:
+    """
+    Indexes for users and orders of one database snapshot.
+
+    The indexes hold references to the same dictionaries as the database,
+    so they must be updated whenever an order changes its status or courier.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Drop all indexed data"""
+        self.users_by_id: Dict[int, Dict[str, Any]] = {}
+        self.orders_by_id: Dict[int, Dict[str, Any]] = {}
+        # Словари используются как упорядоченные множества: порядок вставки сохраняется
+        self.orders_by_status: Dict[str, Dict[int, Dict[str, Any]]] = {
+            status: {} for status in ORDER_STATUSES
+        }
+        self.orders_by_shop: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self.orders_by_courier: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        # Курьеры, число их активных (назначенных) заказов и отсортированные ключи поиска
+        self.couriers_by_id: Dict[int, Dict[str, Any]] = {}
+        self.active_by_courier: Dict[int, int] = {}
+        # Сумма к получению от клиентов по активным заказам и число доставок по дням
+        self.cash_by_courier: Dict[int, float] = {}
+        self.delivered_by_day: Dict[str, Dict[int, int]] = {}
+        self._courier_keys: List[Tuple[str, int]] = []
+        # Ожидающие заказы, сгруппированные по городу и району; ID группы — хэш ее ключа
+        self.pending_by_area: Dict[Tuple[str, str], Dict[int, Dict[str, Any]]] = {}
+        self.areas_by_id: Dict[str, Tuple[str, str]] = {}
+        # Заказы в порядке последнего изменения (поле changed_in) для выгрузки изменений
+        self.orders_by_change: Dict[int, Dict[str, Any]] = {}
+        self._courier_keys_dirty = False
+
+    def rebuild(self, db: Dict[str, Any]):
+        """Build all indexes from the database contents"""
+        self.clear()
+        for user in db.get("users", []):
+            self.add_user(user)
+        for order in db.get("orders", []):
+            self.add_order(order)
+        # Заказы без отметки изменения (созданные до ее появления) идут первыми
+        self.orders_by_change = {
+            order["id"]: order
+            for order in sorted(db.get("orders", []), key=lambda order: order.get("changed_in", 0))
+        }
+
+    def add_user(self, user: Dict[str, Any]):
+        """Index a new or updated user"""
+        self.users_by_id[user["id"]] = user
+        if user.get("role") == ROLE_COURIER:
+            self.couriers_by_id[user["id"]] = user
+        else:
+            self.couriers_by_id.pop(user["id"], None)
+        self._courier_keys_dirty = True
+
+    def remove_user(self, user_id: int):
+        """Remove a user from the indexes"""
+        self.users_by_id.pop(user_id, None)
+        if self.couriers_by_id.pop(user_id, None) is not None:
+            self._courier_keys_dirty = True
+
+    def add_order(self, order: Dict[str, Any]):
+        """Index a new order"""
+        order_id = order["id"]
+        self.orders_by_id[order_id] = order
+        self.orders_by_status.setdefault(order.get("status", "pending"), {})[order_id] = order
+        self.orders_by_shop.setdefault(order.get("shop_id"), {})[order_id] = order
+        self.orders_by_change[order_id] = order
+        if order.get("status", "pending") == "pending":
+            self._add_pending_area(order)
+        if order.get("courier_id") is not None:
+            self.orders_by_courier.setdefault(order["courier_id"], {})[order_id] = order
+            if order.get("status") == "assigned":
+                self._change_active(order["courier_id"], 1, order)
+            elif order.get("status") == "delivered":
+                self._count_delivered(order)
+
+    def update_order(
+        self,
+        order: Dict[str, Any],
+        previous_status: str,
+        previous_courier_id: Optional[int] = None
+    ):
+        """Move an order between index buckets after its status or courier changed"""
+        order_id = order["id"]
+
+        if previous_status == "assigned" and previous_courier_id is not None:
+            self._change_active(previous_courier_id, -1, order)
+        if order.get("status") == "assigned" and order.get("courier_id") is not None:
+            self._change_active(order["courier_id"], 1, order)
+        if previous_status != "delivered" and order.get("status") == "delivered":
+            self._count_delivered(order)
+
+        if previous_status != order.get("status"):
+            self.orders_by_status.get(previous_status, {}).pop(order_id, None)
+            self.orders_by_status.setdefault(order["status"], {})[order_id] = order
+            if previous_status == "pending":
+                self._remove_pending_area(order)
+            elif order["status"] == "pending":
+                self._add_pending_area(order)
+
+        courier_id = order.get("courier_id")
+        if previous_courier_id != courier_id:
+            if previous_courier_id is not None:
+                self.orders_by_courier.get(previous_courier_id, {}).pop(order_id, None)
+            if courier_id is not None:
+                self.orders_by_courier.setdefault(courier_id, {})[order_id] = order
+
+    def mark_changed(self, order: Dict[str, Any]):
+        """Move an order to the end of the change order after its changed_in was bumped"""
+        self.orders_by_change.pop(order["id"], None)
+        self.orders_by_change[order["id"]] = order
+
+    def changed_since(self, version: int) -> List[Dict[str, Any]]:
+        """Return orders changed after the given orders version, oldest change first"""
+        if version <= 0:
+            return list(self.orders_by_change.values())
+        changed = []
+        # Просматриваются только изменения после version, а не вся история
+        for order in reversed(self.orders_by_change.values()):
+            if order.get("changed_in", 0) <= version:
+                break
+            changed.append(order)
+        changed.reverse()
+        return changed
+
+    def _change_active(self, courier_id: int, delta: int, order: Dict[str, Any]):
+        count = self.active_by_courier.get(courier_id, 0) + delta
+        if count > 0:
+            self.active_by_courier[courier_id] = count
+            cash = self.cash_by_courier.get(courier_id, 0) + delta * (order.get("payment_amount") or 0)
+            self.cash_by_courier[courier_id] = max(cash, 0)
+        else:
+            self.active_by_courier.pop(courier_id, None)
+            self.cash_by_courier.pop(courier_id, None)
+
+    def _add_pending_area(self, order: Dict[str, Any]):
+        key = order_area(order)
+        self.areas_by_id.setdefault(area_id(key), key)
+        self.pending_by_area.setdefault(key, {})[order["id"]] = order
+
+    def _remove_pending_area(self, order: Dict[str, Any]):
+        key = order_area(order)
+        orders = self.pending_by_area.get(key)
+        if orders is not None:
+            orders.pop(order["id"], None)
+            if not orders:
+                del self.pending_by_area[key]
+
+    def pending_bundles(self, min_size: int) -> List[Dict[str, Any]]:
+        """Return groups of at least `min_size` pending orders to the same area, largest first"""
+        bundles = [
+            {"id": area_id(key), "city": key[0], "area": key[1], "orders": list(orders.values())}
+            for key, orders in self.pending_by_area.items()
+            if len(orders) >= min_size
+        ]
+        bundles.sort(key=lambda bundle: (-len(bundle["orders"]), bundle["orders"][0]["id"]))
+        return bundles
+
+    def bundle_orders(self, bundle_id: str) -> List[Dict[str, Any]]:
+        """Return pending orders of one area group"""
+        key = self.areas_by_id.get(bundle_id)
+        return list(self.pending_by_area.get(key, {}).values()) if key else []
+
+    def _count_delivered(self, order: Dict[str, Any]):
+        courier_id = order.get("courier_id")
+        if courier_id is None or not order.get("delivered_at"):
+            return
+        # Дата доставки — первые 10 символов "YYYY-MM-DD HH:MM:SS"
+        day = self.delivered_by_day.setdefault(order["delivered_at"][:10], {})
+        day[courier_id] = day.get(courier_id, 0) + 1
+
+    def courier_workload(self, date: str) -> List[Dict[str, Any]]:
+        """
+        Return counters of every courier for the given date (YYYY-MM-DD):
+        active orders, deliveries on that date and cash to collect
+        """
+        delivered = self.delivered_by_day.get(date, {})
+        return [
+            {
+                "courier": courier,
+                "active": self.active_by_courier.get(courier_id, 0),
+                "delivered": delivered.get(courier_id, 0),
+                "cash": self.cash_by_courier.get(courier_id, 0),
+            }
+            for courier_id, courier in self.couriers_by_id.items()
+        ]
+
+    def courier_profile(self, courier_id: int, recent: int) -> Dict[str, Any]:
+        """
+        Describe the recent work of a courier.
+
+        Only the last `recent` orders of the courier are looked at, newest
+        first, so the cost does not grow with the history.
+
+        Returns:
+            Shares of recent orders per normalized city and the average
+            delivery time in minutes (None without completed deliveries)
+        """
+        cities: Counter = Counter()
+        durations = []
+        for order in islice(reversed(self.orders_by_courier.get(courier_id, {}).values()), recent):
+            cities[normalize_city(order.get("city", ""))] += 1
+            if order.get("status") == "delivered" and order.get("assigned_at") and order.get("delivered_at"):
+                try:
+                    assigned_at = datetime.strptime(order["assigned_at"], DATETIME_FORMAT)
+                    delivered_at = datetime.strptime(order["delivered_at"], DATETIME_FORMAT)
+                except ValueError:
+                    continue
+                durations.append((delivered_at - assigned_at).total_seconds() / 60)
+
+        total = sum(cities.values())
+        return {
+            "cities": {city: count / total for city, count in cities.items()},
+            "avg_minutes": sum(durations) / len(durations) if durations else None,
+        }
+
+    def search_couriers(self, query: str = "", date: str = "") -> List[Dict[str, Any]]:
+        """
+        Find couriers whose name word, full name or phone starts with the query.
+
+        Results are sorted by the number of active orders, least loaded first,
+        then by deliveries made on `date`, so the day's work is spread evenly.
+        """
+        query = query.lower().strip()
+        if not query:
+            couriers = list(self.couriers_by_id.values())
+        else:
+            if self._courier_keys_dirty:
+                self._courier_keys = sorted(
+                    (key, courier_id)
+                    for courier_id, courier in self.couriers_by_id.items()
+                    for key in _search_keys(courier["username"])
+                )
+                self._courier_keys_dirty = False
+
+            # Запрос из цифр ищем по телефону без пробелов, скобок и "+"
+            prefix = query
+            digits = re.sub(r"\D", "", query)
+            if digits and len(digits) == len(re.sub(r"[\s+()-]", "", query)):
+                prefix = digits
+
+            found = {}
+            start = bisect_left(self._courier_keys, (prefix,))
+            for key, courier_id in islice(self._courier_keys, start, None):
+                if not key.startswith(prefix):
+                    break
+                found[courier_id] = self.couriers_by_id[courier_id]
+            couriers = list(found.values())
+
+        delivered = self.delivered_by_day.get(date, {})
+        couriers.sort(key=lambda c: (
+            self.active_by_courier.get(c["id"], 0),
+            delivered.get(c["id"], 0),
+            c["username"].lower()
+        ))
+        return couriers
+
+    def count(self, status: str) -> int:
+        """Number of orders with the given status"""
+        return len(self.orders_by_status.get(status, {}))
+
+    def page(self, status: str, page: int, page_size: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Return one page of orders with the given status and the total count"""
+        orders = self.orders_by_status.get(status, {})
+        start = page * page_size
+        return list(islice(orders.values(), start, start + page_size)), len(orders)
@@ -0,0 +1,86 @@
+"""Tests for splitting long HTML lists into Telegram-sized messages"""
+import re
+
+from utils.chunker import chunk_cards, split_html
+
+_TAG_RE = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+
+def assert_balanced(piece: str):
+    """Check that every tag opened in a piece is closed in it, in order"""
+    stack = []
+    for closing, name in _TAG_RE.findall(piece):
+        if closing:
+            assert stack and stack[-1] == name, piece
+            stack.pop()
+        else:
+            stack.append(name)
+    assert not stack, piece
+
+
+def test_split_html_short_text_is_one_piece():
+    assert split_html("<b>Заказ #1</b>", 100) == ["<b>Заказ #1</b>"]
+
+
+def test_split_html_respects_limit_and_keeps_text():
+    text = " ".join(f"слово{i}" for i in range(2000))
+    pieces = split_html(text, 1000)
+
+    assert all(len(piece) <= 1000 for piece in pieces)
+    assert "".join(pieces) == text
+    # Части заполняются до лимита, а не до его половины
+    assert len(pieces) == -(-len(text) // 1000)
+
+
+def test_split_html_closes_and_reopens_tags():
+    text = '<b>Итоги <a href="https://example.com">' + "x" * 250 + "</a></b> конец"
+    pieces = split_html(text, 100)
+
+    assert len(pieces) > 1
+    assert all(len(piece) <= 100 for piece in pieces)
+    for piece in pieces:
+        assert_balanced(piece)
+    assert pieces[1].startswith('<b><a href="https://example.com">')
+    # Без служебных тегов текст совпадает с исходным
+    assert _TAG_RE.sub("", "".join(pieces)) == _TAG_RE.sub("", text)
+
+
+def test_split_html_does_not_cut_entities():
+    text = "&amp;" * 100
+    pieces = split_html(text, 32)
+
+    assert all(len(piece) <= 32 for piece in pieces)
+    assert all(re.fullmatch(r"(&amp;)+", piece) for piece in pieces)
+    assert "".join(pieces) == text
+
+
+def test_chunk_cards_splits_only_between_cards():
+    cards = [f"<b>Заказ #{i}</b>\n" + "a" * 80 + "\n\n" for i in range(50)]
+    chunks = list(chunk_cards(cards, header="Заголовок\n\n", limit=500))
+
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert chunks[0].startswith("Заголовок\n\n<b>Заказ #0</b>")
+    assert "".join(chunks) == "Заголовок\n\n" + "".join(cards)
+    for chunk in chunks:
+        assert_balanced(chunk)
+
+
+def test_chunk_cards_card_exactly_at_limit():
+    card = "x" * 100
+    assert list(chunk_cards([card, card], limit=100)) == [card, card]
+
+
+def test_chunk_cards_long_card_fills_the_header_message():
+    header = "h" * 3000
+    card = "<i>" + "y" * 5000 + "</i>"
+    chunks = list(chunk_cards([card], header=header, limit=4000))
+
+    # Заголовок не уходит отдельным сообщением: длинная карточка дописывается к нему
+    assert [len(chunk) for chunk in chunks] == [4000, 4000, len("<i>") + 14 + len("</i>")]
+    assert chunks[0].startswith(header)
+    for chunk in chunks:
+        assert_balanced(chunk)
+
+
+def test_chunk_cards_empty():
+    assert list(chunk_cards([], header="")) == []
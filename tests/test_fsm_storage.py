@@ -0,0 +1,76 @@
+"""Tests for the persistent FSM storage"""
+import asyncio
+import json
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage.fsm_storage import JsonFileStorage
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def make_storage(tmp_path, **kwargs) -> JsonFileStorage:
+    options = {"flush_interval": 0.01, "ttl": 60, "max_sessions": 100, "sweep_interval": 60}
+    options.update(kwargs)
+    return JsonFileStorage(str(tmp_path / "fsm.json"), **options)
+
+
+def test_sweep_removes_only_expired_sessions(tmp_path):
+    async def main():
+        storage = make_storage(tmp_path)
+        for user_id in (1, 2, 3):
+            await storage.set_state(key(user_id), "form:step")
+        # Запись пользователя 1 изменена последней и поэтому свежая
+        await storage.update_data(key(1), {"phone": "+992"})
+        now = time.time()
+        for user_id in (2, 3):
+            storage._records[f"1:{user_id}:{user_id}::default"]["updated_at"] = now - 120
+
+        assert storage.sweep(now) == 2
+        assert await storage.get_state(key(1)) == "form:step"
+        assert await storage.get_state(key(2)) is None
+        assert storage.stats() == {"sessions": 1, "expired": 2, "evicted": 0}
+        await storage.close()
+
+    asyncio.run(main())
+
+
+def test_oldest_sessions_are_evicted(tmp_path):
+    async def main():
+        storage = make_storage(tmp_path, max_sessions=3)
+        for user_id in (1, 2, 3):
+            await storage.set_state(key(user_id), "form:step")
+        # Обращение к записи 1 переносит ее в конец, поэтому вытесняется запись 2
+        await storage.set_data(key(1), {"step": 2})
+        await storage.set_state(key(4), "form:step")
+
+        assert [await storage.get_state(key(user_id)) for user_id in (1, 2, 3, 4)] == [
+            "form:step", None, "form:step", "form:step"
+        ]
+        assert storage.stats()["evicted"] == 1
+        await storage.close()
+
+    asyncio.run(main())
+
+
+def test_finished_sessions_are_removed_and_state_survives_restart(tmp_path):
+    async def main():
+        storage = make_storage(tmp_path)
+        await storage.set_state(key(1), "form:step")
+        await storage.set_data(key(1), {"phone": "+992"})
+        await storage.set_state(key(2), "form:step")
+        await storage.set_state(key(2), None)
+        await storage.close()
+
+        with open(tmp_path / "fsm.json", encoding="utf-8") as f:
+            assert list(json.load(f)) == ["1:1:1::default"]
+
+        restored = make_storage(tmp_path)
+        assert await restored.get_state(key(1)) == "form:step"
+        assert await restored.get_data(key(1)) == {"phone": "+992"}
+        await restored.close()
+
+    asyncio.run(main())
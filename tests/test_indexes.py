@@ -0,0 +1,98 @@
+"""Tests for the in-memory database indexes"""
+from storage.indexes import DatabaseIndex, area_id, order_area
+
+
+def make_db():
+    return {
+        "users": [
+            {"id": 100, "username": "Али | +992 900 00 00 01", "role": "courier"},
+            {"id": 101, "username": "Бахром | 900000002", "role": "courier"},
+            {"id": 20, "username": "Магазин", "role": "shop"},
+        ],
+        "orders": [
+            {"id": 1, "status": "pending", "shop_id": 20, "city": "Душанбе",
+             "delivery_address": "мкр 34, дом 5", "payment_amount": 10, "changed_in": 3},
+            {"id": 2, "status": "pending", "shop_id": 20, "city": "г. Душанбе",
+             "delivery_address": "34 мкр", "payment_amount": 15, "changed_in": 1},
+            {"id": 3, "status": "assigned", "shop_id": 20, "city": "Худжанд", "delivery_address": "ул. Ленина 1",
+             "payment_amount": 20, "courier_id": 100, "changed_in": 2},
+        ],
+    }
+
+
+def build():
+    db = make_db()
+    index = DatabaseIndex()
+    index.rebuild(db)
+    return db, index
+
+
+def test_rebuild_fills_buckets():
+    _, index = build()
+
+    assert list(index.orders_by_status["pending"]) == [1, 2]
+    assert list(index.orders_by_status["assigned"]) == [3]
+    assert set(index.couriers_by_id) == {100, 101}
+    assert index.active_by_courier == {100: 1}
+    assert index.cash_by_courier == {100: 20}
+    # Оба адреса относятся к одному микрорайону одного города
+    assert list(index.pending_by_area) == [("душанбе", "мкр 34")]
+    assert [bundle["id"] for bundle in index.pending_bundles(2)] == [area_id(("душанбе", "мкр 34"))]
+
+
+def test_assign_moves_order_between_buckets():
+    _, index = build()
+    order = index.orders_by_id[1]
+
+    order.update(status="assigned", courier_id=101)
+    index.update_order(order, "pending", None)
+
+    assert 1 not in index.orders_by_status["pending"]
+    assert 1 in index.orders_by_status["assigned"]
+    assert 1 in index.orders_by_courier[101]
+    assert index.active_by_courier == {100: 1, 101: 1}
+    assert index.cash_by_courier[101] == 10
+    # В группе остался один заказ, поэтому она больше не показывается
+    assert index.pending_bundles(2) == []
+    assert index.bundle_orders(area_id(order_area(order))) == [index.orders_by_id[2]]
+
+
+def test_deliver_moves_order_and_counts_delivery():
+    _, index = build()
+    order = index.orders_by_id[3]
+
+    order.update(status="delivered", delivered_at="2026-10-19 12:00:00")
+    index.update_order(order, "assigned", 100)
+
+    assert 3 in index.orders_by_status["delivered"]
+    assert not index.orders_by_status["assigned"]
+    assert index.active_by_courier == {}
+    assert index.cash_by_courier == {}
+    assert index.delivered_by_day == {"2026-10-19": {100: 1}}
+    workload = {entry["courier"]["id"]: entry for entry in index.courier_workload("2026-10-19")}
+    assert workload[100]["delivered"] == 1
+    assert workload[100]["active"] == 0
+
+
+def test_reassign_moves_order_between_couriers():
+    _, index = build()
+    order = index.orders_by_id[3]
+
+    order["courier_id"] = 101
+    index.update_order(order, "assigned", 100)
+
+    assert 3 not in index.orders_by_courier[100]
+    assert 3 in index.orders_by_courier[101]
+    assert index.active_by_courier == {101: 1}
+
+
+def test_changed_since_follows_change_order():
+    _, index = build()
+
+    assert [order["id"] for order in index.changed_since(0)] == [2, 3, 1]
+    assert [order["id"] for order in index.changed_since(1)] == [3, 1]
+
+    order = index.orders_by_id[2]
+    order["changed_in"] = 4
+    index.mark_changed(order)
+    assert [order["id"] for order in index.changed_since(3)] == [2]
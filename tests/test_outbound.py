@@ -0,0 +1,61 @@
+"""Tests for the outbound message queue"""
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import utils.outbound
+from utils.outbound import OutboundQueue
+
+
+class FakeBot:
+    """Bot whose send_message to a chat fails with the given errors before succeeding"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((time.monotonic(), chat_id, text))
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        return f"sent {text}"
+
+
+def run_queue(bot, *messages, max_retries=3):
+    async def main():
+        queue = OutboundQueue(global_rate=100, chat_rate=100, max_retries=max_retries)
+        queue.start(bot)
+        futures = [queue.send_message(chat_id, text) for chat_id, text in messages]
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        await queue.stop(timeout=1)
+        return queue, results
+
+    return asyncio.run(main())
+
+
+def test_outbound_retries_after_flood_control():
+    method = SendMessage(chat_id=1, text="a")
+    bot = FakeBot({1: [TelegramRetryAfter(method, "Flood control exceeded", 0.3)]})
+
+    queue, results = run_queue(bot, (1, "a"), (1, "b"))
+
+    assert results == ["sent a", "sent b"]
+    # Первое сообщение отправлено повторно не раньше, чем разрешил Telegram, и порядок сохранен
+    assert [text for _, _, text in bot.calls] == ["a", "a", "b"]
+    assert bot.calls[1][0] - bot.calls[0][0] >= 0.3
+    assert queue.retry_count == 1
+    assert queue.sent_count == 2
+
+
+def test_outbound_drops_after_max_retries(monkeypatch):
+    monkeypatch.setattr(utils.outbound, "RETRY_BASE_DELAY", 0.01)
+    method = SendMessage(chat_id=1, text="a")
+    bot = FakeBot({1: [TelegramNetworkError(method, "timeout") for _ in range(3)]})
+
+    queue, results = run_queue(bot, (1, "a"), (2, "b"), max_retries=2)
+
+    assert results == [None, "sent b"]
+    assert queue.retry_count == 2
+    assert queue.drop_count == 1
@@ -0,0 +1,30 @@
+"""Tests for the token bucket rate limiter"""
+import pytest
+
+from utils.ratelimit import TokenBucket
+
+
+def test_token_bucket_starts_full_and_refills():
+    bucket = TokenBucket(rate=2, capacity=3)
+    start = bucket.updated_at
+
+    assert [bucket.consume(start) for _ in range(4)] == [True, True, True, False]
+    assert bucket.time_until_available(start) == pytest.approx(0.5)
+    # Через полсекунды восстанавливается один токен
+    assert bucket.consume(start + 0.5)
+    assert not bucket.consume(start + 0.5)
+
+
+def test_token_bucket_is_capped_by_capacity():
+    bucket = TokenBucket(rate=10, capacity=2)
+    start = bucket.updated_at
+    bucket.consume(start)
+
+    assert bucket.is_full(start + 60)
+    assert bucket.tokens == 2
+    assert [bucket.consume(start + 60) for _ in range(3)] == [True, True, False]
+
+
+def test_token_bucket_default_capacity():
+    assert TokenBucket(rate=0.5).capacity == 1
+    assert TokenBucket(rate=30).capacity == 30
@@ -0,0 +1,138 @@
+"""Tests for the report engine and its saved numbers of closed days"""
+import asyncio
+import json
+import random
+from datetime import timedelta
+
+import pytest
+
+import storage.database as database
+from storage.indexes import DatabaseIndex
+from utils.reports import ReportEngine, ReportRequest, build_snapshot, compute_report
+from utils.timezone import get_datetime_dushanbe
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def make_orders(count: int = 500):
+    rng = random.Random(7)
+    now = get_datetime_dushanbe().replace(tzinfo=None)
+    orders = []
+    for order_id in range(1, count + 1):
+        created = now - timedelta(minutes=rng.randint(60, 60 * 24 * 20))
+        order = {
+            "id": order_id, "status": "pending", "shop_id": 20,
+            "shop_name": rng.choice(["Магазин А", "Магазин Б"]),
+            "city": rng.choice(["Душанбе", "г. Душанбе", "Худжанд"]),
+            "delivery_address": "ул. Рудаки 1", "customer_phone": "+992",
+            "payment_amount": rng.choice([0, 10, 25.5]),
+            "created_at": created.strftime(DATETIME_FORMAT),
+        }
+        roll = rng.random()
+        if roll < 0.7:
+            # Часть заказов доставлена на следующий день после создания
+            delivered = created + timedelta(minutes=rng.randint(20, 60 * 30))
+            order.update(status="delivered", courier_id=100, courier_name=rng.choice(["Али", "Бахром"]),
+                         delivered_at=min(delivered, now).strftime(DATETIME_FORMAT))
+        elif roll < 0.85:
+            order.update(status="assigned", courier_id=100, courier_name="Али")
+        orders.append(order)
+    return orders
+
+
+@pytest.fixture
+def orders_db(tmp_path, monkeypatch):
+    """Database module working on a temporary file with generated orders"""
+    path = tmp_path / "data.json"
+    orders = make_orders()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"users": [], "orders": orders, "next_order_id": len(orders) + 1,
+                   "outbox": [], "next_outbox_id": 1, "cards": {}}, f)
+
+    monkeypatch.setattr(database, "DATABASE_FILE", str(path))
+    monkeypatch.setattr(database, "_db_cache", None)
+    monkeypatch.setattr(database, "_db_signature", None)
+    monkeypatch.setattr(database, "_index", DatabaseIndex())
+    monkeypatch.setattr(database, "_orders_version", 0)
+    monkeypatch.setattr(database, "_db_loaded", False)
+    monkeypatch.setattr(database, "_external_version", 0)
+    monkeypatch.setattr(database, "db_lock", asyncio.Lock())
+    return path
+
+
+def closed_range(days_back: int, length: int) -> ReportRequest:
+    end = get_datetime_dushanbe().date() - timedelta(days=days_back)
+    start = end - timedelta(days=length - 1)
+    return ReportRequest(start, end, "test")
+
+
+async def full_report(request: ReportRequest):
+    return compute_report(build_snapshot(await database.get_all_orders()), request)
+
+
+def assert_same_report(result, expected):
+    for field in ("total", "statuses", "created", "delivered", "breakdown"):
+        assert result[field] == expected[field], field
+    assert result["amount"] == pytest.approx(expected["amount"])
+
+
+@pytest.mark.parametrize("breakdown", ["", "courier", "shop", "city"])
+def test_closed_days_match_full_recompute(orders_db, tmp_path, breakdown):
+    async def main():
+        engine = ReportEngine(str(tmp_path / "daily.json"), days_kept=30)
+        request = closed_range(1, 14)
+        request.breakdown = breakdown
+
+        # Первый запрос считает дни, второй собирает отчет из сохраненных итогов
+        first = await engine.compute(request)
+        second = await engine.compute(request)
+        expected = await full_report(request)
+        assert_same_report(first, expected)
+        assert_same_report(second, expected)
+
+        # Итоги переживают перезапуск
+        restarted = ReportEngine(str(tmp_path / "daily.json"), days_kept=30)
+        assert_same_report(await restarted.compute(request), expected)
+
+    asyncio.run(main())
+
+
+def test_late_delivery_invalidates_saved_day(orders_db, tmp_path):
+    async def main():
+        engine = ReportEngine(str(tmp_path / "daily.json"), days_kept=30)
+        request = closed_range(1, 10)
+        await engine.compute(request)
+
+        # Заказ, созданный в закрытый день, доставлен позже
+        orders = await database.get_all_orders()
+        order = next(
+            order for order in orders
+            if order["status"] == "assigned" and order["created_at"][:10] <= request.end.isoformat()
+        )
+        assert await database.mark_order_as_delivered(
+            order["id"], order["courier_id"], f"{request.end.isoformat()} 23:00:00"
+        )
+
+        expected = await full_report(request)
+        assert_same_report(await engine.compute(request), expected)
+        restarted = ReportEngine(str(tmp_path / "daily.json"), days_kept=30)
+        assert_same_report(await restarted.compute(request), expected)
+
+    asyncio.run(main())
+
+
+def test_external_change_drops_saved_days(orders_db, tmp_path):
+    async def main():
+        engine = ReportEngine(str(tmp_path / "daily.json"), days_kept=30)
+        request = closed_range(1, 10)
+        await engine.compute(request)
+
+        # Файл базы перезаписан снаружи, например скриптом очистки
+        with open(orders_db, "w", encoding="utf-8") as f:
+            json.dump({"users": [], "orders": [], "next_order_id": 1}, f)
+
+        result = await engine.compute(request)
+        assert result["created"] == 0
+        assert result["delivered"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""Tests for cron schedules of the background job scheduler"""
+from datetime import datetime
+
+import pytest
+import pytz
+
+from utils.scheduler import CronSchedule
+from utils.timezone import DUSHANBE_TIMEZONE
+
+
+def dushanbe(*args) -> datetime:
+    return DUSHANBE_TIMEZONE.localize(datetime(*args))
+
+
+def test_next_after_step_within_hour():
+    schedule = CronSchedule("*/15 * * * *")
+    assert schedule.next_after(dushanbe(2026, 10, 19, 10, 7)) == dushanbe(2026, 10, 19, 10, 15)
+
+
+def test_next_after_is_strictly_after():
+    schedule = CronSchedule("30 3 * * *")
+    # Совпадение с текущей минутой не считается: следующий запуск — завтра
+    assert schedule.next_after(dushanbe(2026, 10, 19, 3, 30)) == dushanbe(2026, 10, 20, 3, 30)
+    assert schedule.next_after(dushanbe(2026, 10, 19, 3, 29, 59)) == dushanbe(2026, 10, 19, 3, 30)
+
+
+def test_next_after_converts_to_dushanbe_time():
+    schedule = CronSchedule("0 9 * * *")
+    # 03:30 UTC — это 08:30 в Душанбе
+    assert schedule.next_after(datetime(2026, 10, 19, 3, 30, tzinfo=pytz.utc)) == dushanbe(2026, 10, 19, 9, 0)
+
+
+def test_next_after_weekday():
+    schedule = CronSchedule("0 9 * * 1")
+    # 2026-10-18 — воскресенье, следующий понедельник — 19-е
+    assert schedule.next_after(dushanbe(2026, 10, 18, 12, 0)) == dushanbe(2026, 10, 19, 9, 0)
+    assert schedule.next_after(dushanbe(2026, 10, 19, 9, 0)) == dushanbe(2026, 10, 26, 9, 0)
+
+
+def test_next_after_day_or_weekday():
+    # Как в cron: заданы и день месяца, и день недели — подходит любой из них
+    schedule = CronSchedule("0 0 13 * 5")
+    assert schedule.next_after(dushanbe(2026, 10, 10, 0, 0)) == dushanbe(2026, 10, 13, 0, 0)
+    assert schedule.next_after(dushanbe(2026, 10, 13, 0, 0)) == dushanbe(2026, 10, 16, 0, 0)
+
+
+def test_next_after_skips_short_months():
+    schedule = CronSchedule("0 0 31 * *")
+    assert schedule.next_after(dushanbe(2026, 1, 31, 12, 0)) == dushanbe(2026, 3, 31, 0, 0)
+
+
+def test_next_after_year_boundary():
+    schedule = CronSchedule("5 0 1 1 *")
+    assert schedule.next_after(dushanbe(2026, 10, 19, 0, 0)) == dushanbe(2027, 1, 1, 0, 5)
+
+
+def test_parse_lists_ranges_and_steps():
+    schedule = CronSchedule("5/20 8-10,22 * * *")
+    assert schedule.minutes == {5, 25, 45}
+    assert schedule.hours == {8, 9, 10, 22}
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 5-2 * * *", "0 0 31 2 *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression).next_after(dushanbe(2026, 10, 19, 0, 0))
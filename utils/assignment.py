@@ -0,0 +1,182 @@
+"""
+Assignment of orders to couriers.
+This module assigns orders together with the courier notification and live
+card updates, and picks couriers automatically by their current load, the
+cities they work in and how fast they deliver.
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from config import (
+    AUTO_ASSIGN_MAX_ACTIVE, AUTO_ASSIGN_CITY_BONUS, AUTO_ASSIGN_HISTORY, AUTO_ASSIGN_BATCH_SIZE
+)
+from keyboards.courier_kb import get_delivery_confirmation_keyboard
+from storage.database import (
+    assign_order_to_courier, assign_orders_to_couriers, get_assignment_candidates,
+    get_order_cards, get_pending_orders_page
+)
+from storage.indexes import normalize_city
+from utils.cards import render_order_card
+from utils.outbox import make_notification, make_card_updates, outbox_worker
+
+logger = logging.getLogger(__name__)
+
+
+def format_courier_name(courier) -> str:
+    """Build the courier name stored in an order (name and phone)"""
+    # Разделяем имя и телефон курьера (формат: "Имя | Телефон")
+    courier_info = courier['username'].split(" | ")
+    courier_name = courier_info[0]
+    if len(courier_info) > 1:
+        courier_name += f" ({courier_info[1]})"
+    return courier_name
+
+
+async def _assignment_notifications(order, courier, source_message: Optional[Message] = None):
+    """Build the courier notification and live card updates for an assignment"""
+    order_id = order['id']
+    courier_id = courier['id']
+
+    # Уведомление курьеру с кнопками сохраняется вместе с назначением
+    notifications = [make_notification(
+        courier_id,
+        render_order_card(order, "assignment"),
+        reply_markup=await get_delivery_confirmation_keyboard(order_id),
+        order_id=order_id,
+        variant="courier"
+    )]
+
+    # Карточки администраторов и магазина обновляются на месте
+    skip_message = None
+    if source_message is not None:
+        skip_message = (source_message.chat.id, source_message.message_id)
+    notifications += make_card_updates(
+        {**order, "status": "assigned", "courier_id": courier_id, "courier_name": format_courier_name(courier)},
+        await get_order_cards(order_id),
+        {"admin": "admin_status", "shop": "shop"},
+        skip_message
+    )
+    return notifications
+
+
+async def assign_order(order, courier, source_message: Optional[Message] = None) -> bool:
+    """
+    Assign an order to a courier, queue the courier notification and
+    update live cards of the order
+
+    Args:
+        order: Pending order
+        courier: Courier user
+        source_message: Message the admin pressed the button on; it is updated by the caller
+
+    Returns:
+        False if the order is no longer pending
+    """
+    success = await assign_order_to_courier(
+        order['id'], courier['id'], format_courier_name(courier),
+        notifications=await _assignment_notifications(order, courier, source_message)
+    )
+    if success:
+        outbox_worker.wake()
+    return success
+
+
+async def assign_orders(plan: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[int]:
+    """
+    Assign several orders in one database write
+
+    Args:
+        plan: Pairs of a pending order and a courier
+
+    Returns:
+        IDs of the assigned orders; orders assigned by someone else meanwhile are skipped
+    """
+    assignments = [
+        {
+            "order_id": order['id'],
+            "courier_id": courier['id'],
+            "courier_name": format_courier_name(courier),
+            "notifications": await _assignment_notifications(order, courier),
+        }
+        for order, courier in plan
+    ]
+    assigned = await assign_orders_to_couriers(assignments)
+    if assigned:
+        outbox_worker.wake()
+    return assigned
+
+
+def _score(city: str, candidate: Dict[str, Any], active: int, default_minutes: float) -> float:
+    """
+    Score a courier for an order; lower is better.
+
+    Every active order counts as one point and every hour of average delivery
+    time as another. A courier who recently delivered to the same city gets a
+    bonus proportional to the share of such orders.
+    """
+    minutes = candidate["avg_minutes"]
+    if minutes is None:
+        minutes = default_minutes
+    return active + minutes / 60 - AUTO_ASSIGN_CITY_BONUS * candidate["cities"].get(city, 0)
+
+
+def plan_assignments(
+    orders: List[Dict[str, Any]],
+    candidates: List[Dict[str, Any]]
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Choose a courier for each order in one pass
+
+    Orders are taken in the given order (oldest first) and every choice
+    increases the load of the chosen courier, so a batch is spread over
+    couriers instead of going to the one who was free at the start.
+    Orders for which all couriers are at AUTO_ASSIGN_MAX_ACTIVE are left out.
+
+    Args:
+        orders: Pending orders
+        candidates: Couriers from get_assignment_candidates()
+
+    Returns:
+        Pairs of an order and the chosen courier
+    """
+    loads = {candidate["courier"]["id"]: candidate["active"] for candidate in candidates}
+
+    # Курьеры без завершенных доставок считаются средними по скорости
+    known = [c["avg_minutes"] for c in candidates if c["avg_minutes"] is not None]
+    default_minutes = sum(known) / len(known) if known else 0
+
+    plan = []
+    for order in orders:
+        eligible = [c for c in candidates if loads[c["courier"]["id"]] < AUTO_ASSIGN_MAX_ACTIVE]
+        if not eligible:
+            break
+
+        city = normalize_city(order.get("city", ""))
+        best = min(eligible, key=lambda c: (
+            _score(city, c, loads[c["courier"]["id"]], default_minutes),
+            c["courier"]["username"].lower()
+        ))
+        loads[best["courier"]["id"]] += 1
+        plan.append((order, best["courier"]))
+    return plan
+
+
+async def suggest_courier(order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the best courier for an order or None if every courier is busy"""
+    plan = plan_assignments([order], await get_assignment_candidates(AUTO_ASSIGN_HISTORY))
+    return plan[0][1] if plan else None
+
+
+async def plan_pending_orders(limit: int = AUTO_ASSIGN_BATCH_SIZE):
+    """
+    Plan assignments for the oldest pending orders
+
+    Returns:
+        Pairs of an order and the chosen courier and the total number of pending orders
+    """
+    orders, total = await get_pending_orders_page(0, limit)
+    if not orders:
+        return [], total
+    return plan_assignments(orders, await get_assignment_candidates(AUTO_ASSIGN_HISTORY)), total
@@ -0,0 +1,242 @@
+"""
+Order card rendering.
+This module builds order cards for admins, couriers and shops in one place
+and caches rendered cards by order version, so listing unchanged orders again
+does not format them from scratch. Shop, customer and courier fields come
+from users and are escaped, since every card is sent as HTML.
+"""
+import html
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+from config import ORDER_CARD_CACHE_SIZE
+
+# Названия статусов заказа для магазинов
+STATUS_NAMES = {
+    "pending": "Ожидает",
+    "assigned": "Назначен",
+    "delivered": "Доставлен",
+}
+
+STATUS_EMOJI = {
+    "pending": "🔴",
+    "assigned": "🟡",
+    "delivered": "🟢",
+}
+
+
+def format_payment(amount) -> str:
+    """Format the amount the courier collects from the customer"""
+    amount = amount or 0
+    return f"{amount:.2f}" if amount > 0 else "Нет"
+
+
+def _render_admin(order: Dict[str, Any]) -> str:
+    """Pending order in the admin order browser"""
+    return (
+        f"Заказ <b>#{order['id']}</b>\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n"
+        f"🔄 Статус: {order['status'].capitalize()}\n\n"
+    )
+
+
+def _render_picker(order: Dict[str, Any]) -> str:
+    """Header of the courier picker"""
+    return (
+        f"<b>Назначение заказа #{order['id']}</b>\n\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n\n"
+    )
+
+
+def _render_new_order(order: Dict[str, Any]) -> str:
+    """Admin notification about a new order"""
+    return (
+        f"📦 <b>Новый заказ #{order['id']}</b>\n\n"
+        f"🏪 От магазина: {html.escape(order['shop_name'])}\n"
+        f"📱 Телефон клиента: {html.escape(order['customer_phone'])}\n"
+        f"🏙️ Город: {html.escape(order['city'])}\n"
+        f"📍 Адрес доставки: {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони"
+    )
+
+
+def _render_admin_status(order: Dict[str, Any]) -> str:
+    """Admin new-order card updated after the order changed its status"""
+    status = order.get('status', 'pending')
+    response = (
+        f"📦 <b>Заказ #{order['id']}</b> - {STATUS_EMOJI.get(status, '🔴')} "
+        f"{STATUS_NAMES.get(status, status)}\n\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n"
+    )
+
+    if order.get('courier_name'):
+        response += f"🚚 Курьер: {html.escape(order['courier_name'])}\n"
+
+    if status == "delivered" and "delivered_at" in order:
+        response += f"🕒 Доставлен в: {order['delivered_at']}\n"
+
+    return response
+
+
+def _render_summary(order: Dict[str, Any]) -> str:
+    """One line of the admin digest"""
+    return (
+        f"#{order['id']} • {html.escape(order['shop_name'])} → {html.escape(order['city'])}, {html.escape(order['delivery_address'])} • "
+        f"{format_payment(order.get('payment_amount'))} сомони"
+    )
+
+
+def _render_assignment(order: Dict[str, Any]) -> str:
+    """Courier notification about a new assignment"""
+    return (
+        f"📦 <b>Новое назначение доставки - Заказ #{order['id']}</b>\n\n"
+        f"📱 Телефон клиента: {html.escape(order['customer_phone'])}\n"
+        f"🏙️ Город: {html.escape(order['city'])}\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📍 Адрес доставки: {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони"
+    )
+
+
+def _render_courier(order: Dict[str, Any]) -> str:
+    """Active delivery of a courier"""
+    return (
+        f"🚚 <b>Активная доставка: Заказ #{order['id']}</b>\n\n"
+        f"🏪 <b>Магазин:</b> {html.escape(order['shop_name'])}\n"
+        f"📱 <b>Клиент:</b> {html.escape(order['customer_phone'])}\n"
+        f"📍 <b>Адрес:</b> {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 <b>Сумма к оплате:</b> {format_payment(order.get('payment_amount'))} сомони\n"
+        f"🕒 <b>Назначен:</b> {order.get('assigned_at', 'Н/Д')}\n\n"
+        f"Нажмите кнопку <b>✅ Доставлено</b>, когда заказ будет доставлен клиенту."
+    )
+
+
+def _render_courier_history(order: Dict[str, Any]) -> str:
+    """Completed delivery in the courier history"""
+    return (
+        f"🟢 <b>Заказ #{order['id']}</b>\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n"
+        f"🕒 Доставлен в: {order.get('delivered_at', 'Н/Д')}\n\n"
+    )
+
+
+def _render_delivered(order: Dict[str, Any]) -> str:
+    """Admin and shop notification about a completed delivery"""
+    return (
+        f"✅ <b>Заказ #{order['id']} доставлен!</b>\n\n"
+        f"🏪 Магазин: {html.escape(order['shop_name'])}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n"
+        f"🕒 Доставлен в: {order.get('delivered_at', 'Н/Д')}\n"
+        f"🚚 Курьер: {html.escape(order.get('courier_name', 'Н/Д'))}"
+    )
+
+
+def _render_shop(order: Dict[str, Any]) -> str:
+    """Order in the shop order list"""
+    status = order.get('status', 'pending')
+    response = (
+        f"📦 <b>Заказ #{order['id']}</b> - {STATUS_EMOJI.get(status, '🔴')} "
+        f"{STATUS_NAMES.get(status, status)}\n"
+        f"📱 Клиент: {html.escape(order['customer_phone'])}\n"
+        f"📍 Адрес: {html.escape(order['city'])}, {html.escape(order['delivery_address'])}\n"
+        f"💰 Сумма к оплате: {format_payment(order.get('payment_amount'))} сомони\n"
+    )
+
+    if status == "delivered" and "delivered_at" in order:
+        response += f"🕒 Доставлен в: {order['delivered_at']}\n"
+
+    if status == "assigned" and "courier_name" in order:
+        response += f"🚚 Курьер: {html.escape(order['courier_name'])}\n"
+
+    return response + "\n"
+
+
+_RENDERERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "admin": _render_admin,
+    "picker": _render_picker,
+    "new_order": _render_new_order,
+    "admin_status": _render_admin_status,
+    "summary": _render_summary,
+    "assignment": _render_assignment,
+    "courier": _render_courier,
+    "courier_history": _render_courier_history,
+    "delivered": _render_delivered,
+    "shop": _render_shop,
+}
+
+
+class CardCache:
+    """
+    LRU cache of rendered order cards.
+
+    Cards are keyed by (order id, order version, variant). The database bumps
+    the version on every change of an order, so stale cards are never
+    returned and simply age out of the cache.
+    """
+
+    def __init__(self, max_size: int = ORDER_CARD_CACHE_SIZE):
+        self.max_size = max_size
+        self._cards: "OrderedDict[Tuple[int, int, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, order: Dict[str, Any], variant: str, cached: bool = True) -> str:
+        """
+        Render an order card
+
+        Args:
+            order: Order from the database
+            variant: Card variant (admin, courier, shop, ...)
+            cached: False for orders modified outside the database (e.g. a preview
+                of a status change), which must not be stored under their version
+
+        Returns:
+            Card text in HTML
+        """
+        renderer = _RENDERERS[variant]
+        if not cached:
+            return renderer(order)
+
+        key = (order["id"], order.get("version", 0), variant)
+        card = self._cards.get(key)
+        if card is not None:
+            self.hits += 1
+            self._cards.move_to_end(key)
+            return card
+
+        self.misses += 1
+        card = self._cards[key] = renderer(order)
+        if len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+        return card
+
+    def clear(self):
+        """Drop all cached cards"""
+        self._cards.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache size and hit counters"""
+        return {"size": len(self._cards), "hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш карточек заказов
+card_cache = CardCache()
+
+
+def render_order_card(order: Dict[str, Any], variant: str, cached: bool = True) -> str:
+    """Render an order card through the shared cache"""
+    return card_cache.render(order, variant, cached)
@@ -0,0 +1,150 @@
+"""
+Splitting long lists into Telegram-sized messages.
+This module groups rendered cards (orders, users) into chunks below the
+message length limit, keeping HTML tags balanced, and sends them through the
+outbound queue.
+"""
+import asyncio
+import re
+from typing import Any, Iterable, Iterator, List, Optional
+
+from utils.outbound import outbound
+
+# Лимит Telegram — 4096 символов; оставляем запас на подсчет символов в UTF-16
+MESSAGE_LIMIT = 4000
+
+_TOKEN_RE = re.compile(r"<[^>]+>|&#?\w+;|[^<&]+|[<&]")
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z0-9-]+)[^>]*?(/?)>")
+
+
+def _split_text(text: str, size: int) -> List[str]:
+    """Split plain text into pieces of at most `size` characters, preferring line breaks"""
+    pieces = []
+    while len(text) > size:
+        # Разрыв строки или пробел ищем только во второй половине, чтобы не плодить короткие части
+        cut = text.rfind("\n", size // 2, size)
+        if cut <= 0:
+            cut = text.rfind(" ", size // 2, size)
+        if cut <= 0:
+            cut = size
+        pieces.append(text[:cut])
+        text = text[cut:]
+    pieces.append(text)
+    return pieces
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Split an HTML fragment into pieces no longer than `limit`.
+
+    Tags open at a split point are closed at the end of the piece and
+    reopened at the start of the next one, so every piece is valid HTML.
+    """
+    pieces = []
+    current = ""
+    open_tags: List[tuple] = []  # (name, full opening tag)
+
+    def closing() -> str:
+        return "".join(f"</{name}>" for name, _ in reversed(open_tags))
+
+    def flush():
+        nonlocal current
+        pieces.append(current + closing())
+        current = "".join(tag for _, tag in open_tags)
+
+    for token in _TOKEN_RE.findall(text):
+        tag = _TAG_RE.fullmatch(token)
+
+        if tag is None and not token.startswith("&"):
+            # Длинный текст дописываем в текущую часть до лимита, остаток переносим в следующие
+            while len(current) + len(token) + len(closing()) > limit:
+                room = limit - len(current) - len(closing())
+                reopened = "".join(tag for _, tag in open_tags)
+                if room <= 0 and current != reopened:
+                    flush()
+                    continue
+                part = _split_text(token, max(room, 1))[0]
+                current += part
+                token = token[len(part):]
+                flush()
+            current += token
+            continue
+
+        if len(current) + len(token) + len(closing()) > limit and current.strip():
+            flush()
+        current += token
+
+        if tag:
+            is_closing, name, self_closing = tag.group(1), tag.group(2).lower(), tag.group(3)
+            if is_closing:
+                for i in range(len(open_tags) - 1, -1, -1):
+                    if open_tags[i][0] == name:
+                        del open_tags[i]
+                        break
+            elif not self_closing:
+                open_tags.append((name, token))
+
+    if current.strip():
+        pieces.append(current + closing())
+    return pieces
+
+
+def chunk_cards(cards: Iterable[str], header: str = "", limit: int = MESSAGE_LIMIT) -> Iterator[str]:
+    """
+    Group cards into messages no longer than `limit`.
+
+    Messages are split only between cards; a single card longer than the
+    limit is appended to the current message (or the header) and split with
+    `split_html`. The header is put before the first card. Cards are consumed
+    lazily, so only one message is kept in memory.
+    """
+    current = header
+    for card in cards:
+        if len(current) + len(card) <= limit:
+            current += card
+            continue
+
+        if len(card) > limit:
+            pieces = split_html(current + card, limit)
+            yield from pieces[:-1]
+            current = pieces[-1] if pieces else ""
+            continue
+
+        if current.strip():
+            yield current
+        current = card
+
+    if current.strip():
+        yield current
+
+
+def send_chunked(
+    chat_id: int,
+    cards: Iterable[str],
+    header: str = "",
+    reply_markup: Optional[Any] = None,
+    **kwargs
+) -> Optional[asyncio.Future]:
+    """
+    Send cards as one or more messages through the outbound queue
+
+    Args:
+        chat_id: Recipient chat ID
+        cards: Rendered cards, each ending with its own separator
+        header: Text placed before the first card
+        reply_markup: Keyboard attached to the last message
+        **kwargs: Additional send_message arguments (e.g. parse_mode)
+
+    Returns:
+        Future of the last message or None if there was nothing to send
+    """
+    previous = None
+    future = None
+    for chunk in chunk_cards(cards, header):
+        if previous is not None:
+            outbound.send_message(chat_id, previous, **kwargs)
+        previous = chunk
+
+    if previous is not None:
+        future = outbound.send_message(chat_id, previous, reply_markup=reply_markup, **kwargs)
+    return future
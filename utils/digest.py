@@ -0,0 +1,123 @@
+"""
+Digest mode for admin new-order notifications.
+While traffic is low every new order is sent to admins right away. During
+bursts the alerts are buffered and sent as one summary message per admin.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, List, Optional, Set, Tuple
+
+from config import (
+    ADMIN_CHAT_IDS, ADMIN_DIGEST_ENABLED, ADMIN_DIGEST_INTERVAL,
+    ADMIN_DIGEST_MAX_ORDERS, ADMIN_DIGEST_BURST_THRESHOLD
+)
+from storage.database import register_order_cards
+from utils.outbound import outbound
+
+logger = logging.getLogger(__name__)
+
+
+class AdminDigest:
+    """Buffers new-order alerts for admins during bursts"""
+
+    def __init__(
+        self,
+        enabled: bool = ADMIN_DIGEST_ENABLED,
+        interval: float = ADMIN_DIGEST_INTERVAL,
+        max_orders: int = ADMIN_DIGEST_MAX_ORDERS,
+        burst_threshold: int = ADMIN_DIGEST_BURST_THRESHOLD
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_orders = max_orders
+        self.burst_threshold = burst_threshold
+        self._recent: Deque[float] = deque()
+        self._buffer: List[str] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add_order(
+        self,
+        order_id: int,
+        notification: str,
+        summary_line: str,
+        reply_markup: Optional[Any] = None
+    ):
+        """
+        Notify admins about a new order.
+
+        Args:
+            order_id: ID of the new order
+            notification: Full notification used when sending immediately
+            summary_line: Short line used inside a digest message
+            reply_markup: Keyboard attached to the immediate notification
+        """
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - self.interval:
+            self._recent.popleft()
+
+        # При низкой нагрузке отправляем уведомление сразу
+        if not self.enabled or (not self._buffer and len(self._recent) <= self.burst_threshold):
+            sent = [
+                (admin_id, outbound.send_message(admin_id, notification, reply_markup=reply_markup))
+                for admin_id in ADMIN_CHAT_IDS
+            ]
+            # Отправленные карточки обновляются на месте при назначении и доставке
+            task = asyncio.create_task(self._register_cards(order_id, sent))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+
+        logger.debug(f"Order #{order_id} added to admin digest")
+        self._buffer.append(summary_line)
+
+        if len(self._buffer) >= self.max_orders:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def flush(self):
+        """Send buffered orders as one summary message per admin"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        if not self._buffer:
+            return
+
+        lines, self._buffer = self._buffer, []
+        text = (
+            f"📦 <b>Новые заказы: {len(lines)}</b>\n\n"
+            + "\n".join(lines)
+            + "\n\n📋 Все ожидающие заказы: /orders"
+        )
+        for admin_id in ADMIN_CHAT_IDS:
+            outbound.send_message(admin_id, text)
+        logger.info(f"Admin digest with {len(lines)} orders sent")
+
+    async def _register_cards(self, order_id: int, sent: List[Tuple[int, asyncio.Future]]):
+        cards = []
+        for admin_id, future in sent:
+            message = await future
+            if message is not None:
+                cards.append({
+                    "order_id": order_id,
+                    "chat_id": admin_id,
+                    "message_id": message.message_id,
+                    "variant": "admin"
+                })
+        try:
+            await register_order_cards(cards)
+        except Exception as e:
+            logger.error(f"Error saving admin cards of order #{order_id}: {e}")
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.flush()
+
+
+# Общий буфер уведомлений о новых заказах
+admin_digest = AdminDigest()
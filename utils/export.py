@@ -0,0 +1,554 @@
+"""
+Streaming export of orders.
+Orders are converted to rows in small chunks on the event loop and written
+by a worker thread (Excel in openpyxl write-only mode, CSV, or Parquet with
+one row group per chunk), so memory stays flat regardless of the number of
+orders and polling is never blocked. The progress message is edited while
+the export runs. Sent exports are reused while the orders do not change, and
+old export files are removed. Exports of changes contain only orders created
+or changed since the previous export of the same admin, either as a separate
+file or merged into rolling monthly workbooks.
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+from openpyxl import Workbook, load_workbook
+
+from config import (
+    REPORT_EXPORT_DIR, EXPORT_CHUNK_SIZE, EXPORT_PROGRESS_INTERVAL, EXPORT_CACHE_FILE, EXPORT_CACHE_SIZE,
+    EXPORT_MAX_AGE_DAYS, EXPORT_MAX_TOTAL_MB, ROLE_SHOP, ROLE_COURIER
+)
+from storage.database import get_all_shops, get_all_couriers, get_all_orders
+from utils.timezone import get_date_dushanbe
+
+# pyarrow нужен только для экспорта в Parquet и может быть не установлен
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Колонки экспорта: заголовок и значение из заказа
+EXPORT_COLUMNS: List[Tuple[str, Callable[[Dict[str, Any]], Any]]] = [
+    ("№ заказа", lambda order: order["id"]),
+    ("Статус", lambda order: order["status"]),
+    ("Магазин", lambda order: order.get("shop_name", "Н/Д")),
+    ("Город", lambda order: order.get("city", "Н/Д")),
+    ("Адрес доставки", lambda order: order.get("delivery_address", "Н/Д")),
+    ("Телефон клиента", lambda order: order.get("customer_phone", "Н/Д")),
+    ("Сумма оплаты", lambda order: order.get("payment_amount", 0)),
+    ("Курьер", lambda order: order.get("courier_name", "Не назначен")),
+    ("Создан", lambda order: order.get("created_at", "Н/Д")),
+    ("Назначен", lambda order: order.get("assigned_at", "Н/Д")),
+    ("Доставлен", lambda order: order.get("delivered_at", "Н/Д")),
+]
+
+
+# Поля заказа для Parquet: отсутствующие значения остаются пустыми, а не "Н/Д"
+PARQUET_FIELDS = [
+    ("id", "int64"), ("status", "string"), ("shop_name", "string"), ("city", "string"),
+    ("delivery_address", "string"), ("customer_phone", "string"), ("payment_amount", "float64"),
+    ("courier_name", "string"), ("created_at", "string"), ("assigned_at", "string"),
+    ("delivered_at", "string"),
+]
+
+# Временные файлы выгрузок в работе не удаляются; старше этого возраста — остатки упавших выгрузок
+TEMP_FILE_MAX_AGE = 86400
+
+
+def temp_path(filepath: str) -> str:
+    """
+    Return a unique temporary path next to a file
+
+    Exports with the same format and filters have the same file name and may
+    run at the same time for different admins, so each writes its own file
+    and publishes it with os.replace.
+    """
+    return f"{filepath}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def order_row(order: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Convert an order to a row of the export"""
+    return tuple(getter(order) for _, getter in EXPORT_COLUMNS)
+
+
+def parquet_row(order: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Convert an order to a row of the Parquet export"""
+    return tuple(order.get(field) for field, _ in PARQUET_FIELDS)
+
+
+class XlsxWriter:
+    """Write-only Excel workbook that is filled row by row and saved atomically"""
+
+    row = staticmethod(order_row)
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Заказы")
+        self._sheet.append([header for header, _ in EXPORT_COLUMNS])
+
+    def write_rows(self, rows: Iterable[Tuple[Any, ...]]):
+        for row in rows:
+            self._sheet.append(row)
+
+    def close(self):
+        tmp_file = temp_path(self.filepath)
+        self._workbook.save(tmp_file)
+        os.replace(tmp_file, self.filepath)
+
+
+class CsvWriter:
+    """CSV file written row by row; the BOM lets Excel detect UTF-8"""
+
+    row = staticmethod(order_row)
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._tmp_file = temp_path(filepath)
+        self._file = open(self._tmp_file, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([header for header, _ in EXPORT_COLUMNS])
+
+    def write_rows(self, rows: Iterable[Tuple[Any, ...]]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_file, self.filepath)
+
+
+class ParquetWriter:
+    """Compressed columnar Parquet file with one row group per chunk"""
+
+    row = staticmethod(parquet_row)
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._tmp_file = temp_path(filepath)
+        self._schema = pa.schema([(field, pa.type_for_alias(dtype)) for field, dtype in PARQUET_FIELDS])
+        self._writer = pq.ParquetWriter(self._tmp_file, self._schema, compression="zstd")
+
+    def write_rows(self, rows: Iterable[Tuple[Any, ...]]):
+        columns = list(zip(*rows))
+        if columns:
+            self._writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+                schema=self._schema
+            ))
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_file, self.filepath)
+
+
+# Форматы экспорта; Parquet доступен только при установленном pyarrow
+EXPORT_FORMATS = {"xlsx": XlsxWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+class ExportProgress:
+    """Edits a message with the share of exported orders, at most once per interval"""
+
+    def __init__(self, message: Optional[Message], title: str, interval: float = EXPORT_PROGRESS_INTERVAL):
+        self.message = message
+        self.title = title
+        self.interval = interval
+        self._last_update = time.monotonic()
+
+    async def update(self, done: int, total: int, force: bool = False):
+        now = time.monotonic()
+        if self.message is None or (not force and now - self._last_update < self.interval):
+            return
+        self._last_update = now
+
+        percent = done * 100 // total if total else 100
+        try:
+            await self.message.edit_text(
+                f"⏳ <b>{self.title}</b>\n\nГотово: {percent}% ({done} из {total})",
+                parse_mode="HTML"
+            )
+        except TelegramBadRequest as e:
+            # Прогресс не критичен: сообщение могло быть удалено или не измениться
+            logger.debug(f"Export progress not updated: {e}")
+
+
+def export_path(filename: str) -> str:
+    """Return the path of an export file, creating the export directory"""
+    os.makedirs(REPORT_EXPORT_DIR, exist_ok=True)
+    return os.path.join(REPORT_EXPORT_DIR, filename)
+
+
+async def export_orders(
+    orders: List[Dict[str, Any]],
+    writer_factory: Callable[[str], Any],
+    filename: str,
+    progress: Optional[ExportProgress] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> str:
+    """
+    Export orders chunk by chunk
+
+    Rows of each chunk are built on the event loop, so every row reflects a
+    consistent state of its order, and written to the file in a worker thread.
+
+    Args:
+        orders: Orders to export; the list itself is not modified
+        writer_factory: Writer class (see EXPORT_FORMATS) created for the file path
+        filename: Name of the file in the export directory
+        progress: Progress message updated between chunks
+
+    Returns:
+        Path to the created file
+    """
+    filepath = export_path(filename)
+    writer = await asyncio.to_thread(writer_factory, filepath)
+    total = len(orders)
+
+    try:
+        for start in range(0, total, chunk_size):
+            rows = [writer.row(order) for order in orders[start:start + chunk_size]]
+            await asyncio.to_thread(writer.write_rows, rows)
+            if progress is not None:
+                await progress.update(min(start + chunk_size, total), total)
+        await asyncio.to_thread(writer.close)
+    except Exception:
+        logger.exception(f"Error exporting orders to {filepath}")
+        raise
+
+    logger.info(f"Exported {total} orders to {filepath}")
+    return filepath
+
+
+class ExportRequest:
+    """File format and order filters of an export"""
+
+    def __init__(
+        self,
+        file_format: str = "xlsx",
+        filters: Optional[Dict[str, Any]] = None,
+        labels=None,
+        delta: bool = False,
+        monthly: bool = False
+    ):
+        self.file_format = file_format
+        # Аргументы для storage.database.get_orders_filtered
+        self.filters: Dict[str, Any] = filters or {}
+        # Фильтры в том виде, в котором их ввел администратор (для имени файла)
+        self.labels: List[str] = labels or []
+        # Только заказы, измененные с прошлой выгрузки; monthly — с записью в месячные книги
+        self.delta = delta or monthly
+        self.monthly = monthly
+
+    def cache_key(self) -> str:
+        """Identify the export by its format and filters"""
+        filters = "&".join(f"{key}={value}" for key, value in sorted(self.filters.items()))
+        return f"{self.file_format}|{filters}"
+
+    def cursor_key(self, user_id: int) -> str:
+        """Key of the export cursor; monthly workbooks have their own cursor"""
+        return f"{user_id}:month" if self.monthly else str(user_id)
+
+    def filename(self) -> str:
+        """Build a file name describing the export"""
+        parts = ["orders_changes" if self.delta else "orders_report", get_date_dushanbe()]
+        parts += [re.sub(r"[^\w-]+", "_", label) for label in self.labels]
+        return f"{'_'.join(parts)}.{self.file_format}"
+
+
+async def _resolve_user(value: str, role: str) -> int:
+    """Find a shop or courier by ID or by the beginning of the name"""
+    if value.isdigit():
+        return int(value)
+
+    users = await (get_all_shops() if role == ROLE_SHOP else get_all_couriers())
+    value = value.lower()
+    found = [user for user in users if user["username"].split(" | ")[0].lower().startswith(value)]
+    if len(found) != 1:
+        kind = "Магазин" if role == ROLE_SHOP else "Курьер"
+        raise ValueError(f"{kind} «{value}» не найден" if not found else f"{kind} «{value}» найден несколько раз")
+    return found[0]["id"]
+
+
+async def parse_export_args(args: str) -> ExportRequest:
+    """
+    Parse arguments of the /export_orders command
+
+    Accepts a format (xlsx, csv, parquet) and filters as key=value:
+    from, to (YYYY-MM-DD), status, shop, courier (ID or beginning of the name)
+    and city, e.g. "/export_orders csv from=2024-05-01 status=delivered".
+    "delta" exports only orders changed since the previous export and "month"
+    merges them into rolling monthly workbooks; both work without filters.
+
+    Raises:
+        ValueError: With a message for the user if the arguments are wrong
+    """
+    request = ExportRequest()
+    for word in (args or "").split():
+        if word.lower() in ("delta", "month"):
+            request.delta = True
+            request.monthly = request.monthly or word.lower() == "month"
+            continue
+        if "=" not in word:
+            if word.lower() not in EXPORT_FORMATS:
+                raise ValueError(f"Неизвестный формат «{word}»")
+            request.file_format = word.lower()
+            continue
+
+        key, value = word.split("=", 1)
+        key = key.lower()
+        if not value:
+            raise ValueError(f"Не указано значение фильтра «{key}»")
+        if key in ("from", "to"):
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Дата «{value}» должна быть в формате ГГГГ-ММ-ДД")
+            request.filters["date_from" if key == "from" else "date_to"] = value
+        elif key == "status":
+            if value not in ("pending", "assigned", "delivered"):
+                raise ValueError("Статус должен быть pending, assigned или delivered")
+            request.filters["status"] = value
+        elif key == "shop":
+            request.filters["shop_id"] = await _resolve_user(value, ROLE_SHOP)
+        elif key == "courier":
+            request.filters["courier_id"] = await _resolve_user(value, ROLE_COURIER)
+        elif key == "city":
+            request.filters["city"] = value
+        else:
+            raise ValueError(f"Неизвестный фильтр «{key}»")
+        request.labels.append(f"{key}-{value}")
+
+    if request.delta and request.filters:
+        raise ValueError("Выгрузка изменений выполняется без фильтров")
+    if request.monthly and request.file_format != "xlsx":
+        raise ValueError("Месячная книга ведется только в формате xlsx")
+    if request.file_format == "parquet" and pa is None:
+        raise ValueError("Формат Parquet недоступен: не установлен пакет pyarrow")
+    return request
+
+
+def last_change_month(order: Dict[str, Any]) -> str:
+    """Return the month (YYYY-MM) an order was last created, assigned or delivered in"""
+    return max(order.get(field) or "" for field in ("created_at", "assigned_at", "delivered_at"))[:7]
+
+
+def monthly_workbook_path(user_id: int, month: str) -> str:
+    """Return the path of an admin's rolling workbook for a month"""
+    # Месячные книги лежат в отдельной папке, чтобы их не удаляла очистка старых выгрузок
+    directory = os.path.join(REPORT_EXPORT_DIR, "monthly")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"orders_{month}_{user_id}.xlsx")
+
+
+def update_monthly_workbook(filepath: str, rows: List[Tuple[Any, ...]]) -> int:
+    """
+    Merge order rows into a monthly workbook
+
+    Rows of orders that are already in the workbook are replaced in place and
+    new orders are appended, so the workbook always holds the latest state
+    of every order of the month.
+
+    Returns:
+        Number of orders in the workbook
+    """
+    if os.path.exists(filepath):
+        workbook = load_workbook(filepath)
+        sheet = workbook.active
+    else:
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = "Заказы"
+        sheet.append([header for header, _ in EXPORT_COLUMNS])
+
+    row_by_id = {cell.value: cell.row for (cell,) in sheet.iter_rows(min_row=2, max_col=1)}
+    for row in rows:
+        row_number = row_by_id.get(row[0])
+        if row_number is None:
+            sheet.append(row)
+            row_by_id[row[0]] = sheet.max_row
+            continue
+        for column, value in enumerate(row, start=1):
+            sheet.cell(row=row_number, column=column, value=value)
+
+    tmp_file = temp_path(filepath)
+    workbook.save(tmp_file)
+    os.replace(tmp_file, filepath)
+    return len(row_by_id)
+
+
+async def export_monthly(
+    orders: List[Dict[str, Any]],
+    user_id: int,
+    first_run: bool = False
+) -> List[Tuple[str, str, int, int]]:
+    """
+    Merge changed orders into the admin's monthly workbooks
+
+    Every order goes to the workbook of the month of its last change. A
+    workbook that does not exist yet (a new month or a deleted file) is
+    filled with all orders changed in its month. On the first run only the
+    current month is built instead of the whole history.
+
+    Args:
+        orders: Orders changed since the previous monthly export
+        user_id: Admin the workbooks belong to
+        first_run: True if the admin has no previous monthly export
+
+    Returns:
+        Month, path, number of merged orders and number of orders in the
+        workbook for every updated workbook
+    """
+    current_month = get_date_dushanbe()[:7]
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for order in orders:
+        month = last_change_month(order)
+        if first_run and month != current_month:
+            continue
+        by_month.setdefault(month, []).append(order)
+
+    updated = []
+    for month, month_orders in sorted(by_month.items()):
+        filepath = monthly_workbook_path(user_id, month)
+        if not os.path.exists(filepath):
+            month_orders = [order for order in await get_all_orders() if last_change_month(order) == month]
+        rows = [order_row(order) for order in month_orders]
+        total = await asyncio.to_thread(update_monthly_workbook, filepath, rows)
+        logger.info(f"Merged {len(rows)} orders into monthly workbook {filepath}")
+        updated.append((month, filepath, len(rows), total))
+    return updated
+
+
+class ExportCache:
+    """
+    Telegram file IDs of sent exports.
+
+    An export is identified by its format and filters and remembered with the
+    orders version it was built from. While the version is unchanged the file
+    is sent again by its file_id, without building or uploading it. Entries
+    are kept in a small JSON file, so they survive restarts.
+    """
+
+    def __init__(self, path: str = EXPORT_CACHE_FILE, max_size: int = EXPORT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = self._load()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self) -> "OrderedDict[str, Dict[str, Any]]":
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return OrderedDict(json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading export cache, starting empty: {e}")
+            return OrderedDict()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_file = f"{self.path}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            # Кэш не критичен: в худшем случае выгрузка будет построена заново
+            logger.error(f"Error writing export cache: {e}")
+
+    def get(self, key: str, version: int) -> Optional[Dict[str, Any]]:
+        """Return the cached export built from this orders version, if any"""
+        entry = self._entries.get(key)
+        if entry is None or entry["version"] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, version: int, file_id: str, orders_count: int):
+        """Remember a sent export"""
+        self._entries[key] = {"version": version, "file_id": file_id, "orders": orders_count}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._save()
+
+    def discard(self, key: str):
+        """Forget an export whose file_id no longer works"""
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache size and hit counters"""
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш отправленных выгрузок
+export_cache = ExportCache()
+
+
+def cleanup_exports(
+    directory: str = REPORT_EXPORT_DIR,
+    max_age_days: float = EXPORT_MAX_AGE_DAYS,
+    max_total_mb: float = EXPORT_MAX_TOTAL_MB,
+    now: Optional[float] = None
+) -> int:
+    """
+    Delete old export files
+
+    Files older than `max_age_days` are deleted first; if the rest is still
+    larger than `max_total_mb`, the oldest files are deleted until it fits.
+    Temporary files of exports in progress are skipped; only ones older than
+    TEMP_FILE_MAX_AGE are deleted. Cached exports stay usable, because
+    Telegram keeps the sent files.
+
+    Returns:
+        Number of deleted files
+    """
+    now = now or time.time()
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except FileNotFoundError:
+        return 0
+
+    files = sorted(
+        ((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries),
+        reverse=True
+    )
+    max_age = max_age_days * 86400
+    max_total = max_total_mb * 1024 * 1024
+
+    removed = 0
+    total = 0
+    # Идем от новых файлов к старым и удаляем все, что не помещается по возрасту или размеру
+    for mtime, size, path in files:
+        if path.endswith(".tmp"):
+            if now - mtime <= TEMP_FILE_MAX_AGE:
+                continue
+        elif now - mtime <= max_age and total + size <= max_total:
+            total += size
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.error(f"Error deleting export file {path}: {e}")
+
+    if removed:
+        logger.info(f"Deleted {removed} old export files")
+    return removed
@@ -0,0 +1,73 @@
+"""
+Background jobs of the bot.
+This module registers periodic jobs in the scheduler: deletion of old export
+files, the reminder to admins about orders that are still pending at the
+start of working hours, the day's summary sent to admins when working hours
+end, and saving the numbers of the day that has just closed.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from config import ADMIN_CHAT_IDS, EXPORT_CLEANUP_SCHEDULE, PENDING_REMINDER_ENABLED, DAILY_REPORT_ENABLED
+from keyboards.admin_kb import get_report_keyboard
+from storage.database import get_pending_orders_page
+from utils.export import cleanup_exports
+from utils.outbound import outbound
+from utils.reports import ReportRequest, report_engine, render_report
+from utils.scheduler import scheduler
+from utils.timezone import WORK_HOURS_START, WORK_HOURS_END, get_datetime_dushanbe
+
+logger = logging.getLogger(__name__)
+
+
+async def cleanup_old_exports(scheduled_at: datetime):
+    """Delete old export files in a worker thread"""
+    await asyncio.to_thread(cleanup_exports)
+
+
+async def remind_pending_orders(scheduled_at: datetime):
+    """Remind admins about pending orders"""
+    _, total = await get_pending_orders_page(0, 1)
+    if not total:
+        return
+
+    text = (
+        "⏰ <b>Начало рабочего дня</b>\n\n"
+        f"Заказов в ожидании назначения: {total}\n"
+        "Открыть список: /orders, назначить автоматически: /autoassign"
+    )
+    for admin_id in ADMIN_CHAT_IDS:
+        outbound.send_message(admin_id, text, parse_mode="HTML")
+    logger.info(f"Reminded admins about {total} pending orders")
+
+
+async def send_daily_report(scheduled_at: datetime):
+    """Send the summary by couriers of the day the job was scheduled for to admins"""
+    # Запуск, пропущенный во время остановки бота, может выполниться уже на следующий день
+    day = scheduled_at.date()
+    today = get_datetime_dushanbe().date()
+    period = "today" if day == today else "yesterday" if day == today - timedelta(days=1) else ""
+    request = ReportRequest(day, day, f"итоги дня {day.isoformat()}", period, "courier")
+    text = render_report(request, await report_engine.compute(request))
+    reply_markup = await get_report_keyboard(request.period, request.breakdown)
+    for admin_id in ADMIN_CHAT_IDS:
+        outbound.send_message(admin_id, text, parse_mode="HTML", reply_markup=reply_markup)
+    logger.info(f"Daily report for {day} sent to {len(ADMIN_CHAT_IDS)} admins")
+
+
+async def close_day(scheduled_at: datetime):
+    """Save the numbers of the day before the scheduled run, so /report serves it instantly"""
+    day = scheduled_at.date() - timedelta(days=1)
+    await report_engine.closed_days(day, day)
+
+
+def register_jobs():
+    """Add the bot's periodic jobs to the scheduler"""
+    scheduler.cron("export_cleanup", EXPORT_CLEANUP_SCHEDULE, cleanup_old_exports)
+    if PENDING_REMINDER_ENABLED:
+        scheduler.cron("pending_reminder", f"0 {WORK_HOURS_START} * * *", remind_pending_orders)
+    if DAILY_REPORT_ENABLED:
+        scheduler.cron("daily_report", f"0 {WORK_HOURS_END} * * *", send_daily_report)
+    # Снимок заказов обычно уже построен итогами дня, поэтому закрытие дня почти ничего не стоит
+    scheduler.cron("close_day", "5 0 * * *", close_day)
@@ -0,0 +1,283 @@
+"""
+Outbound message queue for the Telegram Bot API.
+This module serializes all notifications through global and per-chat token
+buckets so the bot stays within Telegram limits instead of losing messages.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE_PER_MINUTE,
+    OUTBOUND_MAX_RETRIES, OUTBOUND_MAX_QUEUE_SIZE
+)
+from utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Задержка между повторными попытками при временных ошибках (секунды)
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+
+@dataclass
+class _OutboundItem:
+    """Single Bot API call waiting in the queue"""
+    chat_id: int
+    method: str
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    attempts: int = 0
+    not_before: float = 0.0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class OutboundQueue:
+    """
+    Central queue for outgoing Bot API calls.
+
+    Calls are grouped per chat and delivered in FIFO order inside each chat.
+    Every call must acquire a token from the global bucket and from the
+    bucket of its chat; RetryAfter pauses the chat, transient network and
+    server errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        group_rate_per_minute: float = OUTBOUND_GROUP_RATE_PER_MINUTE,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        max_queue_size: int = OUTBOUND_MAX_QUEUE_SIZE
+    ):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.max_retries = max_retries
+        self.max_queue_size = max_queue_size
+
+        self._bot: Optional[Bot] = None
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chats: Dict[int, Deque[_OutboundItem]] = {}
+        self._busy_chats: Set[int] = set()
+        self._blocked_until: Dict[int, float] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._size = 0
+
+        # Счетчики для мониторинга
+        self.sent_count = 0
+        self.retry_count = 0
+        self.drop_count = 0
+
+    def start(self, bot: Bot):
+        """Start the background dispatcher loop"""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Outbound message queue started")
+
+    async def stop(self, timeout: float = 10.0):
+        """Try to drain the queue and stop the dispatcher loop"""
+        deadline = time.monotonic() + timeout
+        while (self._size or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._size:
+            logger.warning(f"Outbound queue stopped with {self._size} undelivered messages")
+        logger.info("Outbound message queue stopped")
+
+    def enqueue(self, chat_id: int, method: str, **kwargs) -> asyncio.Future:
+        """
+        Put a Bot API call into the queue.
+
+        Returns a future that resolves to the API result, or to None if the
+        call was dropped after all retries.
+        """
+        future = asyncio.get_running_loop().create_future()
+
+        if self._size >= self.max_queue_size:
+            self.drop_count += 1
+            logger.error(f"Outbound queue is full, dropping {method} to chat {chat_id}")
+            future.set_result(None)
+            return future
+
+        kwargs["chat_id"] = chat_id
+        item = _OutboundItem(chat_id=chat_id, method=method, kwargs=kwargs, future=future)
+        self._chats.setdefault(chat_id, deque()).append(item)
+        self._size += 1
+        self._notify()
+        return future
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue a text message"""
+        return self.enqueue(chat_id, "send_message", text=text, **kwargs)
+
+    def send_document(self, chat_id: int, document: Any, **kwargs) -> asyncio.Future:
+        """Queue a document upload"""
+        return self.enqueue(chat_id, "send_document", document=document, **kwargs)
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue an edit of an existing message"""
+        return self.enqueue(chat_id, "edit_message_text", message_id=message_id, text=text, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id: int, message_id: int, **kwargs) -> asyncio.Future:
+        """Queue an edit of the inline keyboard of an existing message"""
+        return self.enqueue(chat_id, "edit_message_reply_markup", message_id=message_id, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depth and delivery counters"""
+        return {
+            "queued": self._size,
+            "in_flight": len(self._in_flight),
+            "chats": len(self._chats),
+            "sent": self.sent_count,
+            "retried": self.retry_count,
+            "dropped": self.drop_count,
+        }
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID принадлежат группам и каналам
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, 1)
+        return bucket
+
+    def _pick_ready_chat(self, now: float):
+        """Return (chat_id, 0) for a chat ready to send or (None, wait_seconds)"""
+        min_wait = None
+        for chat_id, items in self._chats.items():
+            if chat_id in self._busy_chats:
+                continue
+
+            blocked_until = self._blocked_until.get(chat_id)
+            if blocked_until is not None and blocked_until <= now:
+                del self._blocked_until[chat_id]
+                blocked_until = None
+
+            wait = max(
+                (blocked_until or 0) - now,
+                items[0].not_before - now,
+                self._chat_bucket(chat_id).time_until_available(now),
+                0
+            )
+            if wait == 0:
+                return chat_id, 0.0
+            if min_wait is None or wait < min_wait:
+                min_wait = wait
+
+        return None, min_wait
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            chat_id, wait = self._pick_ready_chat(now)
+
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self._global_bucket.time_until_available(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            self._global_bucket.consume(now)
+            self._chat_bucket(chat_id).consume(now)
+
+            items = self._chats[chat_id]
+            item = items.popleft()
+            if not items:
+                del self._chats[chat_id]
+            self._size -= 1
+
+            # Пока сообщение отправляется, остальные сообщения этого чата ждут,
+            # чтобы сохранить порядок доставки
+            self._busy_chats.add(chat_id)
+            task = asyncio.create_task(self._deliver(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+            # Периодически очищаем корзины неактивных чатов
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets = {
+                    cid: bucket for cid, bucket in self._chat_buckets.items()
+                    if cid in self._chats or not bucket.is_full(now)
+                }
+
+    async def _deliver(self, item: _OutboundItem):
+        try:
+            result = await getattr(self._bot, item.method)(**item.kwargs)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control for chat {item.chat_id}, retry in {e.retry_after}s")
+            self._blocked_until[item.chat_id] = time.monotonic() + e.retry_after
+            self.retry_count += 1
+            self._requeue(item)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._drop(item, e)
+            else:
+                delay = min(RETRY_BASE_DELAY * 2 ** (item.attempts - 1), RETRY_MAX_DELAY)
+                item.not_before = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                self.retry_count += 1
+                logger.warning(
+                    f"Transient error on {item.method} to chat {item.chat_id} "
+                    f"(attempt {item.attempts}/{self.max_retries}): {e}"
+                )
+                self._requeue(item)
+        except TelegramAPIError as e:
+            # Ошибки вроде "bot was blocked by the user" повторять бессмысленно
+            self._drop(item, e)
+        except Exception as e:
+            logger.exception(f"Unexpected error on {item.method} to chat {item.chat_id}")
+            self._drop(item, e)
+        else:
+            self.sent_count += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._busy_chats.discard(item.chat_id)
+            self._notify()
+
+    def _requeue(self, item: _OutboundItem):
+        self._chats.setdefault(item.chat_id, deque()).appendleft(item)
+        self._size += 1
+
+    def _drop(self, item: _OutboundItem, error: Exception):
+        self.drop_count += 1
+        logger.error(f"Dropped {item.method} to chat {item.chat_id}: {error}")
+        if not item.future.done():
+            item.future.set_result(None)
+
+
+# Общая очередь исходящих сообщений бота
+outbound = OutboundQueue()
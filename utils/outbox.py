@@ -0,0 +1,201 @@
+"""
+Background delivery of the persistent notification outbox.
+Notifications are written to the database together with the order state
+change and are sent here, so a restart never loses them and handlers do not
+wait for the Telegram API. A notification may also edit a live order card
+that was sent earlier instead of sending a new message.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from config import OUTBOX_POLL_INTERVAL
+from storage.database import get_due_outbox_entries, complete_outbox_entries
+from utils.outbound import outbound
+from utils.cards import render_order_card
+
+logger = logging.getLogger(__name__)
+
+
+def make_notification(
+    chat_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    parse_mode: Optional[str] = "HTML",
+    message_id: Optional[int] = None,
+    order_id: Optional[int] = None,
+    variant: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Build an outbox notification that can be stored in the database
+    
+    Args:
+        chat_id: Recipient chat ID
+        text: Message text
+        reply_markup: Inline keyboard of the message
+        parse_mode: Parse mode of the text
+        message_id: Edit this message instead of sending a new one
+        order_id: Remember the sent message as a live card of this order
+        variant: Card variant (admin, courier, shop) used with order_id
+    """
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": parse_mode,
+        "reply_markup": reply_markup.model_dump(exclude_none=True) if reply_markup else None,
+        "message_id": message_id,
+        "card": {"order_id": order_id, "variant": variant} if order_id is not None else None,
+    }
+
+
+def make_card_updates(
+    order: Dict[str, Any],
+    cards: List[Dict[str, Any]],
+    variants: Dict[str, str],
+    skip_message: Optional[Tuple[int, int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Build notifications that edit the live cards of an order
+    
+    Args:
+        order: Order with its new status (may be a preview that is not saved yet)
+        cards: Remembered card messages from get_order_cards()
+        variants: Render variant for each card variant; cards of other variants are left as is
+        skip_message: (chat_id, message_id) of a message that was already updated
+    """
+    notifications = []
+    for card in cards:
+        render_variant = variants.get(card["variant"])
+        if render_variant is None or (card["chat_id"], card["message_id"]) == skip_message:
+            continue
+        notifications.append(make_notification(
+            card["chat_id"],
+            render_order_card(order, render_variant, cached=False),
+            message_id=card["message_id"],
+            order_id=order["id"],
+            variant=card["variant"]
+        ))
+    return notifications
+
+
+class OutboxWorker:
+    """Periodically sends due outbox entries through the outbound queue"""
+
+    def __init__(self, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._in_flight: Set[int] = set()
+        self._delivered: List[int] = []
+        self._failed: List[int] = []
+        self._cards: List[Dict[str, Any]] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        """Start the worker loop"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Outbox worker started")
+
+    async def stop(self):
+        """Stop the worker loop and save results of finished deliveries"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_results()
+        logger.info("Outbox worker stopped")
+
+    def wake(self):
+        """Check the outbox right away instead of waiting for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._flush_results()
+                await self._dispatch_due()
+            except Exception as e:
+                logger.error(f"Error processing outbox: {e}", exc_info=True)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch_due(self):
+        for entry in await get_due_outbox_entries():
+            if entry["id"] in self._in_flight:
+                continue
+
+            self._in_flight.add(entry["id"])
+            task = asyncio.create_task(self._deliver(entry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, entry: Dict[str, Any]):
+        reply_markup = None
+        if entry.get("reply_markup"):
+            reply_markup = InlineKeyboardMarkup.model_validate(entry["reply_markup"])
+
+        kwargs = {"parse_mode": entry.get("parse_mode"), "reply_markup": reply_markup}
+        result = None
+        try:
+            if entry.get("message_id"):
+                result = await outbound.edit_message_text(
+                    entry["chat_id"], entry["message_id"], entry["text"], **kwargs
+                )
+                if result is None:
+                    # Карточку нельзя изменить (например, сообщение удалено) — отправляем новую
+                    logger.info(f"Cannot edit card {entry['message_id']} in chat {entry['chat_id']}, sending a new one")
+            if result is None:
+                result = await outbound.send_message(entry["chat_id"], entry["text"], **kwargs)
+        except asyncio.CancelledError:
+            self._in_flight.discard(entry["id"])
+            raise
+
+        if result is None:
+            self._failed.append(entry["id"])
+        else:
+            self._delivered.append(entry["id"])
+            # Запоминаем новое сообщение как карточку заказа
+            card = entry.get("card")
+            message_id = getattr(result, "message_id", None)
+            if card and message_id and message_id != entry.get("message_id"):
+                self._cards.append({
+                    **card,
+                    "chat_id": entry["chat_id"],
+                    "message_id": message_id,
+                    "replaces": entry.get("message_id")
+                })
+        self.wake()
+
+    async def _flush_results(self):
+        if not self._delivered and not self._failed and not self._cards:
+            return
+
+        delivered, self._delivered = self._delivered, []
+        failed, self._failed = self._failed, []
+        cards, self._cards = self._cards, []
+        try:
+            await complete_outbox_entries(delivered, failed, cards)
+        except Exception:
+            # Вернем результаты обратно, чтобы сохранить их при следующей попытке
+            self._delivered.extend(delivered)
+            self._failed.extend(failed)
+            self._cards.extend(cards)
+            raise
+        self._in_flight.difference_update(delivered)
+        self._in_flight.difference_update(failed)
+
+
+# Общий обработчик очереди уведомлений
+outbox_worker = OutboxWorker()
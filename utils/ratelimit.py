@@ -0,0 +1,50 @@
+"""
+Rate limiting primitives.
+This module contains a token bucket used to stay within Telegram API limits.
+"""
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Classic token bucket.
+
+    Tokens are refilled continuously at `rate` tokens per second up to
+    `capacity`. Each consumed token allows one action.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def time_until_available(self, now: Optional[float] = None) -> float:
+        """Return how many seconds to wait before one token is available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: Optional[float] = None) -> bool:
+        """Consume one token if available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now: Optional[float] = None) -> bool:
+        """Check whether the bucket has been idle long enough to refill completely"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity
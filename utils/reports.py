@@ -0,0 +1,404 @@
+"""
+Delivery reports.
+This module builds reports for arbitrary date ranges with breakdowns by
+courier, shop or city. Orders are converted once into a columnar pandas
+snapshot, which is reused until the orders change, and all counting is done
+with vectorized operations in a worker thread. Days before today no longer
+change, so their numbers are computed once, saved to a file, and reports for
+closed days are assembled from them without touching the orders. The file
+keeps the orders version it was checked at; a saved day is dropped and
+recomputed once an order created or delivered on that day changes.
+"""
+import asyncio
+import html
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import REPORT_BREAKDOWN_LIMIT, DAILY_REPORTS_FILE, DAILY_REPORTS_KEPT
+from storage.database import (
+    get_all_orders, get_orders_version, get_order_status_counts, get_changed_order_dates
+)
+from storage.indexes import ORDER_STATUSES, DATETIME_FORMAT, normalize_city
+from utils.cards import format_payment
+from utils.timezone import get_datetime_dushanbe
+
+logger = logging.getLogger(__name__)
+
+# Периоды отчета: ключ -> название (русские слова тоже принимаются в команде)
+PERIODS = {
+    "today": "Сегодня",
+    "yesterday": "Вчера",
+    "week": "Последние 7 дней",
+    "month": "Текущий месяц",
+}
+_PERIOD_ALIASES = {"сегодня": "today", "вчера": "yesterday", "неделя": "week", "месяц": "month"}
+
+# Разбивки отчета: ключ -> (колонка снимка, заголовок)
+BREAKDOWNS = {
+    "courier": ("courier", "По курьерам"),
+    "shop": ("shop", "По магазинам"),
+    "city": ("city", "По городам"),
+}
+_BREAKDOWN_ALIASES = {"курьер": "courier", "курьеры": "courier", "магазин": "shop",
+                      "магазины": "shop", "город": "city", "города": "city"}
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class ReportRequest:
+    """Date range and breakdown of a report"""
+
+    def __init__(self, start: date, end: date, title: str, period: str = "", breakdown: str = ""):
+        self.start = start
+        self.end = end
+        self.title = title
+        self.period = period
+        self.breakdown = breakdown
+
+    @property
+    def key(self) -> str:
+        """Period name or date range ("YYYY-MM-DD_YYYY-MM-DD") used in callback data"""
+        return self.period or f"{self.start.isoformat()}_{self.end.isoformat()}"
+
+
+def period_range(period: str, today: Optional[date] = None) -> Tuple[date, date]:
+    """Return the first and last date of a named period"""
+    today = today or get_datetime_dushanbe().date()
+    if period == "today":
+        return today, today
+    if period == "yesterday":
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    if period == "week":
+        return today - timedelta(days=6), today
+    if period == "month":
+        return today.replace(day=1), today
+    raise ValueError(f"Unknown report period: {period}")
+
+
+def make_request(period: str = "today", breakdown: str = "") -> ReportRequest:
+    """Build a report request for a named period"""
+    start, end = period_range(period)
+    return ReportRequest(start, end, PERIODS[period], period, breakdown)
+
+
+def parse_report_args(args: str) -> ReportRequest:
+    """
+    Parse arguments of the /report command
+
+    Accepts a period (today, yesterday, week, month), one date or two dates
+    in YYYY-MM-DD format, and optionally a breakdown (courier, shop, city),
+    e.g. "/report week courier" or "/report 2024-05-01 2024-05-31 shop".
+
+    Raises:
+        ValueError: If the arguments cannot be parsed
+    """
+    period = ""
+    breakdown = ""
+    dates: List[date] = []
+
+    for word in (args or "").lower().split():
+        word = _PERIOD_ALIASES.get(word, _BREAKDOWN_ALIASES.get(word, word))
+        if word in PERIODS and not period and not dates:
+            period = word
+        elif word in BREAKDOWNS and not breakdown:
+            breakdown = word
+        elif _DATE_RE.match(word) and not period and len(dates) < 2:
+            dates.append(datetime.strptime(word, "%Y-%m-%d").date())
+        else:
+            raise ValueError(f"Unexpected report argument: {word}")
+
+    if not dates:
+        return make_request(period or "today", breakdown)
+
+    start, end = dates[0], dates[-1]
+    if start > end:
+        start, end = end, start
+    title = start.isoformat() if start == end else f"{start.isoformat()} — {end.isoformat()}"
+    return ReportRequest(start, end, title, breakdown=breakdown)
+
+
+def build_snapshot(orders: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Convert orders into a columnar snapshot used by all reports"""
+    frame = pd.DataFrame.from_records(
+        orders,
+        columns=["id", "status", "shop_name", "courier_name", "city", "payment_amount",
+                 "created_at", "delivered_at"]
+    )
+    snapshot = pd.DataFrame({
+        "status": frame["status"].fillna("pending").astype("category"),
+        "shop": frame["shop_name"].fillna("Н/Д").astype("category"),
+        "courier": frame["courier_name"].fillna("Не назначен").astype("category"),
+        "amount": pd.to_numeric(frame["payment_amount"], errors="coerce").fillna(0).to_numpy(np.float64),
+        "created": pd.to_datetime(frame["created_at"], format=DATETIME_FORMAT, errors="coerce"),
+        "delivered": pd.to_datetime(frame["delivered_at"], format=DATETIME_FORMAT, errors="coerce"),
+    })
+
+    # Один и тот же город пишут по-разному ("г. Душанбе", "душанбе"); нормализуем уникальные значения
+    cities = frame["city"].fillna("").astype("category")
+    names = {city: normalize_city(city).capitalize() or "Н/Д" for city in cities.cat.categories}
+    snapshot["city"] = cities.map(names).astype("category")
+    return snapshot
+
+
+def compute_report(snapshot: pd.DataFrame, request: ReportRequest) -> Dict[str, Any]:
+    """
+    Compute report numbers for a snapshot
+
+    Returns:
+        Dict with current status counts, orders created and delivered in the
+        range, the delivered amount and an optional breakdown
+    """
+    start = pd.Timestamp(request.start)
+    end = pd.Timestamp(request.end) + pd.Timedelta(days=1)
+
+    created = (snapshot["created"] >= start) & (snapshot["created"] < end)
+    delivered = (
+        (snapshot["status"] == "delivered").to_numpy()
+        & (snapshot["delivered"] >= start).to_numpy()
+        & (snapshot["delivered"] < end).to_numpy()
+    )
+
+    status_counts = snapshot["status"].value_counts()
+    result: Dict[str, Any] = {
+        "total": len(snapshot),
+        "statuses": {status: int(status_counts.get(status, 0)) for status in ORDER_STATUSES},
+        "created": int(created.sum()),
+        "delivered": int(delivered.sum()),
+        "amount": float(snapshot["amount"].to_numpy()[delivered].sum()),
+        "breakdown": [],
+    }
+
+    if request.breakdown:
+        column = BREAKDOWNS[request.breakdown][0]
+        grouped = (
+            snapshot.loc[delivered]
+            .groupby(column, observed=True)["amount"]
+            .agg(["size", "sum"])
+            .sort_values(["size", "sum"], ascending=False)
+        )
+        result["breakdown"] = [
+            (str(name), int(row["size"]), float(row["sum"]))
+            for name, row in grouped.head(REPORT_BREAKDOWN_LIMIT).iterrows()
+        ]
+        result["breakdown_rest"] = max(len(grouped) - REPORT_BREAKDOWN_LIMIT, 0)
+    return result
+
+
+def compute_daily(snapshot: pd.DataFrame, start: date, end: date) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute numbers of every day of a range with full breakdowns
+
+    Returns:
+        Dict YYYY-MM-DD -> orders created, delivered and the delivered amount
+        of the day, and for every breakdown name -> [delivered, amount]
+    """
+    start_ts = pd.Timestamp(start)
+    end_ts = pd.Timestamp(end) + pd.Timedelta(days=1)
+    days = {
+        day.strftime("%Y-%m-%d"): {
+            "created": 0, "delivered": 0, "amount": 0.0,
+            "breakdowns": {key: {} for key in BREAKDOWNS},
+        }
+        for day in pd.date_range(start, end)
+    }
+
+    created = snapshot["created"]
+    created = created[(created >= start_ts) & (created < end_ts)].dt.normalize()
+    for day, count in created.value_counts().items():
+        days[day.strftime("%Y-%m-%d")]["created"] = int(count)
+
+    delivered = snapshot.loc[
+        (snapshot["status"] == "delivered").to_numpy()
+        & (snapshot["delivered"] >= start_ts).to_numpy()
+        & (snapshot["delivered"] < end_ts).to_numpy()
+    ]
+    day_keys = delivered["delivered"].dt.normalize()
+    for day, row in delivered.groupby(day_keys)["amount"].agg(["size", "sum"]).iterrows():
+        summary = days[day.strftime("%Y-%m-%d")]
+        summary["delivered"] = int(row["size"])
+        summary["amount"] = float(row["sum"])
+
+    for key, (column, _) in BREAKDOWNS.items():
+        grouped = delivered.groupby([day_keys, column], observed=True)["amount"].agg(["size", "sum"])
+        for (day, name), row in grouped.iterrows():
+            days[day.strftime("%Y-%m-%d")]["breakdowns"][key][str(name)] = [int(row["size"]), float(row["sum"])]
+    return days
+
+
+def summarize_days(days: List[Dict[str, Any]], breakdown: str = "") -> Dict[str, Any]:
+    """Add up numbers of several days computed by compute_daily()"""
+    result: Dict[str, Any] = {
+        "created": sum(day["created"] for day in days),
+        "delivered": sum(day["delivered"] for day in days),
+        "amount": sum(day["amount"] for day in days),
+        "breakdown": [],
+    }
+    if breakdown:
+        merged: Dict[str, List[float]] = {}
+        for day in days:
+            for name, (count, amount) in day["breakdowns"][breakdown].items():
+                total = merged.setdefault(name, [0, 0.0])
+                total[0] += count
+                total[1] += amount
+        rows = sorted(merged.items(), key=lambda item: (-item[1][0], -item[1][1], item[0]))
+        result["breakdown"] = [(name, int(count), amount) for name, (count, amount) in rows[:REPORT_BREAKDOWN_LIMIT]]
+        result["breakdown_rest"] = max(len(rows) - REPORT_BREAKDOWN_LIMIT, 0)
+    return result
+
+
+class ReportEngine:
+    """
+    Keeps the order snapshot of the latest orders version and computes reports from it.
+
+    Numbers of closed days (before today in Dushanbe) are kept in a file, so
+    reports that end before today are served without building the snapshot.
+    Late changes of past orders (a delivery marked the next day, cleared data)
+    drop the saved numbers of their days.
+    """
+
+    def __init__(self, path: str = DAILY_REPORTS_FILE, days_kept: int = DAILY_REPORTS_KEPT):
+        self.path = path
+        self.days_kept = days_kept
+        self._version: Optional[int] = None
+        self._snapshot: Optional[pd.DataFrame] = None
+        self._lock = asyncio.Lock()
+        # Версия заказов, на которой сохраненные итоги дней проверены последний раз
+        self._days_version, self._days = self._load()
+
+    def _load(self) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0, {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading daily reports, starting empty: {e}")
+            return 0, {}
+        # В файле старого формата нет версии: такие итоги не проверить, они считаются заново
+        if "days" not in data:
+            return 0, {}
+        return data.get("version", 0), data["days"]
+
+    def _save(self, version: int, days: Dict[str, Dict[str, Any]]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_file = f"{self.path}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"version": version, "days": days}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            # Итоги дней можно пересчитать, поэтому ошибка записи не критична
+            logger.error(f"Error writing daily reports: {e}")
+
+    async def snapshot(self) -> pd.DataFrame:
+        """Return the snapshot of current orders, rebuilding it only after changes"""
+        async with self._lock:
+            version = await get_orders_version()
+            if self._snapshot is None or version != self._version:
+                # Список копируется, чтобы поток не видел добавления новых заказов
+                orders = list(await get_all_orders())
+                self._snapshot = await asyncio.to_thread(build_snapshot, orders)
+                self._version = version
+                logger.debug(f"Report snapshot rebuilt for {len(orders)} orders")
+            return self._snapshot
+
+    async def _drop_changed_days(self):
+        """Drop saved days that have orders changed since the days were checked"""
+        version, dates = await get_changed_order_dates(self._days_version)
+        if version == self._days_version:
+            return
+
+        if dates is None:
+            # Изменения неизвестны (файл менялся вне бота): не доверяем ни одному дню
+            dropped = list(self._days)
+        else:
+            dropped = [key for key in dates if key in self._days]
+        self._days_version = version
+        # Версию без удаленных дней можно не записывать: изменения с прежней версии
+        # отмечены в заказах и после перезапуска будут проверены снова
+        if dropped:
+            for key in dropped:
+                del self._days[key]
+            await asyncio.to_thread(self._save, version, dict(self._days))
+            logger.info(f"Daily reports dropped after order changes: {', '.join(sorted(dropped))}")
+
+    async def closed_days(self, start: date, end: date) -> List[Dict[str, Any]]:
+        """
+        Return numbers of closed days, computing and saving the missing ones
+
+        Args:
+            start: First day of the range
+            end: Last day of the range; must be before today
+        """
+        await self._drop_changed_days()
+        keys = [day.strftime("%Y-%m-%d") for day in pd.date_range(start, end)]
+        days = {key: self._days[key] for key in keys if key in self._days}
+        missing = [key for key in keys if key not in days]
+        if missing:
+            snapshot = await self.snapshot()
+            computed = await asyncio.to_thread(
+                compute_daily, snapshot, date.fromisoformat(missing[0]), date.fromisoformat(missing[-1])
+            )
+            days.update(computed)
+
+            # Храним только последние days_kept дней; более старые считаются при каждом запросе
+            self._days.update(computed)
+            for key in sorted(self._days)[:-self.days_kept]:
+                del self._days[key]
+            await asyncio.to_thread(self._save, self._days_version, dict(self._days))
+            logger.info(f"Daily reports computed for {len(computed)} days from {missing[0]}")
+        return [days[key] for key in keys]
+
+    async def compute(self, request: ReportRequest) -> Dict[str, Any]:
+        """Compute a report for the current data"""
+        if request.end < get_datetime_dushanbe().date():
+            # Закрытые дни уже не меняются: отчет собирается из готовых итогов дней,
+            # а текущие статусы берутся из индексов базы
+            days = await self.closed_days(request.start, request.end)
+            counts = await get_order_status_counts()
+            return {
+                "total": sum(counts.values()),
+                "statuses": {status: counts.get(status, 0) for status in ORDER_STATUSES},
+                **summarize_days(days, request.breakdown),
+            }
+
+        snapshot = await self.snapshot()
+        return await asyncio.to_thread(compute_report, snapshot, request)
+
+
+# Общий движок отчетов
+report_engine = ReportEngine()
+
+
+def render_report(request: ReportRequest, result: Dict[str, Any]) -> str:
+    """Render report numbers as an HTML message"""
+    statuses = result["statuses"]
+    response = (
+        f"📊 <b>Отчет о доставках: {request.title}</b>\n\n"
+        f"Создано заказов: {result['created']}\n"
+        f"Доставлено: {result['delivered']}\n"
+        f"💰 Сумма доставленных: {format_payment(result['amount'])} сомони\n\n"
+        f"<b>Сейчас</b>\n"
+        f"Всего заказов: {result['total']}\n"
+        f"В ожидании: {statuses['pending']}\n"
+        f"Назначено: {statuses['assigned']}\n"
+        f"Доставлено: {statuses['delivered']}\n"
+    )
+
+    if request.breakdown:
+        response += f"\n<b>{BREAKDOWNS[request.breakdown][1]}</b> (доставлено · сумма)\n"
+        if not result["breakdown"]:
+            response += "Нет доставок за период\n"
+        for name, count, amount in result["breakdown"]:
+            response += f"• {html.escape(name)}: {count} · {format_payment(amount)}\n"
+        if result.get("breakdown_rest"):
+            response += f"…и еще {result['breakdown_rest']}\n"
+    return response
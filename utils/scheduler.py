@@ -0,0 +1,282 @@
+"""
+In-process scheduler of background jobs.
+Jobs run by cron expressions in Dushanbe time or once at a given moment. Due
+times are kept in a heap, so the scheduler sleeps until the nearest job
+instead of polling every job. Next run times are saved to a small JSON file:
+a run missed while the bot was stopped happens right after the start. Every
+run is a separate task, so a slow job delays neither other jobs nor update
+handling. A job gets the moment it was scheduled for, so a run caught up
+late still works on the right day.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from config import SCHEDULER_STATE_FILE
+from utils.timezone import DUSHANBE_TIMEZONE, get_datetime_dushanbe
+
+logger = logging.getLogger(__name__)
+
+# Задача получает запланированное время запуска (по Душанбе), а не фактическое
+JobFunc = Callable[[datetime], Awaitable[Any]]
+
+# Планировщик просыпается не реже этого интервала (на случай перевода системных часов)
+MAX_SLEEP = 60
+
+# Допустимые значения полей cron: минута, час, день месяца, месяц, день недели (0 — воскресенье)
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> FrozenSet[int]:
+    """Parse one cron field: *, numbers, ranges (a-b), lists (a,b) and steps (*/n, a-b/n)"""
+    values: Set[int] = set()
+    for part in field.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = end = int(part)
+        # "5/15" означает "с 5-й минуты каждые 15 минут"
+        if step and part != "*" and "-" not in part:
+            end = high
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron value out of range {low}-{high}: {field}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """Cron expression "minute hour day month weekday" evaluated in Dushanbe time"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_cron_field(field, low, high) for field, (low, high) in zip(fields, _CRON_FIELDS)
+        )
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+        self._sorted_hours = sorted(self.hours)
+        self._sorted_minutes = sorted(self.minutes)
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        # В cron воскресенье — 0, в Python — 6
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        # Как в cron: если заданы и день месяца, и день недели, подходит любой из них
+        if not self._any_day and not self._any_weekday:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the first matching minute strictly after the moment"""
+        moment = moment.astimezone(DUSHANBE_TIMEZONE).replace(tzinfo=None)
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+
+        # Перебираем дни, а внутри подходящего дня — только подходящие часы и минуты
+        for _ in range(366 * 8):
+            if self._day_matches(day):
+                for hour in self._sorted_hours:
+                    for minute in self._sorted_minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return DUSHANBE_TIMEZONE.localize(candidate)
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+
+class Job:
+    """Scheduled coroutine function; a job without a schedule runs once"""
+
+    def __init__(self, name: str, func: JobFunc, schedule: Optional[CronSchedule], next_run: float):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.next_run = next_run
+        self.task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    """
+    Runs cron and one-shot jobs from a heap of due times.
+
+    The heap may hold outdated entries of rescheduled or cancelled jobs; they
+    are recognized by a due time that differs from the job's and skipped.
+    """
+
+    def __init__(self, path: str = SCHEDULER_STATE_FILE):
+        self.path = path
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        # Сохраненные времена запуска используются один раз, при регистрации задачи
+        self._saved: Dict[str, float] = self._load()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+        # Счетчики для мониторинга
+        self.run_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+
+    def _load(self) -> Dict[str, float]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading scheduler state, starting empty: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_file = f"{self.path}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({name: job.next_run for name, job in self._jobs.items()}, f)
+            os.replace(tmp_file, self.path)
+        except OSError as e:
+            logger.error(f"Error writing scheduler state: {e}")
+
+    def _push(self, job: Job):
+        heapq.heappush(self._heap, (job.next_run, next(self._counter), job.name))
+        self._wakeup.set()
+
+    def cron(self, name: str, expression: str, func: JobFunc) -> Job:
+        """
+        Add or replace a job that runs by a cron expression
+
+        If the saved next run of the job is earlier than the next run by the
+        expression, the run was missed while the bot was stopped and the job
+        runs right away.
+        """
+        schedule = CronSchedule(expression)
+        next_run = schedule.next_after(get_datetime_dushanbe()).timestamp()
+        saved = self._saved.pop(name, None)
+        if saved is not None and saved < next_run:
+            next_run = saved
+        return self._add(Job(name, func, schedule, next_run))
+
+    def once(self, name: str, run_at: datetime, func: JobFunc) -> Job:
+        """Add or replace a job that runs once at the given moment"""
+        return self._add(Job(name, func, None, run_at.timestamp()))
+
+    def _add(self, job: Job) -> Job:
+        previous = self._jobs.get(job.name)
+        if previous is not None:
+            job.task = previous.task
+        self._jobs[job.name] = job
+        self._push(job)
+        self._save()
+        logger.info(f"Job {job.name} scheduled at {datetime.fromtimestamp(job.next_run, DUSHANBE_TIMEZONE)}")
+        return job
+
+    def cancel(self, name: str) -> bool:
+        """Remove a job; a run in progress is not interrupted"""
+        if self._jobs.pop(name, None) is None:
+            return False
+        self._save()
+        return True
+
+    def next_run(self, name: str) -> Optional[datetime]:
+        """Return the next run of a job in Dushanbe time"""
+        job = self._jobs.get(name)
+        return datetime.fromtimestamp(job.next_run, DUSHANBE_TIMEZONE) if job else None
+
+    def start(self):
+        """Start the scheduler loop"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Scheduler started with {len(self._jobs)} jobs")
+
+    async def stop(self):
+        """Stop the scheduler loop and cancel runs in progress"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        logger.info("Scheduler stopped")
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                run_at, _, name = heapq.heappop(self._heap)
+                job = self._jobs.get(name)
+                if job is None or job.next_run != run_at:
+                    continue
+                self._launch(job, run_at)
+                if job.schedule is None:
+                    del self._jobs[name]
+                else:
+                    job.next_run = job.schedule.next_after(get_datetime_dushanbe()).timestamp()
+                    heapq.heappush(self._heap, (job.next_run, next(self._counter), name))
+                self._save()
+
+            timeout = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else MAX_SLEEP
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def _launch(self, job: Job, run_at: float):
+        # Если предыдущий запуск еще идет, этот пропускается, а не запускается параллельно
+        if job.task is not None and not job.task.done():
+            self.skipped_count += 1
+            logger.warning(f"Job {job.name} is still running, skipping this run")
+            return
+        job.task = asyncio.create_task(
+            self._execute(job, datetime.fromtimestamp(run_at, DUSHANBE_TIMEZONE))
+        )
+        self._running.add(job.task)
+        job.task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: Job, scheduled_at: datetime):
+        started = time.monotonic()
+        try:
+            await job.func(scheduled_at)
+            self.run_count += 1
+            logger.info(f"Job {job.name} finished in {time.monotonic() - started:.1f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed_count += 1
+            logger.exception(f"Job {job.name} failed")
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of jobs and run counters"""
+        return {
+            "jobs": len(self._jobs),
+            "runs": self.run_count,
+            "failed": self.failed_count,
+            "skipped": self.skipped_count,
+        }
+
+
+# Общий планировщик фоновых задач
+scheduler = Scheduler()
@@ -0,0 +1,133 @@
+"""
+Anti-flood throttling of incoming messages and button presses.
+Every user has a token bucket sized by role, and heavy commands (order lists,
+reports, exports) have an additional bucket per user and command. A throttled
+user gets one warning until they are allowed again; further requests are
+dropped without any work.
+"""
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import THROTTLE_ROLE_RATES, THROTTLE_COMMAND_RATES
+from storage.database import get_user_role
+from utils.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+# Корзины пользователей, которые давно ничего не отправляли, периодически удаляются
+MAX_BUCKETS = 10000
+
+
+def _command_key(event: TelegramObject) -> Optional[str]:
+    """Return the heavy command a message invokes, if any"""
+    if not isinstance(event, Message) or not event.text:
+        return None
+    text = event.text.strip()
+    if text.startswith("/"):
+        # "/report@bot_name 2024-01-01" -> "/report"
+        text = text.split()[0].split("@")[0]
+    return text if text in THROTTLE_COMMAND_RATES else None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer middleware for messages and callback queries that drops floods"""
+
+    def __init__(self):
+        # Корзина пользователя создается заново, если его роль изменилась
+        self._user_buckets: Dict[Tuple[int, Optional[str]], TokenBucket] = {}
+        self._command_buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        # Пользователи, которым уже отправлено предупреждение
+        self._warned: Dict[int, float] = {}
+
+        # Счетчики для мониторинга
+        self.throttled_count = 0
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        buckets = [await self._user_bucket(user.id)]
+        command = _command_key(event)
+        if command is not None:
+            buckets.append(self._command_bucket(user.id, command))
+
+        wait = max(bucket.time_until_available(now) for bucket in buckets)
+        if wait > 0:
+            self.throttled_count += 1
+            await self._reject(event, user.id, wait)
+            return None
+
+        for bucket in buckets:
+            bucket.consume(now)
+        self._warned.pop(user.id, None)
+
+        if len(self._user_buckets) > MAX_BUCKETS:
+            self._prune(now)
+        return await handler(event, data)
+
+    async def _user_bucket(self, user_id: int) -> TokenBucket:
+        role = await get_user_role(user_id)
+        key = (user_id, role)
+        bucket = self._user_buckets.get(key)
+        if bucket is None:
+            rate, capacity = THROTTLE_ROLE_RATES.get(role, THROTTLE_ROLE_RATES[None])
+            bucket = self._user_buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _command_bucket(self, user_id: int, command: str) -> TokenBucket:
+        key = (user_id, command)
+        bucket = self._command_buckets.get(key)
+        if bucket is None:
+            rate, capacity = THROTTLE_COMMAND_RATES[command]
+            bucket = self._command_buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    async def _reject(self, event: TelegramObject, user_id: int, wait: float):
+        text = f"⏳ Слишком много запросов. Повторите через {int(wait) + 1} сек."
+
+        # Кнопкам отвечаем всегда, иначе у пользователя будут "часики" на кнопке
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+            return
+
+        # Одно предупреждение на серию запросов, остальные просто отбрасываются
+        if user_id in self._warned:
+            return
+        self._warned[user_id] = time.monotonic()
+        if isinstance(event, Message):
+            logger.info(f"User {user_id} throttled for {wait:.1f}s")
+            await event.answer(text)
+
+    def _prune(self, now: float):
+        self._user_buckets = {
+            key: bucket for key, bucket in self._user_buckets.items()
+            if not bucket.is_full(now)
+        }
+        self._command_buckets = {
+            key: bucket for key, bucket in self._command_buckets.items()
+            if not bucket.is_full(now)
+        }
+        active_users = {user_id for user_id, _ in self._user_buckets}
+        self._warned = {
+            user_id: warned_at for user_id, warned_at in self._warned.items()
+            if user_id in active_users
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of tracked users and throttled requests"""
+        return {
+            "users": len(self._user_buckets),
+            "throttled": self.throttled_count,
+        }
+
+
+# Общий ограничитель частоты запросов
+throttling = ThrottlingMiddleware()
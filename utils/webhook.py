@@ -0,0 +1,168 @@
+"""
+Webhook mode for the bot.
+This module runs a small aiohttp server that receives updates from Telegram,
+checks the secret token, skips repeated updates and feeds the rest to the
+dispatcher. On shutdown it stops accepting updates and waits for the ones
+already being processed.
+"""
+import asyncio
+import logging
+import secrets
+import signal
+from collections import OrderedDict
+from typing import Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_DEDUP_SIZE, WEBHOOK_DRAIN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp server that receives updates from Telegram.
+
+    Telegram is answered right after an update is accepted and the update is
+    processed in a background task. Telegram resends updates it did not get
+    an answer for, so the IDs of recent updates are remembered and repeats
+    are ignored.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        url: str = WEBHOOK_URL,
+        secret: str = WEBHOOK_SECRET,
+        dedup_size: int = WEBHOOK_DEDUP_SIZE,
+        drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.url = url
+        # Без заданного секрета генерируем случайный при каждом запуске
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.dedup_size = dedup_size
+        self.drain_timeout = drain_timeout
+
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self._draining = False
+
+        # Счетчики для мониторинга
+        self.received_count = 0
+        self.duplicate_count = 0
+        self.rejected_count = 0
+
+    def create_app(self) -> web.Application:
+        """Create the aiohttp application with the webhook route"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Receive one update from Telegram"""
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected_count += 1
+            logger.warning(f"Webhook request with invalid secret token from {request.remote}")
+            return web.Response(status=401)
+
+        if self._draining:
+            # Telegram повторит запрос позже, когда бот снова запустится
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.error(f"Invalid webhook update: {e}")
+            return web.Response(status=400)
+
+        if update.update_id in self._seen:
+            self.duplicate_count += 1
+            logger.debug(f"Duplicate update {update.update_id} skipped")
+            return web.Response()
+
+        self._seen[update.update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+
+        self.received_count += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception(f"Error processing update {update.update_id}")
+
+    async def start(self):
+        """Start the HTTP server and register the webhook in Telegram"""
+        await self.dp.emit_startup(bot=self.bot)
+
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+        if self.url:
+            await self.bot.set_webhook(
+                f"{self.url.rstrip('/')}{self.path}",
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types()
+            )
+            logger.info(f"Webhook set to {self.url.rstrip('/')}{self.path}")
+        else:
+            # Локальный режим: обновления можно отправлять вручную через curl
+            logger.warning("WEBHOOK_URL is empty, webhook is not registered in Telegram")
+
+    async def stop(self):
+        """Stop accepting updates and wait for updates being processed"""
+        self._draining = True
+
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} updates to finish")
+            done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            if pending:
+                logger.warning(f"{len(pending)} updates were not finished before shutdown")
+                for task in pending:
+                    task.cancel()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        await self.dp.emit_shutdown(bot=self.bot)
+        logger.info("Webhook server stopped")
+
+    async def serve_forever(self):
+        """Run the server until SIGINT or SIGTERM"""
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        await self.start()
+        try:
+            await stop_event.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            await self.stop()
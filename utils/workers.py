@@ -0,0 +1,114 @@
+"""
+Sharded processing of incoming updates.
+Updates are distributed over a fixed number of worker tasks by user ID, so
+updates of one user are handled strictly one after another (FSM flows stay
+consistent) while different users are served in parallel and a slow handler
+only delays the users of its own shard.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class UpdateWorkerPool(BaseMiddleware):
+    """
+    Outer middleware for dp.update that hands updates to sharded workers.
+
+    The middleware only puts the update into the queue of its shard and
+    returns; when a queue is full it waits, which slows down reading new
+    updates instead of growing memory without bound.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, queue_size: int = UPDATE_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+
+        # Счетчики для мониторинга
+        self.processed_count = 0
+        self.failed_count = 0
+
+    def start(self):
+        """Start worker tasks"""
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+        logger.info(f"Update worker pool started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 30.0):
+        """Wait until queued updates are processed and stop the workers"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Update worker pool stopped with {self.queued()} unprocessed updates")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Update worker pool stopped")
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not self._tasks:
+            # Пул не запущен (например, при тестовом вызове) — обрабатываем сразу
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        shard_key = user.id if user else chat.id if chat else 0
+        await self._queues[shard_key % self.workers].put((handler, event, data))
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            handler, event, data = await queue.get()
+            self._busy += 1
+            try:
+                # Состояние FSM было прочитано при постановке в очередь; предыдущие
+                # обновления пользователя могли его изменить
+                state = data.get("state")
+                if state is not None:
+                    data["raw_state"] = await state.get_state()
+                await handler(event, data)
+                self.processed_count += 1
+            except Exception:
+                self.failed_count += 1
+                logger.exception("Error processing update")
+            finally:
+                self._busy -= 1
+                queue.task_done()
+
+    def queued(self) -> int:
+        """Number of updates waiting in all queues"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> Dict[str, int]:
+        """Return queue depths and processing counters"""
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+        }
+
+
+# Общий пул обработки входящих обновлений
+update_pool = UpdateWorkerPool()